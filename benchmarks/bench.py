@@ -0,0 +1,278 @@
+"""
+Benchmarks of the parse, resolution change, rasterize, decode, merge and
+write paths on synthetic files.
+
+Run from the repository root::
+
+    python -m benchmarks.bench --save results.json
+    python -m benchmarks.bench --compare results.json
+
+Every stage is timed ``--repeat`` times and reports the best and median
+time, the throughput in notes per second and the peak memory allocated
+during one extra run under ``tracemalloc``.
+"""
+from benchmarks.synth import SCENARIOS, generate
+from ugly_midi import MidiObject, get_instrument_from_piano_roll
+from ugly_midi import merge_instruments, __version__
+import numpy as np
+from importlib import metadata
+import argparse
+import collections
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+# ticks per beat of the piano rolls
+ROLL_RESOLUTION = 24
+
+
+class Context(object):
+    """A synthetic file shared by the stages of a scenario"""
+
+    def __init__(self, name, seed, tmp_dir):
+        self.name = name
+        self.data = generate(name, seed)
+        self.path = os.path.join(tmp_dir, name + '.mid')
+        self.out_path = os.path.join(tmp_dir, name + '_out.mid')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+        midi = self.load()
+        self.n_notes = sum(len(i.get_note_array()) for i in midi.instruments)
+        self.n_instruments = len(midi.instruments)
+
+    def load(self, resolution=None):
+        return MidiObject.from_bytes(self.data, resolution=resolution)
+
+
+def _first_roll(ctx):
+    midi = ctx.load(ROLL_RESOLUTION)
+    instr = [i for i in midi.instruments if not i.is_drum][0]
+    return instr.get_piano_roll(dtype=np.uint8)
+
+
+def _loop_piano_roll(instr):
+    """The per-note loop ``get_piano_roll`` ran before it was vectorized,
+    timed as ``piano_roll_loop`` against ``piano_roll_float64``"""
+    if not instr.notes:
+        return np.array([[] * 128])
+    end_time = instr.get_end_time()
+    piano_roll = np.zeros((end_time, 128))
+    for n in instr.notes:
+        piano_roll[n.start:min(n.end, end_time), n.pitch] += n.velocity
+    return piano_roll
+
+
+def _write_mido(ctx, midi):
+    midi.write(ctx.out_path)
+
+
+# name -> (setup, run), setup(ctx) returns the argument of run(ctx, arg) and
+# isn't timed
+STAGES = collections.OrderedDict([
+    ('parse_mido', (lambda ctx: None,
+                    lambda ctx, _: MidiObject(ctx.path))),
+    ('parse_native', (lambda ctx: None,
+                      lambda ctx, _: MidiObject(ctx.path, engine='native'))),
+    ('change_resolution',
+     (lambda ctx: ctx.load(),
+      lambda ctx, midi: midi.change_resolution(
+          max(midi.resolution // 4, 1)))),
+    ('piano_roll',
+     (lambda ctx: ctx.load(ROLL_RESOLUTION),
+      lambda ctx, midi: [
+          i.get_piano_roll(dtype=np.uint8) for i in midi.instruments
+      ])),
+    ('piano_roll_float64',
+     (lambda ctx: ctx.load(ROLL_RESOLUTION),
+      lambda ctx, midi: [i.get_piano_roll() for i in midi.instruments])),
+    ('piano_roll_loop',
+     (lambda ctx: ctx.load(ROLL_RESOLUTION),
+      lambda ctx, midi: [_loop_piano_roll(i) for i in midi.instruments])),
+    ('decode_roll', (_first_roll,
+                     lambda ctx, roll: get_instrument_from_piano_roll(roll))),
+    ('merge_instruments',
+     (lambda ctx: [i for i in ctx.load().instruments if not i.is_drum],
+      lambda ctx, instrs: merge_instruments(*instrs))),
+    ('write_mido', (lambda ctx: ctx.load(), _write_mido)),
+    ('write_native', (lambda ctx: ctx.load(),
+                      lambda ctx, midi: midi.to_bytes())),
+])
+
+
+def run_stage(ctx, stage, repeat, memory=True):
+    """Times ``stage`` on ``ctx``.
+    Returns
+    -------
+    result : dict
+        ``best`` and ``median`` seconds, ``notes_per_s`` at the best time and
+        ``peak_bytes`` allocated by one run, or None if ``memory`` is False.
+    """
+    setup, run = STAGES[stage]
+    times = []
+    for _ in range(repeat):
+        arg = setup(ctx)
+        gc.collect()
+        start = time.perf_counter()
+        run(ctx, arg)
+        times.append(time.perf_counter() - start)
+        del arg
+
+    peak = None
+    if memory:
+        arg = setup(ctx)
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        run(ctx, arg)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        del arg
+
+    best = min(times)
+    return {
+        'best': best,
+        'median': float(np.median(times)),
+        'notes_per_s': ctx.n_notes / best if best > 0 else None,
+        'peak_bytes': peak,
+    }
+
+
+def run(scenarios, stages, repeat=5, seed=0, memory=True, log=None):
+    """Runs ``stages`` on ``scenarios``, returns the results as a dict ready
+    to be saved as JSON"""
+    results = collections.OrderedDict()
+    files = collections.OrderedDict()
+    tmp_dir = tempfile.mkdtemp(prefix='ugly_midi_bench_')
+    try:
+        for name in scenarios:
+            ctx = Context(name, seed, tmp_dir)
+            files[name] = {
+                'bytes': len(ctx.data),
+                'notes': ctx.n_notes,
+                'instruments': ctx.n_instruments,
+            }
+            results[name] = collections.OrderedDict()
+            for stage in stages:
+                with warnings.catch_warnings():
+                    # the writers warn about files with over 15 instruments
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    result = run_stage(ctx, stage, repeat, memory)
+                results[name][stage] = result
+                if log is not None:
+                    log(_format_result(name, stage, result))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'ugly_midi': __version__,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'mido': metadata.version('mido'),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'seed': seed,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'files': files,
+        'results': results,
+    }
+
+
+def _format_result(name, stage, result):
+    peak = result['peak_bytes']
+    return '{:<12} {:<18} {:>9.4f}s {:>12} notes/s {:>10}'.format(
+        name, stage, result['best'],
+        '{:.3g}'.format(result['notes_per_s'] or 0),
+        '' if peak is None else '{:.1f} MB'.format(peak / 1e6))
+
+
+def compare(results, baseline, threshold=0.1):
+    """Compares the best times of ``results`` to ``baseline``.
+    Parameters
+    ----------
+    results, baseline : dict
+        Outputs of ``run``.
+    threshold : float
+        Relative slowdown above which a stage counts as a regression.
+    Returns
+    -------
+    rows : list
+        ``(scenario, stage, baseline seconds, seconds, ratio)`` of the
+        stages found in both.
+    regressions : list
+        The rows with ``ratio > 1 + threshold``.
+    """
+    rows = []
+    for name, stages in results['results'].items():
+        for stage, result in stages.items():
+            old = baseline['results'].get(name, {}).get(stage)
+            if old is None or not old['best']:
+                continue
+            rows.append((name, stage, old['best'], result['best'],
+                         result['best'] / old['best']))
+    regressions = [row for row in rows if row[4] > 1 + threshold]
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--scenario',
+        action='append',
+        choices=list(SCENARIOS),
+        help='scenario to run, can be repeated (default: all)')
+    parser.add_argument(
+        '--stage',
+        action='append',
+        choices=list(STAGES),
+        help='stage to run, can be repeated (default: all)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-memory',
+        action='store_true',
+        help='skip the tracemalloc run')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument(
+        '--compare', help='baseline JSON file to compare the results to')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.1,
+        help='relative slowdown reported as a regression (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    results = run(args.scenario or list(SCENARIOS),
+                  args.stage or list(STAGES), args.repeat, args.seed,
+                  not args.no_memory, log=print)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('seed') != args.seed:
+            print('warning: the baseline was generated with seed {}'.format(
+                baseline['meta'].get('seed')))
+        rows, regressions = compare(results, baseline, args.threshold)
+        print()
+        for name, stage, old, new, ratio in rows:
+            print('{:<12} {:<18} {:>9.4f}s -> {:>9.4f}s {:>+7.1%}{}'.format(
+                name, stage, old, new, ratio - 1,
+                '  REGRESSION' if ratio > 1 + args.threshold else ''))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
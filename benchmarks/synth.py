@@ -0,0 +1,95 @@
+"""
+Deterministic synthetic midi files for the benchmarks
+"""
+from ugly_midi.smf import encode_header, encode_meta_events
+from ugly_midi.smf import encode_channel_events, tempo_payload
+from ugly_midi.smf import time_signature_payload, META_SET_TEMPO
+from ugly_midi.smf import META_TIME_SIGNATURE
+import numpy as np
+import collections
+
+Scenario = collections.namedtuple('Scenario', [
+    'n_tracks', 'notes_per_track', 'mean_gap', 'mean_duration', 'chord_size',
+    'n_tempos', 'n_controls', 'resolution'
+])
+"""Parameters of a synthetic file. ``mean_gap`` and ``mean_duration`` are
+in beats, ``chord_size`` is the number of notes starting together and
+``n_controls`` the number of control changes and pitch bends per track."""
+
+SCENARIOS = collections.OrderedDict([
+    ('sparse', Scenario(4, 500, 2., 1., 1, 1, 0, 480)),
+    ('dense', Scenario(8, 20000, 0.125, 0.5, 4, 1, 2000, 480)),
+    ('many_tracks', Scenario(96, 1000, 0.25, 0.5, 1, 1, 100, 480)),
+    ('long', Scenario(4, 50000, 0.5, 0.5, 1, 1, 500, 96)),
+    ('tempo_heavy', Scenario(4, 5000, 0.25, 0.5, 2, 5000, 0, 480)),
+])
+
+
+def _track_events(rng, scenario, channel, program):
+    """``(ticks, status, data1, data2)`` of one track, sorted by tick"""
+    s = scenario
+    n_chords = max(s.notes_per_track // s.chord_size, 1)
+    gaps = rng.exponential(s.mean_gap * s.resolution, n_chords)
+    onsets = np.cumsum(np.round(gaps).astype(np.int64))
+    start = np.repeat(onsets, s.chord_size)
+    duration = np.round(
+        rng.exponential(s.mean_duration * s.resolution, len(start)))
+    end = start + np.maximum(duration.astype(np.int64), 1)
+    pitch = np.clip(
+        np.round(rng.normal(60, 12, len(start))), 0, 127).astype(np.int64)
+    velocity = rng.randint(1, 128, len(start))
+
+    n = len(start)
+    control_ticks = np.sort(rng.randint(0, end.max() + 1, s.n_controls))
+    is_bend = rng.rand(s.n_controls) < .5
+    # note-offs go before the note-ons of the same tick
+    ticks = np.concatenate([[0], end, start, control_ticks])
+    status = np.concatenate([
+        [0xc0 | channel],
+        np.full(n, 0x80 | channel),
+        np.full(n, 0x90 | channel),
+        np.where(is_bend, 0xe0 | channel, 0xb0 | channel),
+    ])
+    data1 = np.concatenate([[program], pitch, pitch,
+                            rng.randint(0, 128, s.n_controls)])
+    data2 = np.concatenate([[0],
+                            np.zeros(n, dtype=np.int64), velocity,
+                            rng.randint(0, 128, s.n_controls)])
+    order = np.argsort(ticks, kind='stable')
+    return ticks[order], status[order], data1[order], data2[order]
+
+
+def generate(scenario, seed=0):
+    """Encodes a synthetic type 1 midi file.
+    Parameters
+    ----------
+    scenario : Scenario or str
+        Parameters of the file, or the name of one of ``SCENARIOS``.
+    seed : int
+        Seed of the random generator. The same seed gives the same bytes.
+    Returns
+    -------
+    data : bytes
+        The midi file.
+    """
+    if not isinstance(scenario, Scenario):
+        scenario = SCENARIOS[scenario]
+    rng = np.random.RandomState(seed)
+    tracks = []
+    end = 1
+    for i in range(scenario.n_tracks):
+        # channels are shared by tracks past the 16th, as in large files
+        channel = i % 16
+        program = 0 if channel == 9 else rng.randint(0, 128)
+        events = _track_events(rng, scenario, channel, program)
+        end = max(end, events[0][-1])
+        tracks.append(encode_channel_events(*events))
+
+    tempo_ticks = np.sort(rng.randint(1, end + 1, scenario.n_tempos - 1))
+    tempos = rng.randint(300000, 1000000, scenario.n_tempos)
+    meta = [(0, META_TIME_SIGNATURE, time_signature_payload(4, 4))]
+    meta += [(tick, META_SET_TEMPO, tempo_payload(int(tempo)))
+             for tick, tempo in zip([0] + tempo_ticks.tolist(), tempos)]
+    return b''.join(
+        [encode_header(1, len(tracks) + 1, scenario.resolution),
+         encode_meta_events(meta)] + tracks)
@@ -0,0 +1,117 @@
+"""
+Midi files written with mido for the tests
+"""
+from mido import MidiFile, MidiTrack, Message, MetaMessage, bpm2tempo
+import io
+import random
+
+
+def build_midi(tracks, midi_type=1, ticks_per_beat=96):
+    """Bytes of a midi file.
+    Parameters
+    ----------
+    tracks : list
+        One list of messages per track, with absolute ticks as ``time``.
+        Every list is stable sorted by tick.
+    """
+    midi = MidiFile(type=midi_type, ticks_per_beat=ticks_per_beat)
+    for messages in tracks:
+        track = MidiTrack()
+        tick = 0
+        for msg in sorted(messages, key=lambda m: m.time):
+            track.append(msg.copy(time=msg.time - tick))
+            tick = msg.time
+        midi.tracks.append(track)
+    buf = io.BytesIO()
+    midi.save(file=buf)
+    return buf.getvalue()
+
+
+def _random_messages(rng, n_events, max_tick):
+    """Channel events crowded on a few channels and pitches, so that
+    pairing edge cases happen often"""
+    messages = []
+    for _ in range(n_events):
+        tick = rng.randrange(max_tick)
+        channel = rng.choice((0, 1, 9))
+        note = rng.randrange(60, 64)
+        kind = rng.random()
+        if kind < 0.35:
+            messages.append(
+                Message('note_on', channel=channel, note=note,
+                        velocity=rng.randrange(1, 128), time=tick))
+        elif kind < 0.55:
+            messages.append(
+                Message('note_off', channel=channel, note=note,
+                        velocity=rng.randrange(128), time=tick))
+        elif kind < 0.65:
+            messages.append(
+                Message('note_on', channel=channel, note=note, velocity=0,
+                        time=tick))
+        elif kind < 0.72:
+            messages.append(
+                Message('program_change', channel=channel,
+                        program=rng.randrange(4), time=tick))
+        elif kind < 0.82:
+            messages.append(
+                Message('control_change', channel=channel,
+                        control=rng.choice((1, 7, 64)),
+                        value=rng.randrange(128), time=tick))
+        elif kind < 0.88:
+            messages.append(
+                Message('pitchwheel', channel=channel,
+                        pitch=rng.randrange(-8192, 8192), time=tick))
+        elif kind < 0.92:
+            messages.append(
+                Message('polytouch', channel=channel, note=note,
+                        value=rng.randrange(128), time=tick))
+        elif kind < 0.96:
+            messages.append(
+                Message('aftertouch', channel=channel,
+                        value=rng.randrange(128), time=tick))
+        else:
+            messages.append(
+                Message('sysex', data=[rng.randrange(128) for _ in range(4)],
+                        time=tick))
+    return messages
+
+
+def _random_meta(rng, max_tick):
+    messages = [
+        MetaMessage('set_tempo', tempo=bpm2tempo(rng.uniform(40, 200)),
+                    time=0),
+        MetaMessage('time_signature', numerator=4, denominator=4, time=0),
+    ]
+    for _ in range(rng.randrange(4)):
+        tick = rng.randrange(max_tick)
+        messages.append(
+            rng.choice([
+                MetaMessage('set_tempo',
+                            tempo=bpm2tempo(rng.uniform(40, 200)),
+                            time=tick),
+                MetaMessage('time_signature',
+                            numerator=rng.choice((2, 3, 5, 7)),
+                            denominator=rng.choice((4, 8)),
+                            time=tick),
+                MetaMessage('key_signature',
+                            key=rng.choice(('C', 'Eb', 'F#m')),
+                            time=tick),
+            ]))
+    return messages
+
+
+def random_midi(seed, midi_type=1, n_tracks=3, n_events=300, max_tick=2000):
+    """Bytes of a random midi file, see ``_random_messages``. Type 0 files
+    have a single track, type 1 files a meta track and ``n_tracks`` named
+    tracks."""
+    rng = random.Random(seed)
+    ticks_per_beat = rng.choice((96, 220, 480))
+    if midi_type == 0:
+        return build_midi(
+            [_random_meta(rng, max_tick) +
+             _random_messages(rng, n_events, max_tick)], 0, ticks_per_beat)
+    tracks = [_random_meta(rng, max_tick)]
+    for i in range(n_tracks):
+        tracks.append([MetaMessage('track_name', name='track {}'.format(i))] +
+                      _random_messages(rng, n_events, max_tick))
+    return build_midi(tracks, 1, ticks_per_beat)
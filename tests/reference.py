@@ -0,0 +1,139 @@
+"""
+Event by event reference of how ``MidiObject`` reads a file, written
+directly against mido messages to check the vectorized loaders.
+"""
+from mido import MidiFile, tempo2bpm
+import collections
+import io
+
+CHANNEL_EVENTS = ('note_on', 'note_off', 'program_change', 'control_change',
+                  'pitchwheel', 'polytouch', 'aftertouch')
+
+
+class ReferenceInstrument(object):
+
+    def __init__(self, program, is_drum, name):
+        self.program = program
+        self.is_drum = is_drum
+        self.name = name
+        self.notes = []
+        self.control_changes = []
+        self.pitch_bends = []
+        self.aftertouches = []
+
+    def add_control(self, msg):
+        if msg.type == 'control_change':
+            self.control_changes.append((msg.time, msg.control, msg.value))
+        elif msg.type == 'pitchwheel':
+            self.pitch_bends.append((msg.time, msg.pitch))
+        elif msg.type == 'polytouch':
+            self.aftertouches.append((msg.time, msg.note, msg.value))
+        else:
+            self.aftertouches.append((msg.time, -1, msg.value))
+
+
+def reference_load(data):
+    """Reads the bytes of a midi file the way ``MidiObject`` does, one event
+    at a time.
+    Returns
+    -------
+    midi : dict
+        See ``snapshot``.
+    """
+    midi_data = MidiFile(file=io.BytesIO(data))
+    track_names = {}
+    events = []
+    for track_idx, track in enumerate(midi_data.tracks):
+        tick = 0
+        for msg in track:
+            tick += msg.time
+            msg = msg.copy(time=tick)
+            if msg.type == 'track_name':
+                track_names[track_idx] = msg.name
+            elif msg.type in CHANNEL_EVENTS:
+                events.append((track_idx, msg))
+    # playback order, simultaneous events in track order
+    events.sort(key=lambda e: e[1].time)
+
+    meta = collections.defaultdict(list)
+    tick = 0
+    for msg in midi_data.tracks[0]:
+        tick += msg.time
+        if msg.type == 'set_tempo':
+            meta['tempo_changes'].append((tempo2bpm(msg.tempo), tick))
+        elif msg.type == 'key_signature':
+            meta['key_signatures'].append((msg.key, tick))
+        elif msg.type == 'time_signature':
+            meta['time_signatures'].append(
+                (msg.numerator, msg.denominator, tick))
+
+    programs = [0] * 16
+    instruments = collections.OrderedDict()
+    stragglers = collections.defaultdict(list)
+    note_ons = {}
+
+    def get_instrument(program, channel, track):
+        key = (program, channel, track)
+        if key not in instruments:
+            instr = ReferenceInstrument(program, channel == 9,
+                                        track_names.get(track, ''))
+            for msg in stragglers[(channel, track)]:
+                instr.add_control(msg)
+            instruments[key] = instr
+        return instruments[key]
+
+    for track, msg in events:
+        if msg.type == 'program_change':
+            programs[msg.channel] = msg.program
+        elif msg.type == 'note_on' and msg.velocity > 0:
+            note_ons[(track, msg.channel, msg.note)] = (
+                programs[msg.channel], msg.velocity, msg.time)
+        elif msg.type in ('note_on', 'note_off'):
+            key = (track, msg.channel, msg.note)
+            if key not in note_ons:
+                continue
+            program, velocity, start = note_ons[key]
+            instr = get_instrument(program, msg.channel, track)
+            if msg.time == start:
+                continue
+            instr.notes.append((start, msg.time, msg.note, velocity))
+            del note_ons[key]
+        else:
+            key = (programs[msg.channel], msg.channel, track)
+            if key in instruments:
+                instruments[key].add_control(msg)
+            else:
+                stragglers[(msg.channel, track)].append(msg)
+
+    return {
+        'resolution': midi_data.ticks_per_beat,
+        'tempo_changes': meta['tempo_changes'],
+        'key_signatures': meta['key_signatures'],
+        'time_signatures': meta['time_signatures'],
+        'instruments': [(i.program, i.is_drum, i.name, i.notes,
+                         i.control_changes, i.pitch_bends, i.aftertouches)
+                        for i in instruments.values()],
+    }
+
+
+def snapshot(midi):
+    """Plain Python view of a ``MidiObject``, comparable with ``==``.
+    Returns
+    -------
+    midi : dict
+        ``resolution``, the meta events as tuples and ``instruments`` as
+        ``(program, is_drum, name, notes, control_changes, pitch_bends,
+        aftertouches)`` tuples, with notes as ``(start, end, pitch,
+        velocity)``.
+    """
+    return {
+        'resolution': midi.resolution,
+        'tempo_changes': [(t.bpm, t.time) for t in midi.tempo_changes],
+        'key_signatures': [(k.key, k.time) for k in midi.key_signatures],
+        'time_signatures': [(t.numerator, t.denominator, t.time)
+                            for t in midi.time_signatures],
+        'instruments': [(i.program, i.is_drum, i.name,
+                         i.get_note_array().tolist(),
+                         i.control_changes.tolist(), i.pitch_bends.tolist(),
+                         i.aftertouches.tolist()) for i in midi.instruments],
+    }
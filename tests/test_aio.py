@@ -0,0 +1,94 @@
+"""
+Loading and writing through ``AsyncMidiIO``.
+"""
+from tests.generate import random_midi
+from tests.reference import snapshot
+from ugly_midi import AsyncMidiIO, MidiObject
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import pytest
+import threading
+
+# the random files have more instruments than channels
+pytestmark = pytest.mark.filterwarnings(
+    'ignore:Synthesizing with more than 15 instruments:RuntimeWarning')
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(2, thread_name_prefix='midi_io') as executor:
+        yield executor
+
+
+def test_load(tmp_path, executor):
+    data = random_midi(0)
+    path = str(tmp_path / 'a.mid')
+    with open(path, 'wb') as f:
+        f.write(data)
+    midi_io = AsyncMidiIO(executor)
+    from_path = asyncio.run(midi_io.load(path))
+    from_bytes = asyncio.run(midi_io.load(data, 24))
+    assert snapshot(from_path) == snapshot(MidiObject(path))
+    assert snapshot(from_bytes) == snapshot(MidiObject.from_bytes(data, 24))
+
+
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_load_many(executor, batch_size):
+    files = [random_midi(seed) for seed in range(5)]
+    midi_io = AsyncMidiIO(executor, max_concurrency=2, batch_size=batch_size)
+    # the same instance is used by two event loops
+    for _ in range(2):
+        loaded = asyncio.run(midi_io.load_many(files))
+        assert [snapshot(m) for m in loaded] == [
+            snapshot(MidiObject.from_bytes(data)) for data in files
+        ]
+
+
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_load_error(executor, batch_size):
+    midi_io = AsyncMidiIO(executor, batch_size=batch_size)
+
+    async def run():
+        return await asyncio.gather(
+            midi_io.load(random_midi(0)), midi_io.load(b'MThd garbage'),
+            return_exceptions=True)
+
+    good, bad = asyncio.run(run())
+    assert isinstance(good, MidiObject)
+    assert isinstance(bad, Exception)
+
+
+@pytest.mark.parametrize('engine', ['mido', 'native'])
+def test_write(tmp_path, executor, engine):
+    midi = MidiObject.from_bytes(random_midi(0))
+    expected = midi.to_bytes(engine)
+    midi_io = AsyncMidiIO(executor)
+    path = str(tmp_path / 'out.mid')
+    buf = io.BytesIO()
+    asyncio.run(midi_io.write(midi, path, engine))
+    asyncio.run(midi_io.write(midi, buf, engine))
+    with open(path, 'rb') as f:
+        assert f.read() == expected
+    assert buf.getvalue() == expected
+
+
+def test_write_file_encodes_in_executor(executor, monkeypatch):
+    threads = []
+    to_bytes = MidiObject.to_bytes
+
+    def recording_to_bytes(self, engine='native'):
+        threads.append((threading.current_thread().name, engine))
+        return to_bytes(self, engine)
+
+    monkeypatch.setattr(MidiObject, 'to_bytes', recording_to_bytes)
+    midi = MidiObject.from_bytes(random_midi(0))
+    asyncio.run(AsyncMidiIO(executor).write(midi, io.BytesIO(), 'mido'))
+    assert len(threads) == 1
+    assert threads[0][0].startswith('midi_io')
+    assert threads[0][1] == 'mido'
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        MidiObject.from_bytes(random_midi(0)).to_bytes('other')
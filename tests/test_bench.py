@@ -0,0 +1,89 @@
+"""
+Synthetic benchmark files, a small benchmark run and the comparison with a
+baseline.
+"""
+from benchmarks.synth import Scenario, generate
+from benchmarks import bench
+from ugly_midi import MidiObject, Instrument, Note
+import numpy as np
+import json
+
+SMALL = Scenario(3, 40, 0.5, 1., 2, 3, 10, 96)
+
+
+def test_generate():
+    data = generate(SMALL, seed=1)
+    assert data == generate(SMALL, seed=1)
+    assert data != generate(SMALL, seed=2)
+    midi = MidiObject.from_bytes(data)
+    assert midi.resolution == 96
+    assert len(midi.tempo_changes) == 3
+    assert len(midi.instruments) == 3
+    # chord notes drawn on the same pitch pair into one note
+    n_notes = sum(len(i.get_note_array()) for i in midi.instruments)
+    assert 100 < n_notes <= 120
+    assert MidiObject.from_bytes(generate('sparse')).resolution == 480
+
+
+def test_loop_piano_roll():
+    instr = Instrument(0)
+    # overlapping notes of one pitch add up in both
+    for note in [Note(100, 60, 0, 10), Note(50, 60, 5, 20),
+                 Note(70, 64, 3, 4)]:
+        instr.add_note(note)
+    assert np.array_equal(bench._loop_piano_roll(instr),
+                          instr.get_piano_roll())
+
+
+def test_run():
+    results = bench.run(['sparse'], ['parse_native', 'piano_roll_loop'],
+                        repeat=1)
+    assert results['meta']['repeat'] == 1
+    midi = MidiObject.from_bytes(generate('sparse'))
+    assert results['files']['sparse'] == {
+        'bytes': len(generate('sparse')),
+        'notes': sum(len(i.get_note_array()) for i in midi.instruments),
+        'instruments': 4,
+    }
+    stages = results['results']['sparse']
+    assert list(stages) == ['parse_native', 'piano_roll_loop']
+    for result in stages.values():
+        assert result['best'] <= result['median']
+        assert result['peak_bytes'] > 0
+    no_memory = bench.run(['sparse'], ['parse_native'], repeat=1,
+                          memory=False)
+    assert no_memory['results']['sparse']['parse_native']['peak_bytes'] is None
+
+
+def results(best):
+    return {
+        'results': {
+            name: {stage: {'best': t} for stage, t in stages.items()}
+            for name, stages in best.items()
+        }
+    }
+
+
+def test_compare():
+    new = results({'a': {'parse': 1.5, 'write': 1.}, 'b': {'parse': 2.}})
+    old = results({'a': {'parse': 1., 'write': 1.}, 'c': {'parse': 1.}})
+    rows, regressions = bench.compare(new, old)
+    assert rows == [('a', 'parse', 1., 1.5, 1.5), ('a', 'write', 1., 1., 1.)]
+    assert regressions == rows[:1]
+    assert bench.compare(new, old, threshold=0.6)[1] == []
+
+
+def test_main(tmp_path, capsys):
+    path = str(tmp_path / 'results.json')
+    argv = ['--scenario', 'sparse', '--stage', 'parse_native', '--repeat',
+            '1', '--no-memory']
+    assert bench.main(argv + ['--save', path]) == 0
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved['results']['sparse']['parse_native']['best'] > 0
+    # a baseline a thousand times faster is a regression
+    saved['results']['sparse']['parse_native']['best'] /= 1000
+    with open(path, 'w') as f:
+        json.dump(saved, f)
+    assert bench.main(argv + ['--compare', path]) == 1
+    assert 'REGRESSION' in capsys.readouterr().out
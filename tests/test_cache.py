@@ -0,0 +1,128 @@
+"""
+Hits, misses and eviction of the parsed-file cache.
+"""
+from tests.generate import random_midi
+from tests.reference import snapshot
+import ugly_midi.cache
+from ugly_midi import load_cached, save_npz, load_npz, MidiObject
+import io
+import os
+import pytest
+import stat
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Records the paths parsed by ``load_cached`` on a miss"""
+    calls = []
+
+    def midi_object(midi_file=None, *args, **kwargs):
+        if midi_file is not None:
+            calls.append(midi_file)
+        return MidiObject(midi_file, *args, **kwargs)
+
+    monkeypatch.setattr(ugly_midi.cache, 'MidiObject', midi_object)
+    return calls
+
+
+def write_midi(tmp_path, name, seed):
+    path = str(tmp_path / name)
+    with open(path, 'wb') as f:
+        f.write(random_midi(seed))
+    return path
+
+
+def entries(cache_dir):
+    return sorted(f for f in os.listdir(cache_dir) if f.endswith('.npz'))
+
+
+def test_npz_round_trip(tmp_path):
+    midi = MidiObject(write_midi(tmp_path, 'a.mid', 0))
+    buf = io.BytesIO()
+    save_npz(midi, buf)
+    buf.seek(0)
+    assert snapshot(load_npz(buf)) == snapshot(midi)
+    buf.seek(0)
+    assert snapshot(load_npz(buf, columnar=True)) == snapshot(midi)
+
+
+def test_hit_and_miss(tmp_path, parses):
+    cache_dir = str(tmp_path / 'cache')
+    path = write_midi(tmp_path, 'a.mid', 0)
+    expected = snapshot(MidiObject(path))
+
+    assert snapshot(load_cached(path, cache_dir=cache_dir)) == expected
+    assert parses == [path]
+    assert len(entries(cache_dir)) == 1
+    assert snapshot(load_cached(path, cache_dir=cache_dir)) == expected
+    assert parses == [path]
+
+    # resolution and notes are part of the key
+    load_cached(path, 24, cache_dir=cache_dir)
+    load_cached(path, cache_dir=cache_dir, notes=False)
+    assert parses == [path] * 3
+    assert len(entries(cache_dir)) == 3
+
+    # so is the content, not the path
+    with open(path, 'wb') as f:
+        f.write(random_midi(1))
+    load_cached(path, cache_dir=cache_dir)
+    assert parses == [path] * 4
+
+
+def test_corrupt_entry_is_replaced(tmp_path, parses):
+    cache_dir = str(tmp_path / 'cache')
+    path = write_midi(tmp_path, 'a.mid', 0)
+    load_cached(path, cache_dir=cache_dir)
+    entry = os.path.join(cache_dir, entries(cache_dir)[0])
+    with open(entry, 'wb') as f:
+        f.write(b'not a zip file')
+    assert snapshot(load_cached(path, cache_dir=cache_dir)) == snapshot(
+        MidiObject(path))
+    assert len(parses) == 2
+    load_cached(path, cache_dir=cache_dir)
+    assert len(parses) == 2
+
+
+def test_eviction(tmp_path, parses):
+    cache_dir = str(tmp_path / 'cache')
+    paths = [write_midi(tmp_path, '{}.mid'.format(i), i) for i in range(3)]
+    load_cached(paths[0], cache_dir=cache_dir)
+    size = os.path.getsize(os.path.join(cache_dir, entries(cache_dir)[0]))
+    first = entries(cache_dir)[0]
+    os.utime(os.path.join(cache_dir, first), (1, 1))
+    load_cached(paths[1], cache_dir=cache_dir)
+    second = [e for e in entries(cache_dir) if e != first][0]
+    os.utime(os.path.join(cache_dir, second), (2, 2))
+
+    # a hit marks the first entry as the most recently used, so the second
+    # one goes when the third is written
+    load_cached(paths[0], cache_dir=cache_dir)
+    load_cached(paths[2], cache_dir=cache_dir, max_bytes=int(2.5 * size))
+    assert first in entries(cache_dir)
+    assert second not in entries(cache_dir)
+    assert len(entries(cache_dir)) == 2
+    assert not [f for f in os.listdir(cache_dir) if f.endswith('.tmp')]
+
+
+@pytest.mark.parametrize('umask, mode', [(0o022, 0o644), (0o077, 0o600)])
+def test_entry_mode_follows_umask(tmp_path, monkeypatch, umask, mode):
+    cache_dir = str(tmp_path / 'cache')
+    path = write_midi(tmp_path, 'a.mid', 0)
+    old = os.umask(umask)
+    try:
+        # the umask of the process, shared by all threads, is left alone
+        with monkeypatch.context() as m:
+            m.delattr(os, 'umask')
+            load_cached(path, cache_dir=cache_dir)
+    finally:
+        os.umask(old)
+    entry = os.path.join(cache_dir, entries(cache_dir)[0])
+    assert stat.S_IMODE(os.stat(entry).st_mode) == mode
+
+
+def test_no_cache_dir(tmp_path, parses):
+    path = write_midi(tmp_path, 'a.mid', 0)
+    load_cached(path)
+    load_cached(path)
+    assert parses == [path, path]
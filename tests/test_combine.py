@@ -0,0 +1,128 @@
+"""
+Merged instruments and concatenated or overlaid files.
+"""
+from tests.reference import snapshot
+from ugly_midi import MidiObject, Instrument, ColumnarInstrument, Note
+from ugly_midi import TempoChange, TimeSignature, KeySignature
+from ugly_midi import merge_instruments, CONTROL_CHANGE_DTYPE
+import numpy as np
+import pytest
+
+
+def make_instrument(cls, notes, program=0, name='', controls=()):
+    instr = cls(program, name=name)
+    for start, end, pitch in notes:
+        instr.add_note(Note(100, pitch, start, end))
+    instr.control_changes = np.array(list(controls),
+                                     dtype=CONTROL_CHANGE_DTYPE)
+    return instr
+
+
+def make_file(resolution, instruments, tempo=True):
+    midi = MidiObject(resolution=resolution)
+    midi.instruments = instruments
+    if tempo:
+        midi.tempo_changes = [TempoChange(90, 0)]
+    midi.time_signatures = [TimeSignature(3, 4, 0)]
+    return midi
+
+
+def notes_of(instr):
+    return [(s, e, p) for s, e, p, _ in instr.get_note_array().tolist()]
+
+
+@pytest.mark.parametrize('dedupe', [False, True])
+@pytest.mark.parametrize('cls', [Instrument, ColumnarInstrument])
+def test_merge_instruments(cls, dedupe):
+    first = make_instrument(cls, [(10, 20, 60), (0, 5, 62)], 3, 'a',
+                            [(10, 64, 127)])
+    second = make_instrument(Instrument, [(10, 30, 60), (0, 5, 61)], 5, 'b',
+                             [(2, 7, 90), (12, 64, 0)])
+    merged = merge_instruments(first, second, dedupe=dedupe)
+    assert type(merged) is cls
+    assert (merged.program, merged.name) == (3, 'a')
+    expected = [(0, 5, 61), (0, 5, 62), (10, 30, 60)]
+    if not dedupe:
+        expected.insert(2, (10, 20, 60))
+    assert notes_of(merged) == expected
+    assert merged.control_changes.tolist() == [(2, 7, 90), (10, 64, 127),
+                                               (12, 64, 0)]
+
+
+def test_merge_invalid():
+    with pytest.raises(ValueError):
+        merge_instruments()
+    drums = Instrument(0, is_drum=True)
+    with pytest.raises(AssertionError):
+        merge_instruments(Instrument(0), drums)
+
+
+@pytest.mark.parametrize('cls', [Instrument, ColumnarInstrument])
+def test_concat(cls):
+    # the first file ends at tick 100, in its second 3/4 bar
+    first = make_file(24, [
+        make_instrument(cls, [(0, 10, 60), (90, 100, 62)], 0, 'piano',
+                        [(5, 64, 127)]),
+        make_instrument(cls, [(0, 24, 40)], 33),
+    ])
+    first.key_signatures = [KeySignature('D', 24)]
+    second = make_file(48, [
+        make_instrument(cls, [(0, 48, 64)], 33),
+        make_instrument(cls, [(48, 96, 65)], 0, 'piano', [(0, 64, 0)]),
+        make_instrument(cls, [(0, 10, 66)], 0, 'piano'),
+    ], tempo=False)
+    before = snapshot(first), snapshot(second)
+    midi = MidiObject.concat([first, second])
+    assert (snapshot(first), snapshot(second)) == before
+    assert midi.resolution == 48
+    # the second file starts at the third 3/4 bar, tick 144 at 24 tpb
+    assert [(i.program, i.name, notes_of(i)) for i in midi.instruments] == [
+        (0, 'piano', [(0, 20, 60), (180, 200, 62), (336, 384, 65)]),
+        (33, '', [(0, 48, 40), (288, 336, 64)]),
+        (0, 'piano', [(288, 298, 66)]),
+    ]
+    assert midi.instruments[0].control_changes.tolist() == [(10, 64, 127),
+                                                            (288, 64, 0)]
+    assert [(t.bpm, t.time) for t in midi.tempo_changes] == [(90, 0),
+                                                            (120, 288)]
+    assert [(k.key, k.time) for k in midi.key_signatures] == [('D', 48)]
+    assert [(t.numerator, t.time) for t in midi.time_signatures] == [(3, 0),
+                                                                    (3, 288)]
+    unaligned = MidiObject.concat([first, second], bar_aligned=False)
+    assert notes_of(unaligned.instruments[2]) == [(200, 210, 66)]
+
+
+def test_concat_resolution_policy():
+    files = [
+        make_file(96,
+                  [make_instrument(Instrument, [(0, 1, 60), (4, 8, 61)])]),
+        make_file(96, [make_instrument(Instrument, [(0, 96, 60)])]),
+    ]
+    extended = MidiObject.concat(files, resolution=24, bar_aligned=False)
+    # the first note collapses at 24 ticks per beat
+    assert notes_of(extended.instruments[0]) == [(0, 1, 60), (1, 2, 61),
+                                                 (2, 26, 60)]
+    dropped = MidiObject.concat(files, resolution=24, bar_aligned=False,
+                                policy='drop')
+    assert notes_of(dropped.instruments[0]) == [(1, 2, 61), (2, 26, 60)]
+    with pytest.raises(ValueError):
+        MidiObject.concat([])
+    with pytest.raises(ValueError):
+        MidiObject.concat(files, resolution=0)
+
+
+def test_overlay():
+    first = make_file(24, [make_instrument(Instrument, [(0, 12, 60)], 4)])
+    second = make_file(48, [
+        make_instrument(ColumnarInstrument, [(24, 48, 60)], 4),
+        make_instrument(Instrument, [(0, 96, 50)], 9),
+    ])
+    second.tempo_changes = [TempoChange(60, 0)]
+    midi = MidiObject.overlay([first, second])
+    assert [(i.program, notes_of(i)) for i in midi.instruments] == [
+        (4, [(0, 24, 60)]),
+        (4, [(24, 48, 60)]),
+        (9, [(0, 96, 50)]),
+    ]
+    assert isinstance(midi.instruments[1], ColumnarInstrument)
+    assert [(t.bpm, t.time) for t in midi.tempo_changes] == [(90, 0)]
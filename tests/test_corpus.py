@@ -0,0 +1,77 @@
+"""
+Corpus loading over a process pool, with per-file errors.
+"""
+from tests.generate import build_midi, random_midi
+from tests.reference import snapshot
+from ugly_midi import load_corpus, iter_corpus, load_file, MidiObject
+from mido import Message, MetaMessage
+import pytest
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """Paths of five files, the fourth of which is corrupt"""
+    paths = []
+    for i in range(5):
+        path = str(tmp_path / '{}.mid'.format(i))
+        with open(path, 'wb') as f:
+            f.write(b'MThd\x00\x00' if i == 3 else random_midi(i))
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_load_corpus(corpus, workers):
+    results, report = load_corpus(corpus, 24, workers=workers, chunksize=2)
+    assert [r.path for r in results] == corpus
+    for i, result in enumerate(results):
+        if i == 3:
+            assert result.midi is None and result.error is not None
+            assert result.n_notes == 0
+        else:
+            assert result.error is None
+            assert snapshot(result.midi) == snapshot(MidiObject(corpus[i],
+                                                                24))
+            assert result.n_notes == sum(
+                len(ins.notes) for ins in result.midi.instruments)
+    assert report.n_files == 5
+    assert report.n_failed == 1
+    assert report.n_notes == sum(r.n_notes for r in results)
+    assert report.wall_seconds > 0
+    assert '5 files (1 failed' in str(report)
+
+
+def test_unordered(corpus):
+    results = list(iter_corpus(corpus, workers=2, chunksize=1,
+                               ordered=False))
+    assert sorted(r.path for r in results) == sorted(corpus)
+
+
+def test_kwargs_are_passed_on(corpus):
+    result = load_file(corpus[0], engine='native', columnar=True)
+    assert snapshot(result.midi) == snapshot(MidiObject(corpus[0]))
+    assert load_file(corpus[0], engine='other').error is not None
+
+
+def test_warnings_are_recorded(tmp_path):
+    path = str(tmp_path / 'bad.mid')
+    # a type 1 file with a tempo change outside the first track
+    with open(path, 'wb') as f:
+        f.write(
+            build_midi([[],
+                        [
+                            MetaMessage('set_tempo', tempo=400000, time=0),
+                            Message('note_on', note=60, time=0),
+                            Message('note_off', note=60, time=10)
+                        ]]))
+    result = load_file(path)
+    assert result.error is None and result.warnings
+    _, report = load_corpus([path], workers=0)
+    assert report.n_warned == 1
+
+
+def test_profile(corpus):
+    results, report = load_corpus(corpus[:2], workers=0, profile=True,
+                                  engine='native')
+    assert all(r.profile is not None for r in results)
+    assert report.profile.stages()['smf_parse'].calls == 2
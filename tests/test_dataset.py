@@ -0,0 +1,71 @@
+"""
+Packed datasets written and read back.
+"""
+from tests.generate import random_midi
+from ugly_midi import MidiObject, PackedDataset, write_packed
+from ugly_midi import ColumnarInstrument
+import numpy as np
+import pytest
+
+
+def note_snapshot(midi):
+    """The content a packed dataset keeps: meta events and notes"""
+    return (midi.resolution,
+            [(e.bpm, e.time) for e in midi.tempo_changes],
+            [(e.key, e.time) for e in midi.key_signatures],
+            [(e.numerator, e.denominator, e.time)
+             for e in midi.time_signatures],
+            [(i.program, i.is_drum, i.name, i.get_note_array().tolist())
+             for i in midi.instruments])
+
+
+@pytest.fixture
+def midis():
+    midis = [MidiObject.from_bytes(random_midi(seed)) for seed in range(3)]
+    # a file without instruments in the middle
+    midis.insert(1, MidiObject(resolution=96))
+    return midis
+
+
+def test_round_trip(tmp_path, midis):
+    directory = str(tmp_path / 'packed')
+    # a generator is consumed one file at a time
+    assert write_packed(directory, (m for m in midis)) == len(midis)
+    dataset = PackedDataset(directory)
+    assert len(dataset) == len(midis)
+    for i, midi in enumerate(midis):
+        assert dataset.n_instruments(i) == len(midi.instruments)
+        loaded = dataset.get_midi(i)
+        assert note_snapshot(loaded) == note_snapshot(midi)
+        assert all(
+            isinstance(ins, ColumnarInstrument) for ins in loaded.instruments)
+
+
+def test_notes_are_memory_mapped(tmp_path, midis):
+    directory = str(tmp_path / 'packed')
+    write_packed(directory, midis)
+    dataset = PackedDataset(directory)
+    notes = dataset.get_note_array(0, 0)
+    assert isinstance(notes, np.memmap)
+    assert not notes.flags.writeable
+    assert notes.tolist() == midis[0].instruments[0].get_note_array().tolist()
+    with pytest.raises(IndexError):
+        dataset.get_note_array(1, 0)
+
+
+def test_piano_roll_window(tmp_path, midis):
+    directory = str(tmp_path / 'packed')
+    write_packed(directory, midis)
+    dataset = PackedDataset(directory)
+    instr = midis[2].instruments[1]
+    full = instr.get_piano_roll(1000, dtype=np.uint8)
+    window = dataset.get_piano_roll(2, 1, 300, 700, dtype=np.uint8)
+    assert np.array_equal(window, full[300:700])
+
+
+def test_empty(tmp_path):
+    directory = str(tmp_path / 'packed')
+    write_packed(directory, [MidiObject(resolution=24)])
+    dataset = PackedDataset(directory)
+    assert len(dataset) == 1
+    assert dataset.get_midi(0).instruments == []
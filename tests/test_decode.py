@@ -0,0 +1,89 @@
+"""
+Piano roll decoding against the per-frame loop it replaced.
+"""
+from ugly_midi import get_instrument_from_piano_roll, Instrument, Note
+from ugly_midi import get_instruments_from_piano_rolls, ColumnarInstrument
+import numpy as np
+import pytest
+
+
+def loop_decode(roll, split_velocity=False):
+    """(start, end, pitch, velocity) of the notes in pitch and time order,
+    the velocity taken from the last frame of a note"""
+    notes = []
+    for pitch in range(128):
+        prev, start = 0, -1
+        for t in range(roll.shape[0]):
+            curr = roll[t, pitch]
+            ends = prev != 0 and (curr == 0 or
+                                  (split_velocity and curr != prev))
+            if ends:
+                notes.append((start, t, pitch, int(prev)))
+            if curr != 0 and (prev == 0 or ends):
+                start = t
+            prev = curr
+        if prev != 0:
+            notes.append((start, roll.shape[0], pitch, int(prev)))
+    return notes
+
+
+def random_roll(seed, frames=60):
+    rng = np.random.RandomState(seed)
+    roll = np.zeros((frames, 128), dtype=np.uint8)
+    # runs with a few velocities on a handful of pitches, touching the edges
+    for pitch in rng.choice(128, 8, replace=False):
+        values = rng.choice([0, 0, 40, 90], frames)
+        roll[:, pitch] = np.repeat(values[::3], 3)[:frames]
+    return roll
+
+
+def note_tuples(instr):
+    return [(n.start, n.end, n.pitch, n.velocity) for n in instr.notes]
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('split_velocity', [False, True])
+@pytest.mark.parametrize('columnar', [False, True])
+def test_matches_loop(seed, split_velocity, columnar):
+    roll = random_roll(seed)
+    instr = get_instrument_from_piano_roll(roll, 5, False, 'x',
+                                           split_velocity, columnar)
+    assert type(instr) is (ColumnarInstrument if columnar else Instrument)
+    assert (instr.program, instr.name) == (5, 'x')
+    assert note_tuples(instr) == loop_decode(roll, split_velocity)
+
+
+def test_round_trip():
+    instr = Instrument(0)
+    for start, end, pitch, velocity in [(0, 10, 60, 100), (12, 20, 60, 80),
+                                        (5, 30, 64, 70)]:
+        instr.add_note(Note(velocity, pitch, start, end))
+    roll = instr.get_piano_roll(dtype=np.uint8)
+    assert sorted(note_tuples(get_instrument_from_piano_roll(roll))) == sorted(
+        note_tuples(instr))
+
+
+def test_batch():
+    rolls = np.stack([random_roll(seed) for seed in range(4)])
+    rolls[2] = 0
+    instrs = get_instruments_from_piano_rolls(rolls, split_velocity=True)
+    assert len(instrs) == 4
+    for roll, instr in zip(rolls, instrs):
+        assert note_tuples(instr) == loop_decode(roll, True)
+    assert not instrs[2].notes
+
+
+def test_float_roll():
+    roll = random_roll(0).astype(np.float64) / 2
+    assert note_tuples(get_instrument_from_piano_roll(roll)) == [
+        (s, e, p, v / 2) for s, e, p, v in loop_decode(random_roll(0))
+    ]
+
+
+def test_invalid():
+    with pytest.raises(TypeError):
+        get_instrument_from_piano_roll([[0] * 128])
+    with pytest.raises(ValueError):
+        get_instrument_from_piano_roll(np.zeros((10, 64)))
+    with pytest.raises(ValueError):
+        get_instruments_from_piano_rolls(np.zeros((10, 128)))
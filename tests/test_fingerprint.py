@@ -0,0 +1,114 @@
+"""
+Fingerprints of transformed files and the duplicate index.
+"""
+from ugly_midi import MidiObject, Instrument, ColumnarInstrument, Note
+from ugly_midi import midi_fingerprint, signature_similarity
+from ugly_midi import FingerprintIndex
+import numpy as np
+import pytest
+
+
+def random_notes(seed, n=200):
+    rng = np.random.RandomState(seed)
+    start = np.sort(rng.randint(0, 40, n)).cumsum() * 4
+    return [(int(s), int(s + rng.randint(4, 50)), int(rng.randint(40, 90)))
+            for s in start]
+
+
+def make_midi(notes, resolution=24, offset=0, split=1, program=0,
+              cls=Instrument):
+    """A file with ``notes`` scaled to ``resolution`` and shifted by
+    ``offset``, dealt round robin to ``split`` instruments"""
+    midi = MidiObject(resolution=resolution)
+    scale = resolution // 24
+    instruments = [cls(program) for _ in range(split)]
+    for i, (start, end, pitch) in enumerate(notes):
+        instruments[i % split].add_note(
+            Note(100 - i % 50, pitch, start * scale + offset,
+                 end * scale + offset))
+    midi.instruments = instruments
+    return midi
+
+
+def test_invariance():
+    notes = random_notes(0)
+    fp = midi_fingerprint(make_midi(notes))
+    for other in [
+            make_midi(notes, resolution=96),
+            make_midi(notes, offset=480),
+            make_midi(notes[::-1], split=3, program=40),
+            make_midi(notes, cls=ColumnarInstrument),
+    ]:
+        other_fp = midi_fingerprint(other)
+        assert other_fp.hash == fp.hash
+        assert np.array_equal(other_fp.signature, fp.signature)
+    # instrument hashes follow the split
+    split = midi_fingerprint(make_midi(notes, split=3))
+    assert len(split.instrument_hashes) == 3
+
+
+def test_similarity():
+    notes = random_notes(0)
+    fp = midi_fingerprint(make_midi(notes))
+    edited = list(notes)
+    edited[100] = (edited[100][0], edited[100][1], 100)
+    edited_fp = midi_fingerprint(make_midi(edited))
+    assert edited_fp.hash != fp.hash
+    assert signature_similarity(fp.signature, edited_fp.signature) > 0.8
+    other_fp = midi_fingerprint(make_midi(random_notes(1)))
+    assert signature_similarity(fp.signature, other_fp.signature) < 0.1
+    drums = make_midi(notes)
+    drums.instruments[0].is_drum = True
+    assert midi_fingerprint(drums).hash != fp.hash
+    empty = midi_fingerprint(MidiObject(resolution=24))
+    assert np.all(empty.signature == np.iinfo(np.uint64).max)
+
+
+@pytest.fixture
+def index():
+    index = FingerprintIndex(':memory:')
+    base = random_notes(0)
+    edited = list(base)
+    edited[50] = (edited[50][0], edited[50][1], 100)
+    index.add_many([
+        ('a', make_midi(base)),
+        ('b', make_midi(base, resolution=48)),
+        ('c', make_midi(edited)),
+        ('d', make_midi(random_notes(1))),
+    ])
+    yield index
+    index.close()
+
+
+def test_query(index):
+    assert len(index) == 4 and 'c' in index and 'e' not in index
+    matches = index.query(make_midi(random_notes(0), split=2))
+    assert [(key, exact) for key, _, exact in matches] == [('a', True),
+                                                           ('b', True),
+                                                           ('c', False)]
+    assert matches[2][1] > 0.8
+    assert index.query(make_midi(random_notes(2))) == []
+
+
+def test_duplicates(index):
+    assert index.exact_duplicates() == [['a', 'b']]
+    assert index.near_duplicates() == [['a', 'b', 'c']]
+    # replacing a key drops its old fingerprint
+    index.add('b', make_midi(random_notes(3)))
+    assert len(index) == 4
+    assert index.exact_duplicates() == []
+    index.remove('c')
+    assert 'c' not in index
+    assert index.near_duplicates() == []
+
+
+def test_on_disk(tmp_path):
+    path = str(tmp_path / 'index.sqlite')
+    with FingerprintIndex(path, n_perm=64, n_bands=16) as index:
+        index.add('a', make_midi(random_notes(0)))
+    with FingerprintIndex(path, n_perm=64, n_bands=16) as index:
+        assert index.query(make_midi(random_notes(0)))[0][:1] == ('a', )
+    with pytest.raises(ValueError):
+        FingerprintIndex(path)
+    with pytest.raises(ValueError):
+        FingerprintIndex(':memory:', n_perm=64, n_bands=12)
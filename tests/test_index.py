@@ -0,0 +1,83 @@
+"""
+Range queries of ``NoteIndex`` against a plain scan of the notes.
+"""
+from ugly_midi import Instrument, ColumnarInstrument, MidiObject, Note
+import numpy as np
+import pytest
+
+
+def scan(notes, start_time, end_time, pitch_lo=0, pitch_hi=127):
+    return [
+        i for i, n in enumerate(notes) if n.start < end_time and
+        n.end > start_time and pitch_lo <= n.pitch <= pitch_hi
+    ]
+
+
+def random_instrument(cls, seed, n_notes=200):
+    rng = np.random.RandomState(seed)
+    instr = cls(0)
+    for _ in range(n_notes):
+        start = int(rng.randint(0, 1000))
+        instr.add_note(
+            Note(int(rng.randint(1, 128)), int(rng.randint(40, 80)), start,
+                 start + int(rng.randint(1, 200))))
+    return instr
+
+
+@pytest.mark.parametrize('cls', [Instrument, ColumnarInstrument])
+@pytest.mark.parametrize('seed', range(5))
+def test_query_matches_scan(cls, seed):
+    instr = random_instrument(cls, seed)
+    rng = np.random.RandomState(seed + 100)
+    for _ in range(20):
+        t0 = int(rng.randint(0, 1100))
+        t1 = t0 + int(rng.randint(1, 300))
+        lo = int(rng.randint(40, 80))
+        hi = lo + int(rng.randint(0, 20))
+        assert instr.note_indices_in_range(t0, t1, lo, hi).tolist() == scan(
+            instr.notes, t0, t1, lo, hi)
+
+
+def test_list_index_cache():
+    instr = Instrument(0)
+    instr.add_note(Note(100, 60, 0, 10))
+    instr.add_note(Note(100, 62, 5, 15))
+    index = instr.get_note_index()
+    assert instr.get_note_index() is index
+    assert instr.note_indices_in_range(0, 20).tolist() == [0, 1]
+    # adding a note or assigning the list drops the index
+    instr.add_note(Note(100, 64, 8, 9))
+    assert instr.note_indices_in_range(0, 20).tolist() == [0, 1, 2]
+    instr.notes = instr.notes[:2]
+    assert instr.note_indices_in_range(0, 20).tolist() == [0, 1]
+    # edits in place go unnoticed until the index is invalidated
+    instr.notes.pop()
+    instr.notes.append(Note(100, 64, 100, 110))
+    instr.notes[0].start, instr.notes[0].end = 50, 60
+    instr.invalidate_note_index()
+    assert instr.note_indices_in_range(0, 20).tolist() == []
+    assert instr.note_array_in_range(40, 120)['pitch'].tolist() == [60, 64]
+    # the returned arrays are copies of the cached one
+    instr.note_array_in_range(40, 120)['start'] = 0
+    assert instr.note_indices_in_range(0, 20).tolist() == []
+
+
+def test_columnar_view_edit():
+    instr = random_instrument(ColumnarInstrument, 0, 10)
+    instr.note_indices_in_range(0, 2000)
+    instr.notes[3].start = 5000
+    instr.notes[3].end = 5010
+    assert instr.note_indices_in_range(4990, 6000).tolist() == [3]
+
+
+def test_iter_segments_matches_piano_roll():
+    midi = MidiObject(resolution=24)
+    midi.instruments = [
+        random_instrument(Instrument, 1),
+        random_instrument(ColumnarInstrument, 2)
+    ]
+    end_time = midi.get_end_time()
+    rolls = [ins.get_piano_roll(end_time + 64) for ins in midi.instruments]
+    for start, roll in midi.iter_segments(64):
+        for i, full in enumerate(rolls):
+            assert np.array_equal(roll[i], full[start:start + 64])
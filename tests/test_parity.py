@@ -0,0 +1,178 @@
+"""
+The mido and native engines, the columnar instruments and
+``MidiObject.from_bytes`` read files like the event by event reference.
+"""
+from tests.generate import build_midi, random_midi
+from tests.reference import reference_load, snapshot
+from ugly_midi import MidiObject
+from mido import Message, MetaMessage
+import pytest
+import warnings
+
+
+def load_all(data, tmp_path):
+    """Snapshots of ``data`` read by every loader"""
+    path = str(tmp_path / 'test.mid')
+    with open(path, 'wb') as f:
+        f.write(data)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return {
+            'mido': snapshot(MidiObject(path)),
+            'native': snapshot(MidiObject(path, engine='native')),
+            'mido_columnar': snapshot(MidiObject(path, columnar=True)),
+            'native_columnar': snapshot(
+                MidiObject(path, engine='native', columnar=True)),
+            'from_bytes': snapshot(MidiObject.from_bytes(data)),
+        }
+
+
+def check_parity(data, tmp_path):
+    """Asserts that all loaders match the reference, returns its snapshot"""
+    expected = reference_load(data)
+    for name, loaded in load_all(data, tmp_path).items():
+        assert loaded == expected, name
+    return expected
+
+
+def note_on(note, tick, velocity=100, channel=0):
+    return Message('note_on', channel=channel, note=note, velocity=velocity,
+                   time=tick)
+
+
+def note_off(note, tick, channel=0):
+    return Message('note_off', channel=channel, note=note, time=tick)
+
+
+def test_running_status(tmp_path):
+    data = build_midi([[note_on(60, 0), note_on(64, 0), note_on(60, 10, 0),
+                        note_on(64, 20, 0)]])
+    # mido leaves out the repeated note-on status bytes
+    assert data.count(b'\x90') == 1
+    midi = check_parity(data, tmp_path)
+    assert midi['instruments'][0][3] == [(0, 10, 60, 100), (0, 20, 64, 100)]
+
+
+def test_sysex(tmp_path):
+    data = build_midi([[
+        note_on(60, 0),
+        Message('sysex', data=[1, 2, 3], time=5),
+        note_on(62, 5),
+        note_off(60, 10),
+        note_off(62, 10),
+    ]])
+    midi = check_parity(data, tmp_path)
+    assert midi['instruments'][0][3] == [(0, 10, 60, 100), (5, 10, 62, 100)]
+
+
+def test_same_tick_note_off(tmp_path):
+    data = build_midi([[note_on(60, 0), note_off(60, 0), note_off(60, 10),
+                        note_on(62, 20), note_off(62, 20)]])
+    midi = check_parity(data, tmp_path)
+    # the first note-off leaves the note open, the last one creates the
+    # instrument without a note
+    assert midi['instruments'][0][3] == [(0, 10, 60, 100)]
+
+
+def test_zero_velocity_note_on(tmp_path):
+    data = build_midi([[note_on(60, 0, 90), note_on(60, 10, 0),
+                        note_on(60, 12, 0), note_on(60, 20, 80),
+                        note_on(60, 30, 80), note_on(60, 40, 0)]])
+    midi = check_parity(data, tmp_path)
+    assert midi['instruments'][0][3] == [(0, 10, 60, 90), (30, 40, 60, 80)]
+
+
+def test_repeated_note_on(tmp_path):
+    data = build_midi([[note_on(60, 0, 90), note_on(60, 5, 80),
+                        note_off(60, 10), note_off(60, 15)]])
+    midi = check_parity(data, tmp_path)
+    # the second note-on replaces the open one, the last note-off is spurious
+    assert midi['instruments'][0][3] == [(5, 10, 60, 80)]
+
+
+def test_spurious_note_off(tmp_path):
+    data = build_midi([[note_off(60, 0), note_off(62, 3, channel=1),
+                        note_on(60, 5), note_off(60, 8)]])
+    midi = check_parity(data, tmp_path)
+    # note-offs without a note-on create no instrument
+    assert [(i[0], i[3]) for i in midi['instruments']] == [
+        (0, [(5, 8, 60, 100)])
+    ]
+
+
+def test_tracks_pair_separately(tmp_path):
+    data = build_midi([
+        [MetaMessage('set_tempo', tempo=500000, time=0)],
+        [note_on(60, 10), note_off(60, 30)],
+        [note_on(60, 0), note_off(60, 20), note_on(62, 5), note_off(62, 6)],
+    ])
+    midi = check_parity(data, tmp_path)
+    # same channel and pitch on two tracks. Instruments are created and
+    # notes added at their note-offs.
+    assert [i[3] for i in midi['instruments']] == [
+        [(5, 6, 62, 100), (0, 20, 60, 100)], [(10, 30, 60, 100)]
+    ]
+
+
+def test_program_change_across_tracks(tmp_path):
+    data = build_midi([
+        [MetaMessage('set_tempo', tempo=500000, time=0)],
+        [note_on(60, 0), note_off(60, 10), note_on(60, 20), note_off(60, 30)],
+        [Message('program_change', program=5, time=15)],
+    ])
+    midi = check_parity(data, tmp_path)
+    assert [(i[0], i[3]) for i in midi['instruments']] == [
+        (0, [(0, 10, 60, 100)]), (5, [(20, 30, 60, 100)])
+    ]
+
+
+def test_type0(tmp_path):
+    data = build_midi([[
+        MetaMessage('set_tempo', tempo=400000, time=0),
+        MetaMessage('time_signature', numerator=3, denominator=4, time=0),
+        Message('program_change', channel=1, program=3, time=0),
+        note_on(60, 0, channel=1),
+        note_on(36, 0, channel=9),
+        note_off(36, 5, channel=9),
+        note_off(60, 10, channel=1),
+    ]], midi_type=0)
+    midi = check_parity(data, tmp_path)
+    assert midi['time_signatures'] == [(3, 4, 0)]
+    assert [(i[0], i[1]) for i in midi['instruments']] == [(0, True),
+                                                           (3, False)]
+
+
+def test_controls(tmp_path):
+    data = build_midi([
+        [MetaMessage('set_tempo', tempo=500000, time=0)],
+        [
+            Message('control_change', control=7, value=90, time=0),
+            Message('pitchwheel', pitch=-100, time=2),
+            note_on(60, 5),
+            note_off(60, 10),
+            Message('control_change', control=64, value=127, time=12),
+            Message('program_change', program=1, time=15),
+            Message('aftertouch', value=30, time=16),
+            note_on(62, 20),
+            Message('polytouch', note=62, value=40, time=22),
+            note_off(62, 30),
+        ],
+    ])
+    midi = check_parity(data, tmp_path)
+    first, second = midi['instruments']
+    # the events before any instrument go to both, the aftertouch before
+    # the second one to it only
+    assert first[4] == [(0, 7, 90), (12, 64, 127)]
+    assert first[5] == [(2, -100)]
+    assert second[4] == [(0, 7, 90)]
+    assert second[6] == [(16, -1, 30), (22, 62, 40)]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_type1(tmp_path, seed):
+    check_parity(random_midi(seed), tmp_path)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_random_type0(tmp_path, seed):
+    check_parity(random_midi(seed, midi_type=0), tmp_path)
@@ -0,0 +1,98 @@
+"""
+Both rasterizers of ``Instrument.get_piano_roll`` against the loop it
+replaced.
+"""
+from ugly_midi import Instrument, ColumnarInstrument, Note
+import ugly_midi.instrument
+import numpy as np
+import pytest
+
+
+def loop_piano_roll(notes, end_time, dtype, mode):
+    """The per-note loop, summing in int64 before clipping to ``dtype``"""
+    roll = np.zeros((end_time, 128), dtype=np.int64)
+    for n in notes:
+        if n.start >= end_time:
+            continue
+        if mode == 'onset':
+            roll[n.start, n.pitch] += 1
+        else:
+            roll[n.start:min(n.end, end_time), n.pitch] += (
+                n.velocity if mode == 'velocity' else 1)
+    if mode != 'velocity':
+        roll = np.minimum(roll, 1)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        roll = np.clip(roll, info.min, info.max)
+    return roll.astype(dtype)
+
+
+def random_instrument(seed, n_notes, max_length, cls=Instrument):
+    rng = np.random.RandomState(seed)
+    instr = cls(0)
+    for _ in range(n_notes):
+        start = int(rng.randint(0, 500))
+        instr.add_note(
+            Note(int(rng.randint(1, 128)), int(rng.randint(58, 66)), start,
+                 start + int(rng.randint(1, max_length))))
+    return instr
+
+
+@pytest.fixture(params=['runs', 'dense'])
+def rasterizer(request, monkeypatch):
+    density = np.inf if request.param == 'runs' else -1
+    monkeypatch.setattr(ugly_midi.instrument, 'DENSE_RASTER_DENSITY', density)
+    monkeypatch.setattr(ugly_midi.instrument, 'RASTER_CHUNK', 100)
+    return request.param
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.uint8, np.int16, bool])
+@pytest.mark.parametrize('mode', ['velocity', 'binary', 'onset'])
+@pytest.mark.parametrize('max_length', [4, 200])
+def test_matches_loop(rasterizer, dtype, mode, max_length):
+    instr = random_instrument(0, 300, max_length)
+    for end_time in (None, 250):
+        roll = instr.get_piano_roll(end_time, dtype=dtype, mode=mode)
+        expected = loop_piano_roll(instr.notes, end_time or
+                                   instr.get_end_time(), dtype, mode)
+        assert roll.dtype == np.dtype(dtype)
+        assert np.array_equal(roll, expected)
+
+
+@pytest.mark.parametrize('cls', [Instrument, ColumnarInstrument])
+def test_start_time(rasterizer, cls):
+    instr = random_instrument(1, 200, 50, cls)
+    full = instr.get_piano_roll(600)
+    assert np.array_equal(instr.get_piano_roll(400, start_time=100),
+                          full[100:400])
+    assert np.array_equal(
+        instr.get_piano_roll(start_time=100)[:400], full[100:500])
+    # the range query and the filter leave the stored notes alone
+    assert np.array_equal(instr.get_piano_roll(600), full)
+
+
+@pytest.mark.parametrize('cls', [Instrument, ColumnarInstrument])
+def test_start_time_past_end(cls):
+    instr = random_instrument(1, 20, 50, cls)
+    past = instr.get_end_time() + 10
+    assert instr.get_piano_roll(start_time=past).shape == (0, 128)
+    assert instr.get_piano_roll(start_time=past, sustain=True).shape == (0,
+                                                                         128)
+    assert instr.get_piano_roll(past, start_time=past).shape == (0, 128)
+    with pytest.raises(ValueError):
+        instr.get_piano_roll(100, start_time=200)
+
+
+def test_sparse_matches_dense():
+    pytest.importorskip('scipy')
+    instr = random_instrument(2, 200, 50)
+    roll = instr.get_piano_roll(dtype=np.uint8)
+    assert np.array_equal(
+        instr.get_piano_roll(dtype=np.uint8, sparse='csr').toarray(), roll)
+    rows, cols, vals = instr.get_piano_roll(dtype=np.uint8, sparse='triplet')
+    assert np.array_equal(roll[rows, cols], vals)
+    assert np.count_nonzero(roll) == len(vals)
+
+
+def test_empty():
+    assert Instrument(0).get_piano_roll().shape == (1, 0)
@@ -0,0 +1,104 @@
+"""
+Stage timings recorded by ``Profile``.
+"""
+from tests.generate import random_midi
+from ugly_midi import MidiObject, Profile, stage, enabled
+import pickle
+import threading
+
+
+def test_inactive():
+    assert not enabled()
+    with stage('anything') as timer:
+        timer.count = 3
+    with Profile() as prof:
+        assert enabled()
+    assert not enabled()
+    assert prof.records == []
+
+
+def test_stages():
+    with Profile('a') as prof:
+        for count in (2, 5):
+            with stage('outer') as timer:
+                timer.count = count
+                with stage('inner'):
+                    pass
+        with stage('outer'):
+            pass
+    stats = prof.stages()
+    assert list(stats) == ['inner', 'outer']
+    assert stats['outer'].calls == 3
+    assert stats['outer'].count == 7
+    assert stats['inner'].count is None
+    assert stats['outer'].alloc_bytes is None
+    assert stats['outer'].seconds >= stats['inner'].seconds
+    assert prof.labels() == ['a']
+    lines = prof.summary().splitlines()
+    assert len(lines) == 3 and lines[2].split()[:2] == ['outer', '3']
+
+
+def test_nested_profiles_and_merge():
+    with Profile('outer') as outer:
+        with stage('first'):
+            pass
+        with Profile('inner') as inner:
+            with stage('second'):
+                pass
+    assert [r[:2] for r in outer.records] == [('outer', 'first'),
+                                              ('outer', 'second')]
+    assert [r[:2] for r in inner.records] == [('inner', 'second')]
+    merged = pickle.loads(pickle.dumps(outer)).merge(inner)
+    assert merged.labels() == ['outer', 'inner']
+    assert list(merged.stages('inner')) == ['second']
+    assert merged.stages()['second'].calls == 2
+
+
+def test_memory():
+    with Profile(memory=True) as prof:
+        with stage('allocate'):
+            data = bytearray(10**6)
+    del data
+    assert prof.stages()['allocate'].alloc_bytes >= 10**6
+
+
+def test_library_stages():
+    data = random_midi(0)
+    with Profile() as prof:
+        midi = MidiObject.from_bytes(data)
+        midi.change_resolution(24)
+        midi.instruments[0].get_piano_roll()
+    stats = prof.stages()
+    for name in ('smf_parse', 'note_pairing', 'change_resolution',
+                 'rasterize'):
+        assert stats[name].calls >= 1, name
+    n_notes = sum(len(i.get_note_array()) for i in midi.instruments)
+    assert stats['note_pairing'].count >= n_notes
+
+
+def test_threads():
+    data = [random_midi(seed) for seed in range(4)]
+    barrier = threading.Barrier(2)
+    profiles = {}
+
+    def work(label):
+        with Profile(label) as prof:
+            barrier.wait()
+            for d in data:
+                MidiObject.from_bytes(d)
+        profiles[label] = prof
+
+    threads = [threading.Thread(target=work, args=(l, )) for l in 'ab']
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # each profile has the stages of its own thread only
+    assert profiles['a'].stages()['smf_parse'].calls == len(data)
+    assert profiles['b'].stages()['smf_parse'].calls == len(data)
+    with Profile() as prof:
+        thread = threading.Thread(target=MidiObject.from_bytes,
+                                  args=(data[0], ))
+        thread.start()
+        thread.join()
+    assert prof.records == []
@@ -0,0 +1,101 @@
+"""
+Resolution changes and their short-note policies.
+"""
+from ugly_midi import MidiObject, Instrument, ColumnarInstrument, Note
+from ugly_midi import ResolutionReport, TempoChange
+import numpy as np
+import pytest
+
+# (start, end, pitch) at 96 ticks per beat, and at 24 after rounding
+NOTES = [
+    (0, 96, 60),  # (0, 24)
+    (100, 101, 60),  # collapses at 25, nothing else on 60 there
+    (96, 192, 62),  # (24, 48)
+    (97, 98, 62),  # collapses at 24, inside the note above
+    (200, 201, 64),  # both collapse at 50
+    (201, 202, 64),
+]
+
+
+def make_midi(cls=Instrument, notes=NOTES):
+    midi = MidiObject(resolution=96)
+    midi.tempo_changes = [TempoChange(120, 0), TempoChange(90, 190)]
+    instr = cls(0)
+    for start, end, pitch in notes:
+        instr.add_note(Note(100, pitch, start, end))
+    midi.instruments = [instr]
+    return midi
+
+
+def note_tuples(instr):
+    return sorted(instr.get_note_array()[['start', 'end', 'pitch']].tolist())
+
+
+@pytest.mark.parametrize('cls', [Instrument, ColumnarInstrument])
+@pytest.mark.parametrize('policy, report, expected', [
+    ('extend', (4, 0, 0), [(0, 24, 60), (24, 25, 62), (24, 48, 62),
+                           (25, 26, 60), (50, 51, 64), (50, 51, 64)]),
+    ('drop', (0, 4, 0), [(0, 24, 60), (24, 48, 62)]),
+    ('merge', (2, 0, 2), [(0, 24, 60), (24, 48, 62), (25, 26, 60),
+                          (50, 51, 64)]),
+])
+def test_policies(cls, policy, report, expected):
+    midi = make_midi(cls)
+    assert midi.change_resolution(24, policy) == ResolutionReport(*report)
+    assert note_tuples(midi.instruments[0]) == expected
+    assert midi.resolution == 24
+    assert [e.time for e in midi.tempo_changes] == [0, 48]
+
+
+def test_merge_within_instrument():
+    midi = make_midi()
+    other = Instrument(1)
+    other.add_note(Note(100, 62, 97, 98))
+    midi.instruments.append(other)
+    report = midi.change_resolution(24, 'merge')
+    # the note of the second instrument is not absorbed by the first one
+    assert report == ResolutionReport(3, 0, 2)
+    assert note_tuples(other) == [(24, 25, 62)]
+
+
+def test_instrument_change_resolution():
+    instr = make_midi().instruments[0]
+    assert instr.change_resolution(
+        0.25, discard_short_notes=True) == ResolutionReport(0, 4, 0)
+    instr = make_midi().instruments[0]
+    assert instr.change_resolution(0.25) == ResolutionReport(4, 0, 0)
+    with pytest.raises(ValueError):
+        instr.change_resolution(0.25, policy='keep')
+
+
+def test_same_resolution():
+    midi = make_midi()
+    assert midi.change_resolution(96) == ResolutionReport(0, 0, 0)
+    assert note_tuples(midi.instruments[0]) == sorted(NOTES)
+
+
+@pytest.mark.parametrize('res', [96, 24])
+def test_invalid_policy(res):
+    midi = make_midi()
+    with pytest.raises(ValueError):
+        midi.change_resolution(res, policy='bogus')
+    # nothing was rescaled before the policy was checked
+    assert midi.resolution == 96
+    assert [e.time for e in midi.tempo_changes] == [0, 190]
+
+
+@pytest.mark.parametrize('res', [0, -24, 24.0, '24'])
+def test_invalid_resolution(res):
+    with pytest.raises(ValueError):
+        make_midi().change_resolution(res)
+    with pytest.raises(ValueError):
+        MidiObject(resolution=res)
+
+
+def test_controls_are_scaled():
+    midi = make_midi()
+    instr = midi.instruments[0]
+    instr.control_changes = np.array([(10, 64, 127), (97, 64, 0)],
+                                     dtype=instr.control_changes.dtype)
+    midi.change_resolution(48)
+    assert instr.control_changes['time'].tolist() == [5, 48]
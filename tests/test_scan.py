@@ -0,0 +1,131 @@
+"""
+Metadata-only scans against full loads.
+"""
+from tests.generate import build_midi, random_midi
+from ugly_midi import scan, MidiObject
+from ugly_midi.smf import read_smf
+from mido import Message, MetaMessage
+import collections
+import pytest
+
+
+def meta(midi):
+    return ([(e.bpm, e.time) for e in midi.tempo_changes],
+            [(e.key, e.time) for e in midi.key_signatures],
+            [(e.numerator, e.denominator, e.time)
+             for e in midi.time_signatures])
+
+
+def instrument_keys(instruments):
+    return [(i.program, i.is_drum, i.name) for i in instruments]
+
+
+def write(tmp_path, data):
+    path = str(tmp_path / 'a.mid')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_scan(tmp_path):
+    data = build_midi([
+        [
+            MetaMessage('set_tempo', tempo=400000, time=0),
+            MetaMessage('time_signature', numerator=3, denominator=4,
+                        time=0),
+            MetaMessage('key_signature', key='A', time=50),
+        ],
+        [
+            MetaMessage('track_name', name='lead'),
+            Message('program_change', program=4, time=0),
+            Message('note_on', note=60, time=0),
+            Message('note_off', note=60, time=10),
+            Message('program_change', program=7, time=20),
+            Message('note_on', note=62, time=20),
+            Message('note_off', note=62, time=30),
+        ],
+        [
+            MetaMessage('track_name', name='drums'),
+            Message('note_on', channel=9, note=36, time=5),
+            Message('note_off', channel=9, note=36, time=6),
+        ],
+    ], ticks_per_beat=220)
+    path = write(tmp_path, data)
+    info = scan(path)
+    full = MidiObject(path)
+    assert (info.type, info.resolution, info.n_tracks) == (1, 220, 3)
+    assert meta(info) == meta(full)
+    assert instrument_keys(info.instruments) == [(4, False, 'lead'),
+                                                 (0, True, 'drums'),
+                                                 (7, False, 'lead')]
+    assert sorted(instrument_keys(info.instruments)) == sorted(
+        instrument_keys(full.instruments))
+    assert all(not i.notes for i in info.instruments)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_files(tmp_path, seed):
+    data = random_midi(seed)
+    path = write(tmp_path, data)
+    info = scan(path)
+    full = MidiObject(path)
+    assert meta(info) == meta(full)
+    assert info.resolution == full.resolution
+    # a scan also lists the instruments whose notes never end
+    scanned = collections.Counter(instrument_keys(info.instruments))
+    loaded = collections.Counter(instrument_keys(full.instruments))
+    assert not loaded - scanned
+
+
+def test_notes_false(tmp_path):
+    path = write(tmp_path, random_midi(0))
+    midi = MidiObject(path, notes=False)
+    info = scan(path)
+    assert meta(midi) == meta(info)
+    assert instrument_keys(midi.instruments) == instrument_keys(
+        info.instruments)
+    assert all(not i.notes for i in midi.instruments)
+    from_bytes = MidiObject.from_bytes(random_midi(0), notes=False)
+    assert instrument_keys(from_bytes.instruments) == instrument_keys(
+        info.instruments)
+
+
+def test_type0(tmp_path):
+    data = build_midi([[
+        MetaMessage('set_tempo', tempo=600000, time=0),
+        Message('program_change', channel=2, program=9, time=0),
+        Message('note_on', channel=2, note=60, time=0),
+        Message('note_off', channel=2, note=60, time=4),
+    ]], midi_type=0)
+    info = scan(write(tmp_path, data))
+    assert (info.type, info.n_tracks) == (0, 1)
+    assert instrument_keys(info.instruments) == [(9, False, '')]
+    assert [e.time for e in info.tempo_changes] == [0]
+
+
+def test_invalid(tmp_path):
+    # headers of a type 1 and a type 2 file without their track
+    with pytest.raises(ValueError):
+        scan(write(tmp_path, b'MThd\x00\x00\x00\x06\x00\x01\x00\x01\x00`'))
+    with pytest.raises(ValueError):
+        scan(write(tmp_path, b'MThd\x00\x00\x00\x06\x00\x02\x00\x01\x00`'))
+
+
+def test_skipped_events(tmp_path):
+    # the control change and the pitch bend carry data bytes above 127,
+    # which a scan skips without reading
+    track = bytes([
+        0, 0xc3, 4, 0, 0xb3, 7, 0x90, 0, 0x93, 60, 64, 10, 60, 0, 0, 0xe3,
+        0, 0x80, 5, 0xa3, 60, 0x81, 0, 0xff, 0x2f, 0
+    ])
+    data = (b'MThd\x00\x00\x00\x06\x00\x00\x00\x01\x00`MTrk' +
+            len(track).to_bytes(4, 'big') + track)
+    path = write(tmp_path, data)
+    with pytest.raises(ValueError):
+        MidiObject(path, engine='native')
+    info = scan(path)
+    assert instrument_keys(info.instruments) == [(4, False, '')]
+    events = read_smf(data, notes=False).events
+    assert events[['tick', 'type', 'channel', 'data1']].tolist() == [
+        (0, 0xc, 3, 4), (0, 0x9, 3, 60)
+    ]
@@ -0,0 +1,78 @@
+"""
+Piano roll windows of ``MidiObject.iter_segments``.
+"""
+from ugly_midi import MidiObject, Instrument, ColumnarInstrument, Note
+from ugly_midi import TimeSignature
+import numpy as np
+import pytest
+
+
+def make_midi():
+    midi = MidiObject(resolution=24)
+    rng = np.random.RandomState(0)
+    for cls in (Instrument, ColumnarInstrument, Instrument):
+        instr = cls(0)
+        for _ in range(100):
+            start = int(rng.randint(0, 900))
+            instr.add_note(
+                Note(int(rng.randint(1, 128)), int(rng.randint(40, 80)),
+                     start, start + int(rng.randint(1, 60))))
+        midi.instruments.append(instr)
+    return midi
+
+
+def full_rolls(midi, instruments, pad, **kwargs):
+    end_time = midi.get_end_time() + pad
+    return np.stack([
+        midi.instruments[i].get_piano_roll(end_time, **kwargs)
+        for i in instruments
+    ])
+
+
+@pytest.mark.parametrize('hop', [None, 50, 200])
+def test_windows_match_full_roll(hop):
+    midi = make_midi()
+    full = full_rolls(midi, [0, 1, 2], 100)
+    starts = []
+    for start, roll in midi.iter_segments(100, hop, bar_aligned=False):
+        assert roll.shape == (3, 100, 128)
+        assert np.array_equal(roll, full[:, start:start + 100])
+        starts.append(start)
+    assert starts == list(range(0, midi.get_end_time(), hop or 100))
+
+
+def test_bar_aligned():
+    midi = make_midi()
+    # 4/4 bars of 96 ticks, then 3/4 bars of 72 ticks from tick 384
+    midi.time_signatures = [TimeSignature(3, 4, 384)]
+    starts = [start for start, _ in midi.iter_segments(80, hop=80)]
+    bars = midi.get_bar_lines().tolist()
+    assert bars[:6] == [0, 96, 192, 288, 384, 456]
+    assert starts[:4] == [0, 96, 192, 288]
+    assert set(starts) <= set(bars)
+    assert all(b - a >= 80 for a, b in zip(starts, starts[1:]))
+
+
+def test_instruments_and_options():
+    midi = make_midi()
+    chosen = [2, midi.instruments[0]]
+    full = full_rolls(midi, [2, 0], 64, dtype=np.uint8, mode='binary')
+    out = np.empty((2, 64, 128), dtype=np.uint8)
+    for start, roll in midi.iter_segments(64,
+                                          instruments=chosen,
+                                          bar_aligned=False,
+                                          dtype=np.uint8,
+                                          mode='binary',
+                                          out=out):
+        assert roll is out
+        assert np.array_equal(roll, full[:, start:start + 64])
+
+
+def test_invalid():
+    midi = make_midi()
+    with pytest.raises(ValueError):
+        next(midi.iter_segments(0))
+    with pytest.raises(ValueError):
+        next(midi.iter_segments(10, hop=-1))
+    with pytest.raises(ValueError):
+        next(midi.iter_segments(10, out=np.empty((1, 10, 128))))
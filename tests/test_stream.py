@@ -0,0 +1,111 @@
+"""
+Midi files fed to ``StreamBuilder`` in chunks and as live messages.
+"""
+from tests.generate import build_midi, random_midi
+from tests.reference import snapshot
+from ugly_midi import MidiObject, StreamBuilder
+from mido import MidiFile, Message, MetaMessage
+import io
+import pytest
+
+
+def feed_chunks(data, size, **kwargs):
+    builder = StreamBuilder(**kwargs)
+    for i in range(0, len(data), size):
+        builder.feed(data[i:i + size])
+    return builder
+
+
+def program_tracks():
+    """A type 1 file whose program changes only affect their own track"""
+    return build_midi([
+        [
+            MetaMessage('set_tempo', tempo=400000, time=0),
+            MetaMessage('key_signature', key='D', time=30),
+        ],
+        [
+            MetaMessage('track_name', name='lead'),
+            Message('control_change', control=7, value=90, time=0),
+            Message('note_on', note=60, time=0),
+            Message('note_on', note=60, velocity=0, time=10),
+            Message('program_change', program=5, time=12),
+            Message('note_on', note=62, time=12),
+            Message('pitchwheel', pitch=300, time=14),
+            Message('note_off', note=62, time=20),
+        ],
+        [
+            MetaMessage('track_name', name='drums'),
+            Message('note_on', channel=9, note=36, time=3),
+            Message('note_off', channel=9, note=36, time=4),
+        ],
+    ])
+
+
+@pytest.mark.parametrize('size', [1, 7, 100, 10**6])
+@pytest.mark.parametrize('columnar', [False, True])
+def test_chunks(size, columnar):
+    data = program_tracks()
+    builder = feed_chunks(data, size, columnar=columnar)
+    assert snapshot(builder.close()) == snapshot(MidiObject.from_bytes(data))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_type0(seed):
+    # a single track, so every program change precedes the notes it affects
+    data = random_midi(seed, midi_type=0)
+    expected = snapshot(MidiObject.from_bytes(data))
+    assert snapshot(feed_chunks(data, 13).close()) == expected
+    builder = StreamBuilder(MidiFile(file=io.BytesIO(data)).ticks_per_beat)
+    builder.feed_messages(MidiFile(file=io.BytesIO(data)).tracks[0])
+    assert snapshot(builder.get_midi()) == expected
+
+
+def test_pop_notes():
+    data = random_midi(0, midi_type=0)
+    builder = StreamBuilder()
+    popped = {}
+    for i in range(0, len(data), 50):
+        builder.feed(data[i:i + 50])
+        for instr in builder.pop_notes():
+            assert not len(instr.control_changes)
+            notes = instr.get_note_array().tolist()
+            popped.setdefault((instr.program, instr.is_drum), []).extend(notes)
+    assert builder.pop_notes() == []
+    # channels 0 and 1 share programs, so compare the notes of each key
+    expected = {}
+    for instr in builder.close().instruments:
+        key = (instr.program, instr.is_drum)
+        expected.setdefault(key, []).extend(instr.get_note_array().tolist())
+    assert {k: sorted(v) for k, v in popped.items()} == {
+        k: sorted(v) for k, v in expected.items()
+    }
+
+
+def test_open_notes():
+    builder = StreamBuilder(96)
+    builder.feed_messages([
+        Message('note_on', note=60, time=0),
+        Message('note_on', note=62, time=5),
+        Message('note_off', note=60, time=5),
+    ])
+    assert builder.n_open_notes == 1
+    midi = builder.get_midi()
+    assert [i.get_note_array().tolist() for i in midi.instruments] == [
+        [(0, 10, 60, 64)]
+    ]
+    builder.feed_messages([Message('note_off', note=62, time=2)])
+    assert builder.n_open_notes == 0
+    assert builder.pop_notes()[0].get_note_array().tolist() == [
+        (0, 10, 60, 64), (5, 12, 62, 64)
+    ]
+
+
+def test_invalid():
+    data = program_tracks()
+    builder = feed_chunks(data[:-5], 10)
+    with pytest.raises(ValueError):
+        builder.close()
+    with pytest.raises(ValueError):
+        StreamBuilder().feed(b'RIFF\x00\x00\x00\x06')
+    with pytest.raises(ValueError):
+        StreamBuilder().get_midi()
@@ -0,0 +1,102 @@
+"""
+Sustain pedal against a note by note reference.
+"""
+from ugly_midi import Instrument, ColumnarInstrument, Note
+from ugly_midi import apply_sustain, NOTE_DTYPE, CONTROL_CHANGE_DTYPE
+import numpy as np
+import pytest
+
+
+def loop_sustain(notes, control_changes, threshold=64):
+    """Holds every note released while the pedal is down until the pedal
+    is released or the same pitch starts again"""
+    intervals, press = [], None
+    for time, number, value in control_changes.tolist():
+        if number != 64:
+            continue
+        if value >= threshold and press is None:
+            press = time
+        elif value < threshold and press is not None:
+            intervals.append((press, time))
+            press = None
+    if press is not None:
+        intervals.append((press, max(n[1] for n in notes.tolist())))
+    out = []
+    for start, end, pitch, velocity in notes.tolist():
+        sustained = end
+        for press, release in intervals:
+            if press <= end < release:
+                sustained = release
+        later = [
+            n[0] for n in notes.tolist() if n[2] == pitch and n[0] > start
+        ]
+        if later:
+            sustained = min(sustained, min(later))
+        out.append((start, max(end, sustained), pitch, velocity))
+    return out
+
+
+def random_case(seed):
+    rng = np.random.RandomState(seed)
+    starts = rng.randint(0, 500, 60)
+    notes = np.array([(s, s + rng.randint(1, 50), rng.randint(60, 64),
+                       rng.randint(1, 128)) for s in starts],
+                     dtype=NOTE_DTYPE)
+    times = np.sort(rng.randint(0, 600, 20))
+    # sustain pedal values mixed with modulation wheel moves
+    controls = np.array([(t, rng.choice((1, 64, 64)), rng.randint(0, 128))
+                         for t in times],
+                        dtype=CONTROL_CHANGE_DTYPE)
+    return notes, controls
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_loop(seed):
+    notes, controls = random_case(seed)
+    before = notes.copy()
+    sustained = apply_sustain(notes, controls)
+    assert sustained.tolist() == loop_sustain(notes, controls)
+    assert np.array_equal(notes, before)
+
+
+def test_pedal():
+    notes = np.array([(0, 10, 60, 100), (5, 20, 62, 100), (30, 40, 60, 100),
+                      (50, 58, 64, 100), (52, 70, 65, 100)],
+                     dtype=NOTE_DTYPE)
+    controls = np.array([(8, 64, 127), (12, 64, 100), (25, 64, 0),
+                         (55, 64, 64)],
+                        dtype=CONTROL_CHANGE_DTYPE)
+    # both notes released between 8 and 25 are held until 25, and the
+    # pedal pressed at 55 holds until the last note ends
+    assert apply_sustain(notes, controls)['end'].tolist() == [
+        25, 25, 40, 70, 70
+    ]
+    # a higher threshold ignores the press at 55
+    assert apply_sustain(notes, controls, 65)['end'].tolist() == [
+        25, 25, 40, 58, 70
+    ]
+    # a repeated pitch cuts the held note at its start, a note starting on
+    # the same tick does not
+    notes['start'][2] = 15
+    notes = np.append(notes, notes[:1])
+    assert apply_sustain(notes, controls)['end'].tolist() == [
+        15, 25, 40, 70, 70, 15
+    ]
+    assert apply_sustain(notes, controls[:0]) is notes
+
+
+@pytest.mark.parametrize('cls', [Instrument, ColumnarInstrument])
+def test_piano_roll(cls):
+    instr = cls(0)
+    instr.add_note(Note(100, 60, 0, 10))
+    instr.add_note(Note(90, 62, 20, 30))
+    instr.control_changes = np.array([(5, 64, 127), (15, 64, 0)],
+                                     dtype=CONTROL_CHANGE_DTYPE)
+    roll = instr.get_piano_roll(40, sustain=True)
+    assert np.nonzero(roll[:, 60])[0].tolist() == list(range(15))
+    assert np.nonzero(roll[:, 62])[0].tolist() == list(range(20, 30))
+    # the notes themselves are unchanged
+    assert instr.get_note_array()['end'].tolist() == [10, 30]
+    window = instr.get_piano_roll(40, start_time=12, sustain=True)
+    assert np.array_equal(window, roll[12:])
+    assert not instr.get_piano_roll(40)[10:15].any()
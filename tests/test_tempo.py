@@ -0,0 +1,96 @@
+"""
+Tick and second conversion against mido's per-tempo arithmetic.
+"""
+from tests.generate import random_midi
+from ugly_midi import TempoMap, TempoChange, MidiObject, Instrument, Note
+from mido import MidiFile, tick2second
+import io
+import numpy as np
+import pytest
+
+
+def loop_ticks_to_seconds(tick, tempo_changes, resolution):
+    """Sums the seconds of every tempo segment before ``tick``"""
+    changes = sorted(tempo_changes, key=lambda e: e.time)
+    seconds, now, bpm = 0., 0, 120.
+    for change in changes:
+        if change.time >= tick:
+            break
+        seconds += tick2second(change.time - now, resolution,
+                               60e6 / bpm)
+        now, bpm = change.time, change.bpm
+    return seconds + tick2second(tick - now, resolution, 60e6 / bpm)
+
+
+def test_matches_loop():
+    changes = [TempoChange(90, 100), TempoChange(150, 0),
+               TempoChange(60, 400), TempoChange(200, 400)]
+    tempo_map = TempoMap(changes, 96)
+    # the last of the two changes at tick 400 wins
+    assert tempo_map.bpms.tolist() == [150, 90, 200]
+    ticks = np.arange(0, 1000, 7)
+    expected = [loop_ticks_to_seconds(t, changes[:2] + changes[3:], 96)
+                for t in ticks.tolist()]
+    assert np.allclose(tempo_map.ticks_to_seconds(ticks), expected)
+
+
+def test_default_tempo():
+    tempo_map = TempoMap([TempoChange(60, 96)], 96)
+    # 120 bpm until the first change
+    assert np.allclose(tempo_map.ticks_to_seconds([48, 96, 192]),
+                       [0.25, 0.5, 1.5])
+    assert np.allclose(TempoMap([], 24).ticks_to_seconds([24]), [0.5])
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_round_trip(seed):
+    midi = MidiObject.from_bytes(random_midi(seed))
+    tempo_map = midi.get_tempo_map()
+    ticks = np.sort(np.random.RandomState(seed).randint(0, 5000, 100))
+    seconds = tempo_map.ticks_to_seconds(ticks)
+    assert np.all(np.diff(seconds) >= 0)
+    assert np.allclose(tempo_map.seconds_to_ticks(seconds), ticks)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_mido_playback(seed):
+    data = random_midi(seed)
+    midi = MidiObject.from_bytes(data)
+    # mido merges the tracks and converts delta ticks to seconds
+    mido_file = MidiFile(file=io.BytesIO(data))
+    now, times = 0., []
+    for msg in mido_file:
+        now += msg.time
+        if msg.type == 'note_on':
+            times.append(now)
+    ticks = []
+    for track in mido_file.tracks:
+        tick = 0
+        for msg in track:
+            tick += msg.time
+            if msg.type == 'note_on':
+                ticks.append(tick)
+    assert np.allclose(
+        np.sort(midi.get_tempo_map().ticks_to_seconds(ticks)), times)
+
+
+def test_tempo_map_cache():
+    midi = MidiObject(resolution=96)
+    midi.tempo_changes = [TempoChange(120, 0)]
+    first = midi.get_tempo_map()
+    assert midi.get_tempo_map() is first
+    midi.tempo_changes[0].bpm = 60
+    assert midi.get_tempo_map() is not first
+    assert np.allclose(midi.get_tempo_map().ticks_to_seconds([96]), [1.])
+
+
+def test_time_piano_roll():
+    midi = MidiObject(resolution=96)
+    midi.tempo_changes = [TempoChange(120, 0), TempoChange(60, 96)]
+    instr = Instrument(0)
+    instr.add_note(Note(100, 60, 48, 192))
+    start, end = instr.get_note_times(midi.get_tempo_map())
+    assert np.allclose(start, [0.25]) and np.allclose(end, [1.5])
+    roll = instr.get_time_piano_roll(midi.get_tempo_map(), fs=10)
+    assert roll.shape == (15, 128)
+    assert np.nonzero(roll[:, 60])[0].tolist() == list(range(2, 15))
@@ -0,0 +1,93 @@
+"""
+Batched piano roll tensors against per-instrument rolls.
+"""
+from ugly_midi import MidiObject, Instrument, ColumnarInstrument, Note
+from ugly_midi import FAMILIES5
+import numpy as np
+import pytest
+
+# program, is_drum: piano, piano, bass, drums, sound effects (no family5)
+INSTRUMENTS = [(0, False), (1, False), (33, False), (0, True), (120, False)]
+
+
+def make_midi():
+    midi = MidiObject(resolution=24)
+    rng = np.random.RandomState(0)
+    for i, (program, is_drum) in enumerate(INSTRUMENTS):
+        instr = (ColumnarInstrument if i % 2 else Instrument)(program,
+                                                               is_drum)
+        for _ in range(80):
+            start = int(rng.randint(0, 300))
+            # the two pianos share pitches so that their rolls overlap
+            instr.add_note(
+                Note(int(rng.randint(60, 128)), int(rng.randint(60, 66)),
+                     start, start + int(rng.randint(1, 40))))
+        midi.instruments.append(instr)
+    return midi
+
+
+def rolls(midi, end_time, **kwargs):
+    return [
+        ins.get_piano_roll(end_time, **kwargs).astype(np.int64)
+        for ins in midi.instruments
+    ]
+
+
+def test_track():
+    midi = make_midi()
+    end_time = midi.get_end_time()
+    tensor = midi.get_piano_roll_tensor('track')
+    assert tensor.shape == (5, end_time, 128)
+    assert np.array_equal(tensor, np.stack(rolls(midi, end_time)))
+
+
+@pytest.mark.parametrize('reduction', ['max', 'sum', 'clip'])
+@pytest.mark.parametrize('mode', ['velocity', 'binary'])
+def test_family5(reduction, mode):
+    midi = make_midi()
+    end_time = 200
+    tensor = midi.get_piano_roll_tensor('family5', end_time,
+                                        dtype=np.int64, mode=mode,
+                                        reduction=reduction)
+    assert tensor.shape == (len(FAMILIES5), end_time, 128)
+    each = rolls(midi, end_time, mode=mode)
+    if reduction == 'clip':
+        # overlapping notes of one instrument can also sum past 127
+        limit = 127 if mode == 'velocity' else 1
+        each = [np.minimum(r, limit) for r in each]
+    piano = np.stack(each[:2])
+    if reduction == 'max':
+        expected = piano.max(axis=0)
+    elif reduction == 'sum':
+        expected = piano.sum(axis=0)
+    else:
+        expected = np.minimum(piano.sum(axis=0), limit)
+    assert np.array_equal(tensor[FAMILIES5.index('Piano')], expected)
+    assert np.array_equal(tensor[FAMILIES5.index('Bass')], each[2])
+    assert np.array_equal(tensor[FAMILIES5.index('Drums')], each[3])
+    assert not tensor[FAMILIES5.index('Guitar')].any()
+    # the sound effect is in no group
+    assert np.array_equal(tensor.sum(axis=0), expected + each[2] + each[3])
+
+
+def test_program_and_out():
+    midi = make_midi()
+    out = np.full((129, 150, 128), 7, dtype=np.uint8)
+    tensor = midi.get_piano_roll_tensor('program', out=out)
+    assert tensor is out
+    # overlapping notes can sum past the range of uint8
+    each = [np.minimum(r, 255) for r in rolls(midi, 150)]
+    assert np.array_equal(out[0], each[0])
+    assert np.array_equal(out[128], each[3])
+    assert np.array_equal(out[120], each[4])
+    assert out.sum() == sum(r.sum() for r in each)
+
+
+def test_invalid():
+    midi = make_midi()
+    with pytest.raises(ValueError):
+        midi.get_piano_roll_tensor('family')
+    with pytest.raises(ValueError):
+        midi.get_piano_roll_tensor(reduction='mean')
+    with pytest.raises(ValueError):
+        midi.get_piano_roll_tensor('track', out=np.empty((5, 10, 64)))
@@ -0,0 +1,118 @@
+"""
+Augmentation transforms, and that they leave their input alone.
+"""
+from tests.generate import build_midi
+from ugly_midi import MidiObject, Instrument, ColumnarInstrument, Note
+from ugly_midi import Transform, Transpose, TimeStretch, VelocityCurve
+from ugly_midi import Compose
+from mido import Message, MetaMessage
+import numpy as np
+import pytest
+
+
+def make_midi(columnar=False):
+    data = build_midi([
+        [
+            MetaMessage('set_tempo', tempo=500000, time=0),
+            MetaMessage('key_signature', key='C', time=96),
+            MetaMessage('time_signature', numerator=3, denominator=4,
+                        time=192),
+        ],
+        [
+            Message('note_on', note=60, velocity=100, time=0),
+            Message('control_change', control=64, value=127, time=24),
+            Message('note_on', note=60, velocity=0, time=48),
+            Message('note_on', note=126, velocity=50, time=48),
+            Message('note_on', note=126, velocity=0, time=96),
+        ],
+        [
+            Message('note_on', channel=9, note=36, velocity=90, time=0),
+            Message('note_on', channel=9, note=36, velocity=0, time=48),
+        ],
+    ])
+    return MidiObject.from_bytes(data, columnar=columnar)
+
+
+def snapshot(midi):
+    return (midi.resolution,
+            [(e.bpm, e.time) for e in midi.tempo_changes],
+            [(e.key, e.time) for e in midi.key_signatures],
+            [(e.numerator, e.denominator, e.time)
+             for e in midi.time_signatures],
+            [(i.get_note_array().tolist(), i.control_changes.tolist())
+             for i in midi.instruments])
+
+
+TRANSFORMS = [
+    Transform(),
+    Transpose(2),
+    Transpose(0),
+    TimeStretch(2.),
+    VelocityCurve(0.5),
+    Compose([Transpose(-1), TimeStretch(0.5)]),
+]
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+@pytest.mark.parametrize('transform', TRANSFORMS)
+def test_input_unchanged(transform, columnar):
+    midi = make_midi(columnar)
+    before = snapshot(midi)
+    out = transform(midi)
+    out.change_resolution(24)
+    for instr in out.instruments:
+        instr.remove_invalid_notes()
+        for n in instr.notes:
+            n.start += 1
+    assert snapshot(midi) == before
+    # the same through transform_instrument
+    for instr in midi.instruments:
+        transform(instr).change_resolution(0.25)
+    assert snapshot(midi) == before
+
+
+def test_transpose():
+    midi = make_midi()
+    clipped = Transpose(3)(midi)
+    assert clipped.instruments[0].get_note_array()['pitch'].tolist() == [
+        63, 127
+    ]
+    # drums stay where they are
+    assert clipped.instruments[1].get_note_array()['pitch'].tolist() == [36]
+    dropped = Transpose(3, out_of_range='drop')(midi)
+    assert dropped.instruments[0].get_note_array()['pitch'].tolist() == [63]
+    with pytest.raises(ValueError):
+        Transpose(1, out_of_range='wrap')
+
+
+def test_time_stretch():
+    midi = make_midi()
+    out = TimeStretch(2.)(midi)
+    notes = out.instruments[0].get_note_array()
+    assert notes[['start', 'end']].tolist() == [(0, 96), (96, 192)]
+    assert out.instruments[0].control_changes['time'].tolist() == [48]
+    assert [e.time for e in out.key_signatures] == [192]
+    assert [e.time for e in out.time_signatures] == [384]
+    assert out.resolution == midi.resolution
+
+
+def test_velocity_curve():
+    instr = Instrument(0)
+    instr.add_note(Note(100, 60, 0, 10))
+    table = np.arange(128)[::-1]
+    assert VelocityCurve(table)(instr).notes[0].velocity == 27
+    assert VelocityCurve(lambda v: v * 2)(instr).notes[0].velocity == 127
+    with pytest.raises(ValueError):
+        VelocityCurve(np.arange(10))
+
+
+def test_identity_and_types():
+    instr = ColumnarInstrument(5, name='x')
+    instr.add_note(Note(100, 60, 0, 10))
+    out = Transform()(instr)
+    assert type(out) is ColumnarInstrument and out is not instr
+    assert out.get_note_array().tolist() == instr.get_note_array().tolist()
+    assert (out.program, out.name) == (5, 'x')
+    assert len(Transform().batch([instr, instr])) == 2
+    with pytest.raises(TypeError):
+        Transform()([instr])
@@ -0,0 +1,104 @@
+"""
+The native writer against the mido writer.
+"""
+from tests.generate import build_midi, random_midi
+from tests.reference import snapshot
+from ugly_midi import MidiObject, Instrument, ColumnarInstrument, Note
+from mido import Message, MetaMessage
+import io
+import numpy as np
+import pytest
+
+pytestmark = pytest.mark.filterwarnings(
+    'ignore:Synthesizing with more than 15 instruments:RuntimeWarning')
+
+
+def write_both(midi, tmp_path):
+    """Bytes written by the mido and the native engines"""
+    path = str(tmp_path / 'mido.mid')
+    midi.write(path)
+    with open(path, 'rb') as f:
+        mido_bytes = f.read()
+    buf = io.BytesIO()
+    midi.write(buf, engine='native')
+    return mido_bytes, buf.getvalue()
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('columnar', [False, True])
+def test_random_files(tmp_path, seed, columnar):
+    midi = MidiObject.from_bytes(random_midi(seed), columnar=columnar)
+    mido_bytes, native_bytes = write_both(midi, tmp_path)
+    assert native_bytes == mido_bytes
+    # and the written file reads back as the same content
+    assert snapshot(MidiObject.from_bytes(native_bytes)) == snapshot(
+        MidiObject.from_bytes(mido_bytes))
+
+
+def test_more_than_16_instruments(tmp_path):
+    midi = MidiObject(resolution=96)
+    for program in range(20):
+        instr = Instrument(program, is_drum=program % 7 == 0)
+        instr.add_note(Note(100, 40 + program, program * 10, program * 10 +
+                            30))
+        midi.instruments.append(instr)
+    with pytest.warns(RuntimeWarning):
+        mido_bytes, native_bytes = write_both(midi, tmp_path)
+    assert native_bytes == mido_bytes
+    # the instruments past the 16th channel are left out
+    written = MidiObject.from_bytes(native_bytes)
+    assert len(written.instruments) < len(midi.instruments)
+
+
+def test_empty(tmp_path):
+    midi = MidiObject(resolution=480)
+    mido_bytes, native_bytes = write_both(midi, tmp_path)
+    assert native_bytes == mido_bytes
+    # the default meta events are filled in
+    written = MidiObject.from_bytes(native_bytes)
+    assert [(e.bpm, e.time) for e in written.tempo_changes] == [(120, 0)]
+    assert [(e.numerator, e.denominator)
+            for e in written.time_signatures] == [(4, 4)]
+
+
+def test_controls_and_meta(tmp_path):
+    data = build_midi([
+        [
+            MetaMessage('set_tempo', tempo=400000, time=0),
+            MetaMessage('key_signature', key='Eb', time=10),
+            MetaMessage('time_signature', numerator=7, denominator=8,
+                        time=20),
+        ],
+        [
+            Message('program_change', program=3, time=0),
+            Message('control_change', control=64, value=127, time=0),
+            Message('note_on', note=60, velocity=90, time=0),
+            Message('pitchwheel', pitch=-2000, time=5),
+            Message('aftertouch', value=20, time=6),
+            Message('polytouch', note=60, value=30, time=7),
+            Message('note_off', note=60, time=40),
+        ],
+    ])
+    midi = MidiObject.from_bytes(data)
+    mido_bytes, native_bytes = write_both(midi, tmp_path)
+    assert native_bytes == mido_bytes
+    written = snapshot(MidiObject.from_bytes(native_bytes))
+    assert written == snapshot(midi)
+
+
+def test_overlapping_notes(tmp_path):
+    """Note-offs sort before note-ons on the same tick in both writers"""
+    instr = ColumnarInstrument(0)
+    instr.set_note_array(
+        np.array([(0, 10, 60, 100), (10, 20, 60, 90), (5, 10, 62, 80),
+                  (10, 10, 64, 70)],
+                 dtype=instr.get_note_array().dtype))
+    midi = MidiObject(resolution=96)
+    midi.instruments = [instr]
+    mido_bytes, native_bytes = write_both(midi, tmp_path)
+    assert native_bytes == mido_bytes
+
+
+def test_unknown_engine(tmp_path):
+    with pytest.raises(ValueError):
+        MidiObject(resolution=96).write(str(tmp_path / 'x.mid'), 'other')
@@ -1,4 +1,15 @@
+from ugly_midi.version import __version__
 from ugly_midi.containers import *
 from ugly_midi.instrument import *
 from ugly_midi.midi_file import *
+from ugly_midi.smf import *
+from ugly_midi.tempo import *
 from ugly_midi.misc import *
+from ugly_midi.corpus import *
+from ugly_midi.cache import *
+from ugly_midi.dataset import *
+from ugly_midi.transforms import *
+from ugly_midi.stream import *
+from ugly_midi.profiling import *
+from ugly_midi.fingerprint import *
+from ugly_midi.aio import *
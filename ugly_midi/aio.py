@@ -0,0 +1,201 @@
+"""
+Loading and writing midi files from asyncio code without blocking the event
+loop.
+"""
+from ugly_midi.midi_file import MidiObject
+import asyncio
+import os
+import weakref
+
+
+def _load(cls, midi_file, resolution, kwargs):
+    if isinstance(midi_file, (bytes, bytearray, memoryview)):
+        return cls.from_bytes(midi_file, resolution, **kwargs)
+    return cls(midi_file, resolution, **kwargs)
+
+
+def _load_batch(requests):
+    """Loads ``(cls, midi_file, resolution, kwargs)`` requests, returns a
+    ``(midi, error)`` pair for each"""
+    results = []
+    for request in requests:
+        try:
+            results.append((_load(*request), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+def _write(midi, midi_file, engine):
+    midi.write(midi_file, engine)
+
+
+def _to_bytes(midi, engine):
+    return midi.to_bytes(engine)
+
+
+class _LoopState(object):
+    """State of an ``AsyncMidiIO`` bound to one event loop"""
+
+    def __init__(self, max_concurrency):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.pending = []
+        self.flush_handle = None
+        # keep references to the running batches
+        self.batches = set()
+
+
+class AsyncMidiIO(object):
+    """Runs loads and writes on an executor for asyncio code.
+
+    Loads can be batched: requests arriving within ``batch_delay`` of each
+    other are sent to the executor as one job, up to ``batch_size`` at a
+    time, which saves the per-job overhead of a process pool. The
+    concurrency limit and pending batches are kept per event loop, so an
+    instance can be shared by successive ``asyncio.run`` calls.
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Where files are parsed and encoded, ``None`` for the default thread
+        pool of the event loop. With a ``ProcessPoolExecutor`` the parsed
+        files are pickled back to the calling process.
+    max_concurrency : int
+        Largest number of jobs in the executor at once, ``None`` for one per
+        CPU.
+    batch_size : int
+        Largest number of loads in one job, 1 disables batching.
+    batch_delay : float
+        Seconds to wait for more loads before sending an incomplete batch.
+    """
+
+    def __init__(self,
+                 executor=None,
+                 max_concurrency=None,
+                 batch_size=1,
+                 batch_delay=0.005):
+        if batch_size < 1:
+            raise ValueError('batch_size must be positive')
+        self.executor = executor
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # event loop -> _LoopState
+        self._states = weakref.WeakKeyDictionary()
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            # the state references its loop through the semaphore, so the
+            # weak keys alone don't release closed loops
+            for closed in [l for l in self._states if l.is_closed()]:
+                del self._states[closed]
+            state = self._states[loop] = _LoopState(self.max_concurrency)
+        return state
+
+    async def _run(self, fn, *args):
+        async with self._state().semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, fn, *args)
+
+    async def load(self, midi_file, resolution=None, cls=MidiObject,
+                   **kwargs):
+        """Loads a midi file.
+        Parameters
+        ----------
+        midi_file : str or bytes
+            Path of the file, or its raw bytes which are read with
+            ``MidiObject.from_bytes``.
+        resolution : int
+            Ticks per beat to convert the file to.
+        cls : type
+            ``MidiObject`` or a subclass.
+        kwargs
+            Passed on to ``MidiObject``, or ``MidiObject.from_bytes``.
+        """
+        request = (cls, midi_file, resolution, kwargs)
+        if self.batch_size == 1:
+            return await self._run(_load, *request)
+
+        loop = asyncio.get_running_loop()
+        state = self._state()
+        future = loop.create_future()
+        state.pending.append((request, future))
+        if len(state.pending) >= self.batch_size:
+            self._flush(state)
+        elif state.flush_handle is None:
+            state.flush_handle = loop.call_later(self.batch_delay,
+                                                 self._flush, state)
+        return await future
+
+    def _flush(self, state):
+        if state.flush_handle is not None:
+            state.flush_handle.cancel()
+            state.flush_handle = None
+        batch, state.pending = state.pending, []
+        task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+        state.batches.add(task)
+        task.add_done_callback(state.batches.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            results = await self._run(_load_batch,
+                                      [request for request, _ in batch])
+        except BaseException as e:
+            # e.g. a broken process pool
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), (midi, error) in zip(batch, results):
+            if future.done():
+                # the caller was cancelled
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(midi)
+
+    async def load_many(self, midi_files, resolution=None, **kwargs):
+        """Loads several files concurrently, returns the ``MidiObject``s in
+        order. The first error is raised."""
+        return await asyncio.gather(*[
+            self.load(midi_file, resolution, **kwargs)
+            for midi_file in midi_files
+        ])
+
+    async def write(self, midi, midi_file, engine='mido'):
+        """Writes ``midi`` to a path, or to an open binary file. For a file,
+        ``midi`` is encoded with ``engine`` in the executor and only the
+        bytes are written from the event loop."""
+        if hasattr(midi_file, 'write'):
+            midi_file.write(await self._run(_to_bytes, midi, engine))
+            return
+        await self._run(_write, midi, midi_file, engine)
+
+    async def to_bytes(self, midi, engine='native'):
+        """Encodes ``midi`` with ``MidiObject.to_bytes``"""
+        return await self._run(_to_bytes, midi, engine)
+
+
+_default_io = None
+
+
+def get_default_io():
+    """The ``AsyncMidiIO`` used by ``MidiObject.aload`` and ``awrite``"""
+    global _default_io
+    if _default_io is None:
+        _default_io = AsyncMidiIO()
+    return _default_io
+
+
+def configure_aio(executor=None,
+                  max_concurrency=None,
+                  batch_size=1,
+                  batch_delay=0.005):
+    """Replaces the default ``AsyncMidiIO``, see its parameters. Returns the
+    new instance."""
+    global _default_io
+    _default_io = AsyncMidiIO(executor, max_concurrency, batch_size,
+                              batch_delay)
+    return _default_io
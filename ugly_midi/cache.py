@@ -0,0 +1,195 @@
+"""
+On-disk cache of parsed midi files, keyed by file content, resolution and
+library version
+"""
+from ugly_midi.midi_file import MidiObject
+from ugly_midi.instrument import Instrument, ColumnarInstrument
+from ugly_midi.containers import TimeSignature, KeySignature, TempoChange
+from ugly_midi.containers import CONTROL_CHANGE_DTYPE
+from ugly_midi.containers import PITCH_BEND_DTYPE, AFTERTOUCH_DTYPE
+from ugly_midi.midi_file import _concat_notes
+from ugly_midi.version import __version__
+import numpy as np
+import hashlib
+import os
+import uuid
+import zipfile
+
+# bumped whenever the layout written by ``save_npz`` changes
+CACHE_FORMAT = 2
+
+
+def cache_key(path, resolution=None, notes=True):
+    """Hex digest identifying a file's parsed content"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    h.update('|{}|{}|{}|{}'.format(resolution, bool(notes), __version__,
+                                   CACHE_FORMAT).encode())
+    return h.hexdigest()
+
+
+_CONTROL_ARRAYS = (('control_changes', CONTROL_CHANGE_DTYPE),
+                   ('pitch_bends', PITCH_BEND_DTYPE),
+                   ('aftertouches', AFTERTOUCH_DTYPE))
+
+
+def save_npz(midi, file):
+    """Writes the parsed content of a ``MidiObject`` as an ``.npz``"""
+    notes, offsets = _concat_notes(midi.instruments)
+    controls = {}
+    for field, dtype in _CONTROL_ARRAYS:
+        arrays = [getattr(instr, field) for instr in midi.instruments]
+        controls[field] = (np.concatenate(arrays).astype(dtype)
+                           if arrays else np.zeros(0, dtype=dtype))
+        controls[field + '_offsets'] = np.cumsum(
+            [0] + [len(a) for a in arrays]).astype(np.int64)
+    np.savez(
+        file,
+        resolution=midi.resolution,
+        notes=notes,
+        note_offsets=offsets.astype(np.int64),
+        programs=np.array([int(i.program) for i in midi.instruments],
+                          dtype=np.int64),
+        is_drum=np.array([i.is_drum for i in midi.instruments], dtype=bool),
+        names=np.array([i.name for i in midi.instruments], dtype=np.str_),
+        tempo_times=np.array([e.time for e in midi.tempo_changes],
+                             dtype=np.int64),
+        tempo_bpms=np.array([e.bpm for e in midi.tempo_changes],
+                            dtype=np.float64),
+        key_times=np.array([e.time for e in midi.key_signatures],
+                           dtype=np.int64),
+        keys=np.array([e.key for e in midi.key_signatures], dtype=np.str_),
+        time_signatures=np.array(
+            [(e.time, e.numerator, e.denominator)
+             for e in midi.time_signatures],
+            dtype=np.int64).reshape(-1, 3),
+        **controls)
+
+
+def load_npz(file, columnar=False):
+    """Rebuilds a ``MidiObject`` written by ``save_npz``"""
+    with np.load(file, allow_pickle=False) as data:
+        midi = MidiObject(resolution=int(data['resolution']))
+        midi.tempo_changes = [
+            TempoChange(bpm, time) for time, bpm in zip(
+                data['tempo_times'].tolist(), data['tempo_bpms'].tolist())
+        ]
+        midi.key_signatures = [
+            KeySignature(key, time)
+            for time, key in zip(data['key_times'].tolist(),
+                                 data['keys'].tolist())
+        ]
+        midi.time_signatures = [
+            TimeSignature(numerator, denominator, time) for time, numerator,
+            denominator in data['time_signatures'].tolist()
+        ]
+
+        notes, offsets = data['notes'], data['note_offsets']
+        controls = [(field, data[field], data[field + '_offsets'].tolist())
+                    for field, _ in _CONTROL_ARRAYS]
+        instrument_class = ColumnarInstrument if columnar else Instrument
+        for i, (program, is_drum, name) in enumerate(
+                zip(data['programs'].tolist(), data['is_drum'].tolist(),
+                    data['names'].tolist())):
+            instr = instrument_class(program, is_drum, name)
+            instr.set_note_array(notes[offsets[i]:offsets[i + 1]])
+            for field, events, bounds in controls:
+                setattr(instr, field, events[bounds[i]:bounds[i + 1]])
+            midi.instruments.append(instr)
+    return midi
+
+
+def _evict(cache_dir, max_bytes):
+    """Removes the least recently used entries until the cache fits"""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npz'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # another process evicted it first
+            pass
+        total -= size
+
+
+def _create_temp(cache_dir):
+    """Creates a new file in ``cache_dir`` for writing, with the mode of a
+    regular file: 0o666 minus the umask, which the kernel applies. Returns
+    its descriptor and path."""
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+    while True:
+        path = os.path.join(cache_dir, '{}.tmp'.format(uuid.uuid4().hex))
+        try:
+            return os.open(path, flags, 0o666), path
+        except FileExistsError:
+            continue
+
+
+def load_cached(path,
+                resolution=None,
+                cache_dir=None,
+                max_bytes=None,
+                columnar=False,
+                notes=True,
+                **kwargs):
+    """Loads a midi file through the cache in ``cache_dir``.
+    Parameters
+    ----------
+    path : str
+        Path to the midi file.
+    resolution : int
+        Resolution to convert to, part of the cache key.
+    cache_dir : str
+        Cache directory, ``None`` disables caching.
+    max_bytes : int
+        Size bound of the cache. Least recently used entries are evicted
+        after a write.
+    columnar : bool
+        Return ``ColumnarInstrument``s.
+    notes : bool
+        Parse the notes, part of the cache key.
+    kwargs
+        Passed on to ``MidiObject`` on a cache miss.
+    """
+    if cache_dir is None:
+        return MidiObject(
+            path, resolution, columnar=columnar, notes=notes, **kwargs)
+
+    entry = os.path.join(cache_dir,
+                         cache_key(path, resolution, notes) + '.npz')
+    try:
+        midi = load_npz(entry, columnar)
+        # mark as recently used
+        os.utime(entry)
+        return midi
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        pass
+
+    midi = MidiObject(
+        path, resolution, columnar=columnar, notes=notes, **kwargs)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a private file and rename it, so that concurrent writers and
+    # readers only ever see complete entries
+    fd, tmp_path = _create_temp(cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            save_npz(midi, f)
+        os.replace(tmp_path, entry)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    if max_bytes is not None:
+        _evict(cache_dir, max_bytes)
+    return midi
@@ -2,6 +2,19 @@
 containers copied from the Pretty Midi Project
 https://github.com/craffel/pretty-midi
 """
+import numpy as np
+
+# dtype of the structured arrays holding notes in columnar form
+NOTE_DTYPE = np.dtype([('start', np.int64), ('end', np.int64),
+                       ('pitch', np.int16), ('velocity', np.int16)])
+
+# dtypes of the per-instrument control event arrays. Pitch bends range over
+# -8192..8191, and aftertouch events have a note of -1 for channel pressure
+CONTROL_CHANGE_DTYPE = np.dtype([('time', np.int64), ('number', np.int16),
+                                 ('value', np.int16)])
+PITCH_BEND_DTYPE = np.dtype([('time', np.int64), ('pitch', np.int16)])
+AFTERTOUCH_DTYPE = np.dtype([('time', np.int64), ('note', np.int16),
+                             ('value', np.int16)])
 
 
 class Note(object):
@@ -17,6 +30,7 @@ class Note(object):
     end : float
         Note off time, absolute, in seconds.
     """
+    __slots__ = ('velocity', 'pitch', 'start', 'end')
 
     def __init__(self, velocity, pitch, start, end):
         self.velocity = int(velocity)
@@ -55,6 +69,7 @@ class TimeSignature(object):
     >>> print(ts)
     6/8 at 3.14 seconds
     """
+    __slots__ = ('numerator', 'denominator', 'time')
 
     def __init__(self, numerator, denominator, time):
         if not (isinstance(numerator, int) and numerator > 0):
@@ -84,6 +99,7 @@ class KeySignature(object):
     """Contains the key signature and the event time in seconds.
     Attributes
     """
+    __slots__ = ('key', 'time')
 
     def __init__(self, key, time):
         # if not isinstance(key_number, int) or key_number < 0 or key_number >= 24:
@@ -105,6 +121,8 @@ class KeySignature(object):
 
 
 class TempoChange(object):
+    __slots__ = ('bpm', 'time')
+
     def __init__(self, bpm, time):
         if not (isinstance(bpm, (int, float)) and bpm >= 0):
             raise ValueError(
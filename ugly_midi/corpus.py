@@ -0,0 +1,203 @@
+"""
+Batch loading of midi corpora over a process pool
+"""
+from ugly_midi.midi_file import MidiObject
+from ugly_midi.profiling import Profile
+import collections
+import concurrent.futures
+import os
+import time
+import warnings
+
+LoadResult = collections.namedtuple(
+    'LoadResult',
+    ['path', 'midi', 'error', 'warnings', 'n_notes', 'seconds', 'profile'],
+    defaults=(None, ))
+LoadResult.__doc__ = """Outcome of loading one file.
+Attributes
+----------
+path : str
+    The file that was loaded.
+midi : MidiObject
+    The loaded file, ``None`` if loading failed.
+error : Exception
+    The exception raised while loading, ``None`` on success.
+warnings : list
+    Messages of the warnings raised while loading.
+n_notes : int
+    Number of notes over all instruments.
+seconds : float
+    Time spent loading the file in the worker.
+profile : Profile
+    Stage timings of the file, labelled with its path, if profiling was
+    requested.
+"""
+
+
+class CorpusReport(object):
+    """Throughput summary of a corpus load. ``profile`` merges the profiles
+    of the results, see ``Profile.summary``."""
+
+    def __init__(self):
+        self.n_files = 0
+        self.n_failed = 0
+        self.n_warned = 0
+        self.n_notes = 0
+        self.load_seconds = 0.
+        self.wall_seconds = 0.
+        self.profile = Profile()
+
+    def add(self, result):
+        self.n_files += 1
+        self.n_failed += result.error is not None
+        self.n_warned += bool(result.warnings)
+        self.n_notes += result.n_notes
+        self.load_seconds += result.seconds
+        if result.profile is not None:
+            self.profile.merge(result.profile)
+
+    @property
+    def files_per_second(self):
+        return self.n_files / self.wall_seconds if self.wall_seconds else 0.
+
+    @property
+    def notes_per_second(self):
+        return self.n_notes / self.wall_seconds if self.wall_seconds else 0.
+
+    def __str__(self):
+        return ('{} files ({} failed, {} with warnings), {} notes in {:.2f}s: '
+                '{:.1f} files/s, {:.0f} notes/s, {:.2f}s spent in workers'.
+                format(self.n_files, self.n_failed, self.n_warned,
+                       self.n_notes, self.wall_seconds, self.files_per_second,
+                       self.notes_per_second, self.load_seconds))
+
+    def __repr__(self):
+        return ('CorpusReport(n_files={}, n_failed={}, n_notes={}, '
+                'wall_seconds={:.2f})'.format(self.n_files, self.n_failed,
+                                              self.n_notes,
+                                              self.wall_seconds))
+
+
+def load_file(path, resolution=None, profile=False, **kwargs):
+    """Loads one file into a ``LoadResult`` instead of raising. With
+    ``profile``, the stages of the load are recorded in a ``Profile``, or
+    also their allocations if ``profile`` is ``'memory'``."""
+    start = time.perf_counter()
+    prof = Profile(path, profile == 'memory') if profile else None
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        try:
+            if prof is not None:
+                with prof:
+                    midi = MidiObject(path, resolution, **kwargs)
+            else:
+                midi = MidiObject(path, resolution, **kwargs)
+            error = None
+        except Exception as e:
+            midi = None
+            error = e
+    n_notes = sum(len(i.notes) for i in midi.instruments) if midi else 0
+    return LoadResult(path, midi, error, [str(w.message) for w in caught],
+                      n_notes, time.perf_counter() - start, prof)
+
+
+def _load_chunk(paths, resolution, profile, kwargs):
+    return [load_file(path, resolution, profile, **kwargs) for path in paths]
+
+
+def iter_corpus(paths,
+                resolution=None,
+                workers=None,
+                chunksize=16,
+                ordered=True,
+                profile=False,
+                **kwargs):
+    """Loads many midi files over a process pool, yielding ``LoadResult``s.
+    Parameters
+    ----------
+    paths : iterable
+        Paths of the midi files.
+    resolution : int
+        Resolution every file is converted to, ``None`` keeps the original.
+    workers : int
+        Number of worker processes, ``None`` for one per CPU and ``0`` to
+        load in the calling process.
+    chunksize : int
+        Number of files sent to a worker at once.
+    ordered : bool
+        Yield results in the order of ``paths`` instead of as they complete.
+    profile : bool or str
+        Record the stages of every load in ``LoadResult.profile``, see
+        ``load_file``.
+    kwargs
+        Passed on to ``MidiObject``, e.g. ``engine='native'``.
+    """
+    paths = list(paths)
+    chunks = [
+        paths[i:i + chunksize] for i in range(0, len(paths), chunksize)
+    ]
+    if workers == 0:
+        for chunk in chunks:
+            for result in _load_chunk(chunk, resolution, profile, kwargs):
+                yield result
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        # keep a bounded number of chunks in flight so that finished results
+        # don't pile up in memory faster than they are consumed
+        pending = collections.deque()
+        chunks = iter(chunks)
+
+        def submit():
+            while len(pending) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                pending.append(
+                    executor.submit(_load_chunk, chunk, resolution, profile,
+                                    kwargs))
+
+        submit()
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            for future in done:
+                for result in future.result():
+                    yield result
+            submit()
+
+
+def load_corpus(paths,
+                resolution=None,
+                workers=None,
+                chunksize=16,
+                ordered=True,
+                profile=False,
+                **kwargs):
+    """Loads many midi files over a process pool.
+
+    See ``iter_corpus`` for the parameters.
+    Returns
+    -------
+    results : list
+        One ``LoadResult`` per file. Files that failed to load have an
+        ``error`` instead of aborting the run.
+    report : CorpusReport
+        Throughput of the run, and the merged stage timings with
+        ``profile``.
+    """
+    report = CorpusReport()
+    results = []
+    start = time.perf_counter()
+    for result in iter_corpus(paths, resolution, workers, chunksize, ordered,
+                              profile, **kwargs):
+        results.append(result)
+        report.add(result)
+    report.wall_seconds = time.perf_counter() - start
+    return results, report
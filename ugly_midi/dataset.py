@@ -0,0 +1,151 @@
+"""
+Packed, memory-mapped storage of many parsed midi files.
+
+A packed dataset is a directory holding
+    notes.bin         every note of every instrument, ``NOTE_DTYPE`` records
+    instruments.npy   ``INSTRUMENT_DTYPE`` rows with note offsets and metadata
+    files.npy         ``FILE_DTYPE`` rows with instrument offsets
+    meta.json         instrument names and tempo, key and time signatures
+"""
+from ugly_midi.midi_file import MidiObject
+from ugly_midi.instrument import ColumnarInstrument, rasterize
+from ugly_midi.containers import TimeSignature, KeySignature, TempoChange
+from ugly_midi.containers import NOTE_DTYPE
+from ugly_midi.version import __version__
+import numpy as np
+import json
+import os
+
+INSTRUMENT_DTYPE = np.dtype([('note_start', np.int64), ('note_end', np.int64),
+                             ('program', np.int16), ('is_drum', np.bool_),
+                             ('file', np.int64)])
+FILE_DTYPE = np.dtype([('instrument_start', np.int64),
+                       ('instrument_end', np.int64),
+                       ('resolution', np.int64)])
+
+
+def write_packed(directory, midis):
+    """Packs ``MidiObject``s into ``directory``.
+    Parameters
+    ----------
+    directory : str
+        Output directory, created if missing.
+    midis : iterable
+        The files to pack. They are consumed one at a time, so a generator
+        keeps memory bounded by a single file.
+    Returns
+    -------
+    n_files : int
+        Number of packed files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    instruments = []
+    files = []
+    meta = {'version': __version__, 'names': [], 'files': []}
+    n_notes = 0
+    with open(os.path.join(directory, 'notes.bin'), 'wb') as f:
+        for midi in midis:
+            first_instrument = len(instruments)
+            for instr in midi.instruments:
+                notes = np.ascontiguousarray(instr.get_note_array(),
+                                             dtype=NOTE_DTYPE)
+                f.write(notes.tobytes())
+                instruments.append((n_notes, n_notes + len(notes),
+                                    int(instr.program), instr.is_drum,
+                                    len(files)))
+                meta['names'].append(instr.name)
+                n_notes += len(notes)
+            files.append((first_instrument, len(instruments), midi.resolution))
+            meta['files'].append({
+                'tempo_changes': [(int(e.time), float(e.bpm))
+                                  for e in midi.tempo_changes],
+                'key_signatures': [(int(e.time), e.key)
+                                   for e in midi.key_signatures],
+                'time_signatures': [(int(e.time), e.numerator, e.denominator)
+                                    for e in midi.time_signatures],
+            })
+
+    np.save(os.path.join(directory, 'instruments.npy'),
+            np.array(instruments, dtype=INSTRUMENT_DTYPE))
+    np.save(os.path.join(directory, 'files.npy'),
+            np.array(files, dtype=FILE_DTYPE))
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return len(files)
+
+
+class PackedDataset(object):
+    """Reader of a directory written by ``write_packed``.
+
+    Notes are memory mapped, so instruments and piano roll windows are built
+    from the pages they touch without loading the rest of the dataset.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        notes_path = os.path.join(directory, 'notes.bin')
+        if os.path.getsize(notes_path):
+            self.notes = np.memmap(notes_path, dtype=NOTE_DTYPE, mode='r')
+        else:
+            self.notes = np.zeros(0, dtype=NOTE_DTYPE)
+        self.instruments = np.load(os.path.join(directory, 'instruments.npy'))
+        self.files = np.load(os.path.join(directory, 'files.npy'))
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    def __len__(self):
+        return len(self.files)
+
+    def n_instruments(self, file_idx):
+        row = self.files[file_idx]
+        return int(row['instrument_end'] - row['instrument_start'])
+
+    def _instrument_row(self, file_idx, instr_idx):
+        if not 0 <= instr_idx < self.n_instruments(file_idx):
+            raise IndexError('instrument index out of range')
+        return int(self.files[file_idx]['instrument_start']) + instr_idx
+
+    def get_note_array(self, file_idx, instr_idx):
+        """Memory mapped, read-only notes of one instrument"""
+        row = self.instruments[self._instrument_row(file_idx, instr_idx)]
+        return self.notes[row['note_start']:row['note_end']]
+
+    def get_instrument(self, file_idx, instr_idx):
+        """A ``ColumnarInstrument`` backed by the memory mapped notes"""
+        i = self._instrument_row(file_idx, instr_idx)
+        row = self.instruments[i]
+        instr = ColumnarInstrument(int(row['program']), bool(row['is_drum']),
+                                   self.meta['names'][i])
+        instr.set_note_array(self.notes[row['note_start']:row['note_end']])
+        return instr
+
+    def get_midi(self, file_idx):
+        """Rebuilds a ``MidiObject`` with memory mapped instruments"""
+        meta = self.meta['files'][file_idx]
+        midi = MidiObject(resolution=int(self.files[file_idx]['resolution']))
+        midi.tempo_changes = [
+            TempoChange(bpm, time) for time, bpm in meta['tempo_changes']
+        ]
+        midi.key_signatures = [
+            KeySignature(key, time) for time, key in meta['key_signatures']
+        ]
+        midi.time_signatures = [
+            TimeSignature(numerator, denominator, time)
+            for time, numerator, denominator in meta['time_signatures']
+        ]
+        midi.instruments = [
+            self.get_instrument(file_idx, i)
+            for i in range(self.n_instruments(file_idx))
+        ]
+        return midi
+
+    def get_piano_roll(self, file_idx, instr_idx, start_time, end_time,
+                       **kwargs):
+        """Piano roll of the frames ``[start_time, end_time)`` of one
+        instrument, see ``Instrument.get_piano_roll`` for ``kwargs``"""
+        notes = self.get_note_array(file_idx, instr_idx)
+        notes = notes[(notes['start'] < end_time) & (notes['end'] > start_time)]
+        notes = notes.copy()
+        notes['start'] -= start_time
+        notes['end'] -= start_time
+        return rasterize(notes, end_time - start_time, **kwargs)
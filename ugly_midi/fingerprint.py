@@ -0,0 +1,400 @@
+"""
+Content fingerprints of midi files for exact and near duplicate detection.
+
+Note times are converted to ``FINGERPRINT_RESOLUTION`` ticks per beat and
+taken relative to the first onset, so that the same notes at another
+resolution, tempo, track order or instrument split give the same
+fingerprint. Programs and velocities are ignored.
+"""
+from ugly_midi.instrument import notes_to_array
+from ugly_midi.midi_file import _concat_notes
+import numpy as np
+import collections
+import hashlib
+import sqlite3
+
+FINGERPRINT_RESOLUTION = 24
+# inter-onset intervals in the n-gram tokens are capped at 4 beats
+_MAX_INTERVAL = 4 * FINGERPRINT_RESOLUTION
+
+Fingerprint = collections.namedtuple('Fingerprint',
+                                     ['hash', 'instrument_hashes', 'signature'])
+Fingerprint.__doc__ = """Fingerprint of a midi file.
+Attributes
+----------
+hash : str
+    Hash of the normalized notes of all instruments together.
+instrument_hashes : list
+    Hash of the normalized notes of every instrument.
+signature : np.ndarray
+    MinHash signature of the pitch and onset n-grams, see
+    ``minhash_signature``.
+"""
+
+
+def _normalized(notes, resolution, drum=None):
+    """Sorted ``[n x 3]`` array of (start, end, pitch) at the fingerprint
+    resolution, relative to the first onset. Drum pitches are offset by 128.
+    """
+    scale = FINGERPRINT_RESOLUTION / resolution
+    start = np.round(notes['start'] * scale).astype(np.int64)
+    end = np.maximum(np.round(notes['end'] * scale).astype(np.int64),
+                     start + 1)
+    pitch = notes['pitch'].astype(np.int64)
+    if drum is not None:
+        pitch = pitch + 128 * drum
+    if len(start):
+        end -= start.min()
+        start -= start.min()
+    rows = np.stack([start, end, pitch], axis=1)
+    return rows[np.lexsort((pitch, end, start))]
+
+
+def _hash_rows(rows):
+    return hashlib.blake2b(
+        np.ascontiguousarray(rows, dtype='<i8').tobytes(),
+        digest_size=16).hexdigest()
+
+
+def instrument_hash(instr, resolution):
+    """Hash of the notes of ``instr``, normalized from ``resolution`` ticks
+    per beat, see the module docstring"""
+    rows = _normalized(instr.get_note_array(), resolution)
+    return _hash_rows(
+        np.concatenate([[[len(rows), int(instr.is_drum), 0]], rows]))
+
+
+def _file_notes(midi):
+    """All notes of ``midi`` and whether each is a drum note"""
+    notes, offsets = _concat_notes(midi.instruments)
+    drum = np.repeat(
+        np.array([i.is_drum for i in midi.instruments], dtype=np.int64),
+        np.diff(offsets))
+    return notes, drum
+
+
+def midi_hash(midi):
+    """Hash of the notes of all instruments of ``midi`` together, which
+    doesn't depend on the order or split of the instruments"""
+    notes, drum = _file_notes(midi)
+    return _hash_rows(_normalized(notes, midi.resolution, drum))
+
+
+def _mix(x):
+    """splitmix64 finalizer of an uint64 array"""
+    x = x + np.uint64(0x9e3779b97f4a7c15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def _shingles(rows, ngram):
+    """Distinct hashes of the n-grams of (pitch, inter-onset interval)
+    tokens of notes sorted by onset and pitch"""
+    start, pitch = rows[:, 0], rows[:, 2]
+    order = np.lexsort((pitch, start))
+    start, pitch = start[order], pitch[order]
+    interval = np.minimum(np.diff(start, prepend=0), _MAX_INTERVAL)
+    tokens = _mix((pitch * (_MAX_INTERVAL + 1) + interval).astype(np.uint64))
+    if not len(tokens):
+        return tokens
+    ngram = min(ngram, len(tokens))
+    n = len(tokens) - ngram + 1
+    h = np.zeros(n, dtype=np.uint64)
+    for j in range(ngram):
+        h = _mix(h ^ tokens[j:j + n])
+    return np.unique(h)
+
+
+def _permutations(n_perm, seed):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 2**32, (n_perm, 2)).astype(np.uint64)
+    b = rng.randint(0, 2**32, (n_perm, 2)).astype(np.uint64)
+    # odd multipliers permute the uint64 values
+    a = (a[:, 0] << np.uint64(32)) | a[:, 1] | np.uint64(1)
+    b = (b[:, 0] << np.uint64(32)) | b[:, 1]
+    return a, b
+
+
+def minhash_signature(notes, resolution, n_perm=128, ngram=4, seed=0,
+                      drum=None):
+    """MinHash signature of the pitch and onset n-grams of ``notes``. The
+    fraction of equal values of two signatures estimates the Jaccard
+    similarity of their sets of n-grams.
+    Parameters
+    ----------
+    notes : np.ndarray
+        Notes with dtype ``NOTE_DTYPE``, or a list of ``Note``s.
+    resolution : int
+        Ticks per beat of ``notes``.
+    n_perm : int
+        Length of the signature.
+    ngram : int
+        Number of consecutive notes in an n-gram.
+    seed : int
+        Seed of the hash permutations. Only signatures with the same
+        ``n_perm``, ``ngram`` and ``seed`` can be compared.
+    drum : np.ndarray
+        Whether each note is a drum note.
+    Returns
+    -------
+    signature : np.ndarray
+        ``n_perm`` uint64 values, all ``2**64 - 1`` without notes.
+    """
+    if not isinstance(notes, np.ndarray):
+        notes = notes_to_array(notes)
+    shingles = _shingles(_normalized(notes, resolution, drum), ngram)
+    a, b = _permutations(n_perm, seed)
+    signature = np.full(n_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+    # bound the size of the [n_perm x shingles] block
+    step = max((1 << 20) // n_perm, 1)
+    for i in range(0, len(shingles), step):
+        block = a[:, None] * shingles[None, i:i + step] + b[:, None]
+        np.minimum(signature, block.min(axis=1), out=signature)
+    return signature
+
+
+def signature_similarity(sig1, sig2):
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return float(np.mean(np.asarray(sig1) == np.asarray(sig2)))
+
+
+def midi_fingerprint(midi, n_perm=128, ngram=4, seed=0):
+    """Computes the ``Fingerprint`` of ``midi``, see ``minhash_signature``
+    for the parameters"""
+    notes, drum = _file_notes(midi)
+    return Fingerprint(
+        _hash_rows(_normalized(notes, midi.resolution, drum)),
+        [instrument_hash(i, midi.resolution) for i in midi.instruments],
+        minhash_signature(notes, midi.resolution, n_perm, ngram, seed, drum))
+
+
+def _band_buckets(signature, n_bands):
+    """One int64 bucket per band of the signature"""
+    bands = signature.reshape(n_bands, -1)
+    h = np.zeros(n_bands, dtype=np.uint64)
+    for j in range(bands.shape[1]):
+        h = _mix(h ^ bands[:, j])
+    return h.view(np.int64)
+
+
+class FingerprintIndex(object):
+    """On-disk index of file fingerprints, backed by sqlite.
+
+    Exact duplicates share their ``Fingerprint.hash``. Near duplicates are
+    found by locality sensitive hashing: the signature is cut into
+    ``n_bands`` bands, and files with an identical band are candidates,
+    verified by their signature similarity. Adding files and finding the
+    duplicates of all of them take roughly linear time.
+    Parameters
+    ----------
+    path : str
+        Database file, created if needed. ``':memory:'`` keeps it in memory.
+    n_perm, ngram, seed : int
+        Fingerprint parameters, see ``minhash_signature``. They are stored
+        with a new index and must match for an existing one.
+    n_bands : int
+        Number of bands, which must divide ``n_perm``. More bands find less
+        similar files.
+    """
+
+    def __init__(self, path, n_perm=128, ngram=4, seed=0, n_bands=32):
+        if n_perm % n_bands:
+            raise ValueError('n_bands must divide n_perm')
+        self.path = path
+        self.params = collections.OrderedDict([('n_perm', n_perm),
+                                               ('ngram', ngram),
+                                               ('seed', seed),
+                                               ('n_bands', n_bands)])
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS params (
+                name TEXT PRIMARY KEY, value INTEGER);
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY, key TEXT UNIQUE, hash TEXT,
+                signature BLOB);
+            CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER, bucket INTEGER, file_id INTEGER);
+            CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket);
+            CREATE INDEX IF NOT EXISTS bands_file ON bands (file_id);
+        ''')
+        stored = dict(self.db.execute('SELECT name, value FROM params'))
+        if not stored:
+            with self.db:
+                self.db.executemany('INSERT INTO params VALUES (?, ?)',
+                                    self.params.items())
+        elif stored != dict(self.params):
+            raise ValueError(
+                'Index {} was built with {}, got {}'.format(
+                    path, stored, dict(self.params)))
+
+    @property
+    def n_bands(self):
+        return self.params['n_bands']
+
+    def fingerprint(self, midi):
+        """Fingerprint of ``midi`` with the parameters of the index"""
+        p = self.params
+        return midi_fingerprint(midi, p['n_perm'], p['ngram'], p['seed'])
+
+    def add(self, key, midi):
+        """Adds a file, see ``add_many``"""
+        self.add_many([(key, midi)])
+
+    def add_many(self, items):
+        """Adds files in one transaction.
+        Parameters
+        ----------
+        items : iterable
+            ``(key, midi)`` pairs, where ``midi`` is a ``MidiObject`` or its
+            ``Fingerprint`` and ``key`` identifies the file, e.g. its path.
+            A key already in the index is replaced.
+        """
+        with self.db:
+            for key, midi in items:
+                fp = (midi if isinstance(midi, Fingerprint) else
+                      self.fingerprint(midi))
+                if len(fp.signature) != self.params['n_perm']:
+                    raise ValueError('Expecting a signature of {} values'.
+                                     format(self.params['n_perm']))
+                self._remove(key)
+                file_id = self.db.execute(
+                    'INSERT INTO files (key, hash, signature) '
+                    'VALUES (?, ?, ?)',
+                    (key, fp.hash, fp.signature.astype('<u8').tobytes())
+                ).lastrowid
+                buckets = _band_buckets(fp.signature, self.n_bands)
+                self.db.executemany(
+                    'INSERT INTO bands VALUES (?, ?, ?)',
+                    zip(range(self.n_bands), buckets.tolist(),
+                        [file_id] * self.n_bands))
+
+    def _remove(self, key):
+        row = self.db.execute('SELECT id FROM files WHERE key = ?',
+                              (key, )).fetchone()
+        if row is not None:
+            self.db.execute('DELETE FROM bands WHERE file_id = ?', row)
+            self.db.execute('DELETE FROM files WHERE id = ?', row)
+
+    def remove(self, key):
+        with self.db:
+            self._remove(key)
+
+    def _signatures(self, file_ids):
+        """Maps file ids to their key and signature"""
+        signatures = {}
+        # stay below the sqlite limit on query parameters
+        for i in range(0, len(file_ids), 500):
+            chunk = file_ids[i:i + 500]
+            for file_id, key, sig in self.db.execute(
+                    'SELECT id, key, signature FROM files WHERE id IN ({})'.
+                    format(','.join('?' * len(chunk))), chunk):
+                signatures[file_id] = (key, np.frombuffer(sig, dtype='<u8'))
+        return signatures
+
+    def query(self, midi, threshold=0.5):
+        """Finds the indexed files similar to ``midi``.
+        Parameters
+        ----------
+        midi : MidiObject or Fingerprint
+            The file to look up.
+        threshold : float
+            Smallest estimated similarity of the near duplicates returned.
+        Returns
+        -------
+        matches : list
+            ``(key, similarity, exact)`` triples sorted by decreasing
+            similarity, where ``exact`` tells whether the notes are
+            identical.
+        """
+        fp = (midi if isinstance(midi, Fingerprint) else
+              self.fingerprint(midi))
+        buckets = _band_buckets(fp.signature, self.n_bands)
+        file_ids = set()
+        for band, bucket in enumerate(buckets.tolist()):
+            file_ids.update(r[0] for r in self.db.execute(
+                'SELECT file_id FROM bands WHERE band = ? AND bucket = ?',
+                (band, bucket)))
+        exact = set(r[0] for r in self.db.execute(
+            'SELECT id FROM files WHERE hash = ?', (fp.hash, )))
+        file_ids |= exact
+
+        matches = []
+        for file_id, (key, sig) in self._signatures(list(file_ids)).items():
+            similarity = signature_similarity(fp.signature, sig)
+            if file_id in exact or similarity >= threshold:
+                matches.append((key, similarity, file_id in exact))
+        return sorted(matches, key=lambda m: (-m[2], -m[1], m[0]))
+
+    def exact_duplicates(self):
+        """Groups of keys of files with identical notes"""
+        groups = collections.OrderedDict()
+        for file_hash, key in self.db.execute(
+                'SELECT hash, key FROM files WHERE hash IN (SELECT hash FROM '
+                'files GROUP BY hash HAVING COUNT(*) > 1) ORDER BY hash, id'):
+            groups.setdefault(file_hash, []).append(key)
+        return list(groups.values())
+
+    def near_duplicates(self, threshold=0.5):
+        """Clusters of similar files.
+
+        The members of every LSH bucket are compared to its first member
+        and merged with it above ``threshold``, so the work is linear in the
+        number of files and similarity is transitive within a cluster.
+        Returns
+        -------
+        clusters : list
+            Lists of keys of at least two files.
+        """
+        parent = {}
+        keys = {}
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for ids, in self.db.execute(
+                'SELECT group_concat(file_id) FROM bands GROUP BY band, '
+                'bucket HAVING COUNT(*) > 1'):
+            ids = [int(i) for i in ids.split(',')]
+            signatures = self._signatures(ids)
+            first = ids[0]
+            for file_id in ids[1:]:
+                if signature_similarity(signatures[first][1],
+                                        signatures[file_id][1]) < threshold:
+                    continue
+                for i in (first, file_id):
+                    if i not in parent:
+                        parent[i] = i
+                        keys[i] = signatures[i][0]
+                root1, root2 = find(first), find(file_id)
+                if root1 != root2:
+                    parent[max(root1, root2)] = min(root1, root2)
+
+        clusters = collections.OrderedDict()
+        for file_id in sorted(parent):
+            clusters.setdefault(find(file_id), []).append(keys[file_id])
+        return list(clusters.values())
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def __contains__(self, key):
+        return self.db.execute('SELECT 1 FROM files WHERE key = ?',
+                               (key, )).fetchone() is not None
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return 'FingerprintIndex({!r}, n_files={})'.format(self.path, len(self))
@@ -1,4 +1,447 @@
 import numpy as np
+import collections
+from ugly_midi.containers import Note, NOTE_DTYPE
+from ugly_midi.containers import CONTROL_CHANGE_DTYPE, PITCH_BEND_DTYPE
+from ugly_midi.containers import AFTERTOUCH_DTYPE
+from ugly_midi.profiling import stage
+
+SHORT_NOTE_POLICIES = ('extend', 'drop', 'merge')
+
+ResolutionReport = collections.namedtuple('ResolutionReport',
+                                          ['extended', 'dropped', 'merged'])
+ResolutionReport.__doc__ = """Number of notes that collapsed to zero length
+when changing resolution, by how they were handled"""
+
+
+def notes_to_array(notes):
+    """Converts a sequence of notes into an array with dtype ``NOTE_DTYPE``"""
+    if isinstance(notes, np.ndarray):
+        return notes.astype(NOTE_DTYPE, copy=False)
+    if isinstance(notes, NoteArrayView):
+        return notes.instrument.get_note_array().copy()
+    return np.array([(n.start, n.end, n.pitch, n.velocity) for n in notes],
+                    dtype=NOTE_DTYPE)
+
+
+def _clip_to_dtype(values, dtype):
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        values = np.clip(values, info.min, info.max)
+    return values.astype(dtype, copy=False)
+
+
+def _note_deltas(notes, end_time, mode, pitch=None):
+    """Returns the (start, end, pitch, velocity) columns to rasterize.
+    ``pitch`` replaces the pitch column, e.g. by a wider key."""
+    if mode not in ('velocity', 'binary', 'onset'):
+        raise ValueError(
+            'Unknown mode {}. Expecting "velocity", "binary" or "onset".'.
+            format(mode))
+    start = np.maximum(notes['start'], 0)
+    if mode == 'onset':
+        # notes starting before the roll have no onset in it
+        end = np.minimum(notes['start'] + 1, end_time)
+    else:
+        end = np.minimum(notes['end'], end_time)
+    keep = start < end
+    if pitch is None:
+        pitch = notes['pitch']
+    start, end, pitch = start[keep], end[keep], pitch[keep]
+    if mode == 'velocity':
+        velocity = notes['velocity'][keep].astype(np.int64)
+    else:
+        velocity = np.ones(len(start), dtype=np.int64)
+    return start, end, pitch.astype(np.intp), velocity
+
+
+def roll_segments(start, end, pitch, velocity):
+    """Splits overlapping notes into runs of constant roll value.
+
+    Returns ``(start, end, pitch, value)`` arrays of the non-zero runs,
+    sorted by pitch and then by time.
+    """
+    ticks = np.concatenate([start, end])
+    pitches = np.concatenate([pitch, pitch])
+    deltas = np.concatenate([velocity, -velocity])
+    order = np.lexsort((ticks, pitches))
+    ticks, pitches, deltas = ticks[order], pitches[order], deltas[order]
+    # every note adds and removes its velocity, so the running sum returns to
+    # zero at the last event of each pitch
+    values = np.cumsum(deltas)
+    keep = (ticks[1:] > ticks[:-1]) & (values[:-1] != 0)
+    return (ticks[:-1][keep], ticks[1:][keep], pitches[:-1][keep],
+            values[:-1][keep])
+
+
+def _run_cells(start, end, pitch, value):
+    """Expands runs into the ``(rows, cols, vals)`` of their cells"""
+    lengths = end - start
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows = np.repeat(start, lengths) + np.arange(lengths.sum()) - offsets
+    return rows, np.repeat(pitch, lengths), np.repeat(value, lengths)
+
+
+# runs at least this long are written as slices, shorter ones in one
+# vectorized assignment
+SLICE_RUN_LENGTH = 64
+
+
+def _rasterize_runs(start, end, pitch, velocity, end_time, dtype, mode):
+    """Run rasterizer: writes the runs of constant value into a zeroed roll.
+
+    The cost grows with the number of sounding cells, and the pages of the
+    roll that no note reaches are never touched.
+    """
+    seg_start, seg_end, seg_pitch, seg_value = roll_segments(
+        start, end, pitch, velocity)
+    if mode != 'velocity':
+        seg_value = np.minimum(seg_value, 1)
+    seg_value = _clip_to_dtype(seg_value, dtype)
+    # writing in time order keeps consecutive writes on nearby rows
+    order = np.argsort(seg_start, kind='stable')
+    seg_start, seg_end = seg_start[order], seg_end[order]
+    seg_pitch, seg_value = seg_pitch[order], seg_value[order]
+
+    roll = np.zeros((end_time, 128), dtype=dtype)
+    is_long = seg_end - seg_start >= SLICE_RUN_LENGTH
+    for s, e, p, v in zip(seg_start[is_long].tolist(),
+                          seg_end[is_long].tolist(),
+                          seg_pitch[is_long].tolist(),
+                          seg_value[is_long].tolist()):
+        roll[s:e, p] = v
+    is_short = ~is_long
+    rows, cols, vals = _run_cells(seg_start[is_short], seg_end[is_short],
+                                  seg_pitch[is_short], seg_value[is_short])
+    roll[rows, cols] = vals
+    return roll
+
+
+# frames integrated at once by the dense rasterizer
+RASTER_CHUNK = 4096
+# sounding cells per roll cell above which the dense rasterizer is cheaper
+# than writing runs
+DENSE_RASTER_DENSITY = 0.25
+
+
+def _rasterize_dense(start, end, pitch, velocity, end_time, dtype, mode):
+    """Difference array rasterizer: +velocity at the onset, -velocity at the
+    offset, integrated over time with a cumulative sum.
+
+    The sum runs over chunks of ``RASTER_CHUNK`` frames, carrying the
+    sounding values from one chunk to the next, so that besides the roll
+    only a chunk sized temporary is allocated whatever the dtype.
+    """
+    ticks = np.concatenate([start, end])
+    keys = ticks * 128 + np.concatenate([pitch, pitch])
+    deltas = np.concatenate([velocity, -velocity])
+    order = np.argsort(keys, kind='stable')
+    keys, deltas = keys[order], deltas[order]
+    roll = np.empty((end_time, 128), dtype=dtype)
+    carry = np.zeros(128)
+    for lo in range(0, end_time, RASTER_CHUNK):
+        hi = min(lo + RASTER_CHUNK, end_time)
+        a, b = np.searchsorted(keys, [lo * 128, hi * 128])
+        # bincount returns integers instead of floats for an empty chunk
+        chunk = np.bincount(keys[a:b] - lo * 128, deltas[a:b],
+                            (hi - lo) * 128).astype(np.float64, copy=False)
+        chunk = chunk.reshape(hi - lo, 128)
+        np.cumsum(chunk, axis=0, out=chunk)
+        chunk += carry
+        carry = chunk[-1].copy()
+        if mode != 'velocity':
+            np.minimum(chunk, 1, out=chunk)
+        roll[lo:hi] = _clip_to_dtype(chunk, dtype)
+    return roll
+
+
+def rasterize(notes, end_time, dtype=np.float64, mode='velocity',
+              sparse=None):
+    """Rasterizes a ``NOTE_DTYPE`` array into a piano roll.
+
+    See ``Instrument.get_piano_roll`` for the parameters.
+    """
+    dtype = np.dtype(dtype)
+    start, end, pitch, velocity = _note_deltas(notes, end_time, mode)
+
+    if sparse is None:
+        # the dense rasterizer goes through every cell of the roll, writing
+        # runs only through the sounding ones
+        if (end - start).sum() > DENSE_RASTER_DENSITY * end_time * 128:
+            return _rasterize_dense(start, end, pitch, velocity, end_time,
+                                    dtype, mode)
+        return _rasterize_runs(start, end, pitch, velocity, end_time, dtype,
+                               mode)
+
+    if sparse not in (None, 'triplet', 'coo', 'csr'):
+        raise ValueError(
+            'Unknown sparse format {}. Expecting "triplet", "coo" or "csr".'.
+            format(sparse))
+    # sparse rolls are built from runs of constant value, one entry per
+    # sounding cell
+    seg_start, seg_end, seg_pitch, seg_value = roll_segments(
+        start, end, pitch, velocity)
+    if mode != 'velocity':
+        seg_value = np.minimum(seg_value, 1)
+    rows, cols, vals = _run_cells(seg_start, seg_end, seg_pitch,
+                                  _clip_to_dtype(seg_value, dtype))
+    if sparse == 'triplet':
+        return rows, cols, vals
+
+    try:
+        import scipy.sparse
+    except ImportError:
+        raise ImportError('scipy is required for sparse={}'.format(sparse))
+    roll = scipy.sparse.coo_matrix((vals, (rows, cols)),
+                                   shape=(end_time, 128))
+    return roll.tocsr() if sparse == 'csr' else roll
+
+
+REDUCTIONS = ('max', 'sum', 'clip')
+
+
+def rasterize_groups(notes,
+                     sources,
+                     groups,
+                     n_groups,
+                     end_time,
+                     dtype=np.float64,
+                     mode='velocity',
+                     reduction='max',
+                     out=None):
+    """Rasterizes the notes of several instruments into one
+    ``(n_groups, end_time, 128)`` array in a single pass.
+    Parameters
+    ----------
+    notes : np.ndarray
+        Notes of all instruments, dtype ``NOTE_DTYPE``.
+    sources : np.ndarray
+        Instrument index of every note.
+    groups : np.ndarray
+        Group of every instrument, -1 to leave it out.
+    n_groups : int
+        Number of groups.
+    end_time : int
+        Number of frames.
+    dtype, mode
+        See ``Instrument.get_piano_roll``.
+    reduction : str
+        How the rolls of instruments in the same group are merged:
+        ``'max'``, ``'sum'``, or ``'clip'`` for a sum clipped to the range
+        of a single roll (127, or 1 outside of velocity mode).
+    out : np.ndarray
+        Array to fill instead of allocating a new one, its dtype overrides
+        ``dtype``.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(
+            'Unknown reduction {}. Expecting one of {}.'.format(
+                reduction, REDUCTIONS))
+    shape = (n_groups, end_time, 128)
+    if out is None:
+        out = np.zeros(shape, dtype=dtype)
+    else:
+        if out.shape != shape or not out.flags.c_contiguous:
+            raise ValueError(
+                'out must be a C contiguous array of shape {}'.format(shape))
+        out[...] = 0
+    groups = np.asarray(groups, dtype=np.int64)
+    sources = np.asarray(sources, dtype=np.int64)
+    in_group = groups[sources] >= 0 if len(groups) else sources >= 0
+    notes, sources = notes[in_group], sources[in_group]
+
+    # runs of every instrument, with the mode applied per instrument
+    start, end, keys, velocity = _note_deltas(
+        notes, end_time, mode, sources * 128 + notes['pitch'])
+    seg_start, seg_end, seg_key, seg_value = roll_segments(
+        start, end, keys, velocity)
+    if mode != 'velocity':
+        seg_value = np.minimum(seg_value, 1)
+    seg_key = groups[seg_key // 128] * 128 + seg_key % 128
+    if reduction != 'max':
+        # sums of the instrument runs are again runs of constant value
+        seg_start, seg_end, seg_key, seg_value = roll_segments(
+            seg_start, seg_end, seg_key, seg_value)
+        if reduction == 'clip':
+            seg_value = np.minimum(seg_value, 127 if mode == 'velocity' else 1)
+
+    lengths = seg_end - seg_start
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows = np.repeat(seg_start, lengths) + np.arange(lengths.sum()) - offsets
+    keys = np.repeat(seg_key, lengths)
+    idx = ((keys // 128) * end_time + rows) * 128 + keys % 128
+    vals = _clip_to_dtype(np.repeat(seg_value, lengths), out.dtype)
+    flat = out.reshape(-1)
+    if reduction == 'max':
+        np.maximum.at(flat, idx, vals)
+    else:
+        flat[idx] = vals
+    return out
+
+
+def _covered(keys, start, end, query_keys, query_ticks):
+    """For every query, whether a note with the same key spans the tick,
+    ends included"""
+    if not len(keys):
+        return np.zeros(len(query_keys), dtype=bool)
+    order = np.lexsort((start, keys))
+    keys, start, end = keys[order], start[order], end[order]
+    span = int(max(end.max(), query_ticks.max(), start.max())) + 1
+    # running maximum of the note ends within each key; the key offset
+    # keeps maxima from leaking into the following key
+    reach = np.maximum.accumulate(keys * span + end) - keys * span
+    pos = np.searchsorted(keys * span + start, query_keys * span + query_ticks,
+                          'right') - 1
+    valid = pos >= 0
+    pos = np.maximum(pos, 0)
+    return valid & (keys[pos] == query_keys) & (reach[pos] >= query_ticks)
+
+
+def _check_policy(policy):
+    if policy not in SHORT_NOTE_POLICIES:
+        raise ValueError(
+            'Unknown policy {}. Expecting one of {}.'.format(
+                policy, SHORT_NOTE_POLICIES))
+
+
+def scale_notes(notes, scale, policy='extend', groups=None):
+    """Rescales the times of a ``NOTE_DTYPE`` array.
+    Parameters
+    ----------
+    notes : np.ndarray
+        Notes to rescale.
+    scale : float or np.ndarray
+        Ratio of the new to the old resolution, or one ratio per note.
+    policy : str
+        How notes collapsing to zero length are handled: ``'extend'`` makes
+        them one tick long, ``'drop'`` removes them and ``'merge'`` removes
+        them when a note of the same pitch (and group) spans or touches
+        their tick, or when they repeat one another, and extends the rest.
+    groups : np.ndarray
+        Group index of every note, e.g. its instrument. Notes only merge
+        within their group.
+    Returns
+    -------
+    notes : np.ndarray
+        Rescaled notes, in the original order.
+    keep : np.ndarray
+        Boolean mask of the input notes that were kept.
+    report : ResolutionReport
+        Number of collapsed notes handled by each policy.
+    """
+    _check_policy(policy)
+    start = np.round(notes['start'] * scale).astype(np.int64)
+    end = np.round(notes['end'] * scale).astype(np.int64)
+    collapsed = start == end
+    extend = collapsed
+    merged = np.zeros(len(notes), dtype=bool)
+
+    if policy == 'merge' and collapsed.any():
+        keys = notes['pitch'].astype(np.int64)
+        if groups is not None:
+            keys = keys + 128 * np.asarray(groups, dtype=np.int64)
+        idx = np.nonzero(collapsed)[0]
+        absorbed = _covered(keys[~collapsed], start[~collapsed],
+                            end[~collapsed], keys[idx], start[idx])
+        merged[idx[absorbed]] = True
+        # of the remaining collapsed notes on the same key and tick, only the
+        # first one is extended
+        rest = idx[~absorbed]
+        _, first = np.unique(np.stack([keys[rest], start[rest]], axis=1),
+                             axis=0, return_index=True)
+        merged[rest] = True
+        merged[rest[first]] = False
+        extend = collapsed & ~merged
+
+    if policy == 'drop':
+        keep = ~collapsed
+        report = ResolutionReport(0, int(collapsed.sum()), 0)
+    else:
+        keep = ~merged
+        report = ResolutionReport(int(extend.sum()), 0, int(merged.sum()))
+
+    out = notes.copy()
+    out['start'] = start
+    out['end'] = end + extend
+    return out[keep], keep, report
+
+
+SUSTAIN_PEDAL = 64
+
+
+def apply_sustain(notes, control_changes, threshold=64):
+    """Extends notes held by the sustain pedal.
+
+    A note released while the pedal is down sounds until the pedal is
+    released, or until the next note of the same pitch starts.
+    Parameters
+    ----------
+    notes : np.ndarray
+        Notes with dtype ``NOTE_DTYPE``.
+    control_changes : np.ndarray
+        Control changes with dtype ``CONTROL_CHANGE_DTYPE``, sorted by time.
+    threshold : int
+        Pedal values from ``threshold`` on are down.
+    """
+    pedal = control_changes[control_changes['number'] == SUSTAIN_PEDAL]
+    if not len(pedal) or not len(notes):
+        return notes
+    down = pedal['value'] >= threshold
+    was_down = np.concatenate([[False], down[:-1]])
+    presses = pedal['time'][down & ~was_down]
+    releases = pedal['time'][~down & was_down]
+    if not len(presses):
+        return notes
+    if len(releases) < len(presses):
+        # a pedal that is never released holds until the last note ends
+        releases = np.append(releases, notes['end'].max())
+
+    end = notes['end']
+    idx = np.searchsorted(presses, end, 'right') - 1
+    held = (idx >= 0) & (end < releases[np.maximum(idx, 0)])
+    sustained = np.where(held, releases[np.maximum(idx, 0)], end)
+
+    # a repeated note cuts the sustained one, but never shortens it. Notes
+    # of the same pitch starting on the same tick do not cut each other.
+    start = notes['start'].astype(np.int64)
+    pitch = notes['pitch'].astype(np.int64)
+    offset = start - start.min()
+    keys = pitch * (int(offset.max()) + 1) + offset
+    order = np.argsort(keys, kind='stable')
+    pos = np.searchsorted(keys[order], keys, 'right')
+    following = order[np.minimum(pos, len(notes) - 1)]
+    next_start = np.where(
+        (pos < len(notes)) & (pitch[following] == pitch), start[following],
+        np.iinfo(np.int64).max)
+    notes = notes.copy()
+    notes['end'] = np.maximum(end, np.minimum(sustained, next_start))
+    return notes
+
+
+class NoteIndex(object):
+    """Index of notes sorted by start, with the running maximum of their
+    ends, for time range queries.
+
+    Notes overlapping ``[t0, t1)`` start before ``t1``, and the first note
+    that may end after ``t0`` is where the running maximum passes ``t0``, so
+    both ends of the candidate run are found by binary search.
+    """
+
+    def __init__(self, notes):
+        self.order = np.argsort(notes['start'], kind='stable')
+        self.start = notes['start'][self.order]
+        self.end = notes['end'][self.order]
+        self.pitch = notes['pitch'][self.order]
+        self.reach = np.maximum.accumulate(self.end) if len(notes) else self.end
+
+    def query(self, start_time, end_time, pitch_lo=0, pitch_hi=127):
+        """Indices of the notes sounding in ``[start_time, end_time)`` with
+        a pitch in ``[pitch_lo, pitch_hi]``, in note order"""
+        lo = np.searchsorted(self.reach, start_time, 'right')
+        hi = np.searchsorted(self.start, end_time, 'left')
+        mask = ((self.end[lo:hi] > start_time) &
+                (self.pitch[lo:hi] >= pitch_lo) &
+                (self.pitch[lo:hi] <= pitch_hi))
+        return np.sort(self.order[lo:hi][mask])
 
 
 class Instrument(object):
@@ -9,28 +452,191 @@ class Instrument(object):
         self.is_drum = is_drum
         self.name = name
         self.notes = []
+        self.control_changes = np.zeros(0, dtype=CONTROL_CHANGE_DTYPE)
+        self.pitch_bends = np.zeros(0, dtype=PITCH_BEND_DTYPE)
+        self.aftertouches = np.zeros(0, dtype=AFTERTOUCH_DTYPE)
+
+    @property
+    def notes(self):
+        """List of ``Note`` objects. Assigning a new list drops the cached
+        ``NoteIndex``; editing the list or its notes in place needs a call to
+        ``invalidate_note_index``."""
+        return self._notes
+
+    @notes.setter
+    def notes(self, notes):
+        self._notes = notes
+        self._note_index = None
 
     def add_note(self, note):
-        self.notes.append(note)
+        self._notes.append(note)
+        self._note_index = None
 
-    def get_piano_roll(self, end_time=None):
-        """Gets a piano roll aligned by beats"""
-        if not self.notes:
+    def get_note_array(self):
+        """Returns the notes as an array with dtype ``NOTE_DTYPE``"""
+        return notes_to_array(self.notes)
+
+    def set_note_array(self, note_array):
+        """Replaces the notes with the rows of a ``NOTE_DTYPE`` array"""
+        self.notes = [
+            Note(velocity, pitch, start, end)
+            for start, end, pitch, velocity in note_array.tolist()
+        ]
+
+    def _get_indexed_notes(self):
+        """The note array and its ``NoteIndex``, cached together until a
+        note is added or ``notes`` is assigned"""
+        if self._note_index is None:
+            notes = self.get_note_array()
+            self._note_index = (notes, NoteIndex(notes))
+        return self._note_index
+
+    def get_note_index(self):
+        """``NoteIndex`` of the notes, built on the first query and cached
+        until the notes change, see ``invalidate_note_index``"""
+        return self._get_indexed_notes()[1]
+
+    def invalidate_note_index(self):
+        """Drops the cached ``NoteIndex``. Adding notes with ``add_note``
+        or assigning ``notes`` drops it already, but edits the instrument
+        can't see need this call: changing the ``notes`` list or its
+        ``Note`` objects in place, or writing to the array returned by
+        ``ColumnarInstrument.get_note_array``."""
+        self._note_index = None
+
+    def note_indices_in_range(self,
+                              start_time,
+                              end_time,
+                              pitch_lo=0,
+                              pitch_hi=127):
+        """Indices in ``notes`` of the notes sounding in
+        ``[start_time, end_time)`` with a pitch in ``[pitch_lo, pitch_hi]``"""
+        return self.get_note_index().query(start_time, end_time, pitch_lo,
+                                           pitch_hi)
+
+    def note_array_in_range(self,
+                            start_time,
+                            end_time,
+                            pitch_lo=0,
+                            pitch_hi=127):
+        """``NOTE_DTYPE`` array of the notes sounding in
+        ``[start_time, end_time)`` with a pitch in ``[pitch_lo, pitch_hi]``,
+        a copy sliced from the note array cached with ``get_note_index``"""
+        notes, index = self._get_indexed_notes()
+        return notes[index.query(start_time, end_time, pitch_lo, pitch_hi)]
+
+    def notes_in_range(self, start_time, end_time, pitch_lo=0, pitch_hi=127):
+        """Notes sounding in ``[start_time, end_time)`` with a pitch in
+        ``[pitch_lo, pitch_hi]``, see ``note_indices_in_range``"""
+        notes = self.notes
+        return [
+            notes[i] for i in self.note_indices_in_range(
+                start_time, end_time, pitch_lo, pitch_hi).tolist()
+        ]
+
+    def get_piano_roll(self,
+                       end_time=None,
+                       dtype=np.float64,
+                       mode='velocity',
+                       sparse=None,
+                       start_time=0,
+                       sustain=False):
+        """Gets a piano roll aligned by beats
+        Parameters
+        ----------
+        end_time : int
+            End of the roll, defaults to the end of the last note.
+        dtype : np.dtype
+            Dtype of the roll. Integer rolls are clipped to the dtype range.
+        mode : str
+            ``'velocity'`` sums the velocities of the sounding notes,
+            ``'binary'`` marks sounding notes with 1 and ``'onset'`` marks
+            the first frame of every note with 1.
+        sparse : str
+            ``None`` for a dense ``(end_time, 128)`` array, ``'triplet'`` for
+            a ``(rows, cols, vals)`` tuple, ``'coo'`` or ``'csr'`` for a
+            scipy sparse matrix.
+        start_time : int
+            Start of the roll. Only the notes sounding in
+            ``[start_time, end_time)`` are rasterized, into
+            ``end_time - start_time`` frames. A non-zero start queries
+            ``get_note_index``. The roll has no frames when ``start_time``
+            is past the end of the last note and ``end_time`` is not set.
+        sustain : bool
+            Extend the notes held by the sustain pedal, see
+            ``apply_sustain``.
+        """
+        if end_time is not None and end_time < start_time:
+            raise ValueError(
+                'end_time {} is before start_time {}'.format(
+                    end_time, start_time))
+        if not len(self.notes) and sparse is None:
             return np.array([[] * 128])
+        if start_time and not sustain and end_time is not None:
+            notes = self.note_array_in_range(start_time, end_time)
+        else:
+            notes = self.get_note_array()
+            if sustain:
+                notes = apply_sustain(notes, self.control_changes)
+            if end_time is None:
+                end_time = max(int(notes['end'].max(initial=0)), start_time)
+            if start_time or end_time < notes['end'].max(initial=0):
+                notes = notes[(notes['start'] < end_time) &
+                              (notes['end'] > start_time)]
+        # the notes are a copy whenever start_time is set
+        if start_time:
+            notes['start'] -= start_time
+            notes['end'] -= start_time
+        with stage('rasterize') as timer:
+            timer.count = len(notes)
+            return rasterize(notes, end_time - start_time, dtype, mode,
+                             sparse)
 
-        end_time = self.get_end_time() if end_time is None else end_time
-        piano_roll = np.zeros((end_time, 128))
+    def get_note_times(self, tempo_map):
+        """Start and end times of the notes in seconds.
+        Parameters
+        ----------
+        tempo_map : TempoMap
+            Tempo map of the file, see ``MidiObject.get_tempo_map``.
+        Returns
+        -------
+        start, end : np.ndarray
+            Float arrays in the order of ``notes``.
+        """
+        notes = self.get_note_array()
+        return (tempo_map.ticks_to_seconds(notes['start']),
+                tempo_map.ticks_to_seconds(notes['end']))
 
-        # fill piano roll with notes
-        for n in self.notes:
-            start = n.start
-            if start >= end_time:
-                continue
-            end = min(n.end, end_time)
-            piano_roll[start:end, n.pitch] += n.velocity
+    def get_time_piano_roll(self,
+                            tempo_map,
+                            fs=100,
+                            n_frames=None,
+                            dtype=np.float64,
+                            mode='velocity',
+                            sparse=None):
+        """Gets a piano roll sampled at ``fs`` frames per second
+        Parameters
+        ----------
+        tempo_map : TempoMap
+            Tempo map of the file, see ``MidiObject.get_tempo_map``.
+        fs : float
+            Frames per second.
+        n_frames : int
+            Number of frames, defaults to the end of the last note.
+        dtype, mode, sparse
+            See ``get_piano_roll``.
+        """
+        notes = self.get_note_array()
+        if not len(notes) and sparse is None:
+            return np.array([[] * 128])
 
-        # TODO: pitch bends and pedals
-        return piano_roll
+        start, end = self.get_note_times(tempo_map)
+        notes = notes.copy()
+        notes['start'] = np.round(start * fs)
+        notes['end'] = np.round(end * fs)
+        if n_frames is None:
+            n_frames = int(notes['end'].max()) if len(notes) else 0
+        return rasterize(notes, n_frames, dtype, mode, sparse)
 
     def get_end_time(self):
         if not self.notes:
@@ -40,16 +646,170 @@ class Instrument(object):
     def remove_invalid_notes(self):
         self.notes = [n for n in self.notes if n.start < n.end]
 
-    def change_resolution(self, scale, discard_short_notes=False):
-        for n in self.notes:
-            start = round(n.start * scale)
-            end = round(n.end * scale)
-            if start == end:
-                if discard_short_notes:
-                    return
-                end += 1
+    def change_resolution(self,
+                          scale,
+                          discard_short_notes=False,
+                          policy=None):
+        """Rescales note times by ``scale``, see ``scale_notes`` for
+        ``policy``. ``discard_short_notes`` is a shorthand for
+        ``policy='drop'``. Returns a ``ResolutionReport``."""
+        if policy is None:
+            policy = 'drop' if discard_short_notes else 'extend'
+        with stage('change_resolution') as timer:
+            notes = self.get_note_array()
+            timer.count = len(notes)
+            notes, keep, report = scale_notes(notes, scale, policy)
+            self._set_scaled_notes(notes, keep)
+            self._scale_controls(scale)
+        return report
+
+    def _scale_controls(self, scale):
+        """Rescales the times of the control event arrays"""
+        for name in ('control_changes', 'pitch_bends', 'aftertouches'):
+            events = getattr(self, name).copy()
+            events['time'] = np.round(events['time'] * scale)
+            setattr(self, name, events)
+
+    def _set_scaled_notes(self, notes, keep):
+        """Stores the output of ``scale_notes``, updating the ``Note``
+        objects in place instead of rebuilding them"""
+        kept = [n for n, k in zip(self.notes, keep.tolist()) if k]
+        for n, start, end in zip(kept, notes['start'].tolist(),
+                                 notes['end'].tolist()):
             n.start, n.end = start, end
+        self.notes = kept
 
     def __repr__(self):
         return 'Instrument(program={}, is_drum={}, name="{}")'.format(
             self.program, self.is_drum, self.name.replace('"', r'\"'))
+
+
+class ColumnarInstrument(Instrument):
+    """Instrument storing its notes in a single ``NOTE_DTYPE`` array.
+
+    ``notes`` is a lazy sequence of ``NoteView`` objects reading from and
+    writing to the array, so code written against ``Instrument`` keeps
+    working while a note costs 20 bytes instead of a Python object.
+    """
+
+    @property
+    def notes(self):
+        return NoteArrayView(self)
+
+    @notes.setter
+    def notes(self, notes):
+        self.set_note_array(notes_to_array(notes))
+
+    def add_note(self, note):
+        if self._n_notes == len(self._note_buffer):
+            # grow geometrically so that appending stays amortized O(1)
+            buffer = np.zeros(max(16, 2 * self._n_notes), dtype=NOTE_DTYPE)
+            buffer[:self._n_notes] = self._note_buffer[:self._n_notes]
+            self._note_buffer = buffer
+        self._note_buffer[self._n_notes] = (note.start, note.end, note.pitch,
+                                            note.velocity)
+        self._n_notes += 1
+
+    def get_note_array(self):
+        """Returns the note array itself, not a copy"""
+        return self._note_buffer[:self._n_notes]
+
+    def set_note_array(self, note_array):
+        """Uses ``note_array`` as note storage without copying it"""
+        self._note_buffer = np.asarray(note_array).astype(NOTE_DTYPE,
+                                                          copy=False)
+        self._n_notes = len(self._note_buffer)
+
+    def _get_indexed_notes(self):
+        """The note array and its ``NoteIndex``, cached together until notes
+        are added, replaced or edited through a ``NoteView``"""
+        cached = getattr(self, '_note_index', None)
+        if (cached is None or cached[0] is not self._note_buffer or
+                cached[1] != self._n_notes):
+            notes = self.get_note_array()
+            cached = (self._note_buffer, self._n_notes, notes,
+                      NoteIndex(notes))
+            self._note_index = cached
+        return cached[2], cached[3]
+
+    def get_end_time(self):
+        if not self._n_notes:
+            return 0
+        return int(self.get_note_array()['end'].max())
+
+    def remove_invalid_notes(self):
+        notes = self.get_note_array()
+        self.set_note_array(notes[notes['start'] < notes['end']])
+
+    def _set_scaled_notes(self, notes, keep):
+        self.set_note_array(notes)
+
+
+class NoteView(object):
+    """A ``Note``-like view of one row of a ``ColumnarInstrument``"""
+    __slots__ = ('_instrument', '_index')
+
+    def __init__(self, instrument, index):
+        self._instrument = instrument
+        self._index = index
+
+    def _get(self, field):
+        return int(self._instrument._note_buffer[field][self._index])
+
+    def _set(self, field, value):
+        self._instrument._note_buffer[field][self._index] = int(value)
+        self._instrument.invalidate_note_index()
+
+    start = property(lambda self: self._get('start'),
+                     lambda self, value: self._set('start', value))
+    end = property(lambda self: self._get('end'),
+                   lambda self, value: self._set('end', value))
+    pitch = property(lambda self: self._get('pitch'),
+                     lambda self, value: self._set('pitch', value))
+    velocity = property(lambda self: self._get('velocity'),
+                        lambda self, value: self._set('velocity', value))
+
+    def get_duration(self):
+        return self.end - self.start
+
+    @property
+    def duration(self):
+        return self.get_duration()
+
+    def __repr__(self):
+        return 'Note(start={:f}, end={:f}, pitch={}, velocity={})'.format(
+            self.start, self.end, self.pitch, self.velocity)
+
+
+class NoteArrayView(object):
+    """Sequence of ``NoteView`` objects over a ``ColumnarInstrument``"""
+    __slots__ = ('instrument', )
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+
+    def __len__(self):
+        return self.instrument._n_notes
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [NoteView(self.instrument, i)
+                    for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('note index out of range')
+        return NoteView(self.instrument, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield NoteView(self.instrument, i)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def append(self, note):
+        self.instrument.add_note(note)
@@ -1,22 +1,262 @@
-from ugly_midi.instrument import Instrument
-from ugly_midi.containers import Note, TimeSignature, KeySignature, TempoChange
+from ugly_midi.instrument import Instrument, ColumnarInstrument, rasterize
+from ugly_midi.instrument import rasterize_groups
+from ugly_midi.instrument import ResolutionReport, scale_notes
+from ugly_midi.instrument import _check_policy
+from ugly_midi.containers import TimeSignature, KeySignature, TempoChange
+from ugly_midi.containers import NOTE_DTYPE, CONTROL_CHANGE_DTYPE
+from ugly_midi.containers import PITCH_BEND_DTYPE, AFTERTOUCH_DTYPE
+from ugly_midi.tempo import TempoMap, DEFAULT_BPM
+from ugly_midi.profiling import stage
+from ugly_midi.smf import read_smf, NOTE_ON, NOTE_OFF, PROGRAM_CHANGE
+from ugly_midi.smf import EVENT_DTYPE, CONTROL_CHANGE, PITCH_BEND
+from ugly_midi.smf import POLY_AFTERTOUCH, CHANNEL_AFTERTOUCH
+from ugly_midi.smf import META_KEY_SIGNATURE, META_TIME_SIGNATURE
+from ugly_midi.smf import META_SET_TEMPO
+from ugly_midi.smf import encode_header, encode_meta_events
+from ugly_midi.smf import encode_channel_events, key_signature_payload
+from ugly_midi.smf import time_signature_payload, tempo_payload
 from mido import MidiFile, MetaMessage, Message, bpm2tempo, tempo2bpm
 import numpy as np
 import warnings
 import collections
+import io
 
 MAX_TICK = 1e7
 
 
+def _check_header(midi_type, n_tracks, midi_file):
+    if midi_type not in [0, 1]:
+        raise ValueError('Midi type {} ({}) is not supported.'.format(
+            midi_type, midi_file))
+    if n_tracks < 1:
+        raise ValueError(
+            'File {} appears to have no midi tracks. It is invalid.'.format(
+                midi_file))
+
+
+def _check_resolution(resolution):
+    if (not isinstance(resolution, int)) or (resolution <= 0):
+        raise ValueError(
+            'Invalid resolution {} specified. Expecting a positive integer.'.
+            format(resolution))
+
+
+def _read_smf(source, notes=True):
+    with stage('smf_parse') as timer:
+        smf = read_smf(source, notes)
+        timer.count = len(smf.events)
+    return smf
+
+
+def _check_max_tick(max_tick):
+    if max_tick > MAX_TICK:
+        raise ValueError(('MIDI file has a largest tick of {},'
+                          ' it is likely corrupt'.format(max_tick)))
+
+
+def _warn_meta_on_other_tracks():
+    warnings.warn(
+        "Tempo, Key or Time signature change events found on "
+        "non-zero tracks.  This is not a valid type 0 or type 1 "
+        "MIDI file.  Tempo, Key or Time Signature may be wrong.",
+        RuntimeWarning)
+
+
+def _programs_at(events):
+    """Returns the program in effect on the channel of every event.
+    Parameters
+    ----------
+    events : np.ndarray
+        Events with dtype ``smf.EVENT_DTYPE`` in playback order.
+    """
+    n = len(events)
+    channels = events['channel'].astype(np.int64)
+    keys = channels * (n + 1) + np.arange(n)
+    is_change = events['type'] == PROGRAM_CHANGE
+    if not is_change.any():
+        return np.zeros(n, dtype=np.int64)
+    order = np.argsort(keys[is_change])
+    change_keys = keys[is_change][order]
+    change_programs = events['data1'][is_change].astype(np.int64)[order]
+    # the keys are ordered by channel first, so the preceding program change
+    # of an event is found by a binary search over the program changes
+    idx = np.searchsorted(change_keys, keys, 'left') - 1
+    found = idx >= 0
+    found[found] = change_keys[idx[found]] // (n + 1) == channels[found]
+    return np.where(found, change_programs[np.maximum(idx, 0)], 0)
+
+
+def _concat_notes(instruments):
+    """Concatenates the note arrays of ``instruments``.
+    Returns
+    -------
+    notes : np.ndarray
+        Notes of all instruments, in instrument order.
+    offsets : np.ndarray
+        Index of the first note of every instrument, followed by the total.
+    """
+    note_arrays = [ins.get_note_array() for ins in instruments]
+    offsets = np.cumsum([0] + [len(notes) for notes in note_arrays])
+    # filling a preallocated array is much cheaper than np.concatenate for
+    # many small structured arrays
+    notes = np.empty(offsets[-1], dtype=NOTE_DTYPE)
+    for i, instrument_notes in enumerate(note_arrays):
+        notes[offsets[i]:offsets[i + 1]] = instrument_notes
+    return notes, offsets
+
+
+def _file_span(midi, bar_aligned=True):
+    """Length of ``midi`` in ticks: the end of its last note or meta event,
+    rounded up to a bar line if ``bar_aligned``"""
+    meta = midi.tempo_changes + midi.key_signatures + midi.time_signatures
+    span = max([midi.get_end_time()] + [e.time for e in meta])
+    if not bar_aligned:
+        return span
+    longest_bar = max([4 * midi.resolution] + [
+        4 * midi.resolution * ts.numerator / ts.denominator
+        for ts in midi.time_signatures
+    ])
+    bars = midi.get_bar_lines(span + int(np.ceil(longest_bar)) + 1)
+    return int(bars[np.searchsorted(bars, span)])
+
+
+def _instrument_events(instr, channel):
+    """Channel events of one instrument in write order: the program change,
+    then the control changes, pitch bends, aftertouch and note on/offs,
+    stable sorted by time.
+    Returns
+    -------
+    ticks, status, data1, data2 : np.ndarray
+        Absolute ticks, status bytes and data bytes.
+    """
+    notes = instr.get_note_array()
+    cc, bends, touches = (instr.control_changes, instr.pitch_bends,
+                          instr.aftertouches)
+    n = len(notes)
+    bend = bends['pitch'].astype(np.int64) + 8192
+    poly = touches['note'] >= 0
+    touch_status = np.where(poly, POLY_AFTERTOUCH, CHANNEL_AFTERTOUCH)
+    # note on/offs interleaved, like the order they are written by mido
+    note_ticks = np.zeros(2 * n, dtype=np.int64)
+    note_ticks[0::2], note_ticks[1::2] = notes['start'], notes['end']
+    note_status = np.tile([NOTE_ON, NOTE_OFF], n)
+    note_data1 = np.repeat(notes['pitch'], 2)
+    note_data2 = np.zeros(2 * n, dtype=np.int64)
+    note_data2[0::2] = notes['velocity']
+
+    ticks = np.concatenate([[0], cc['time'], bends['time'], touches['time'],
+                            note_ticks]).astype(np.int64)
+    status = np.concatenate([[PROGRAM_CHANGE],
+                             np.full(len(cc), CONTROL_CHANGE),
+                             np.full(len(bends), PITCH_BEND), touch_status,
+                             note_status]).astype(np.int64) << 4 | channel
+    data1 = np.concatenate([[instr.program], cc['number'], bend & 0x7f,
+                            np.where(poly, touches['note'], touches['value']),
+                            note_data1]).astype(np.int64)
+    data2 = np.concatenate([[0], cc['value'], bend >> 7,
+                            np.where(poly, touches['value'], 0),
+                            note_data2]).astype(np.int64)
+    order = np.argsort(ticks[1:], kind='stable') + 1
+    order = np.concatenate([[0], order])
+    return ticks[order], status[order], data1[order], data2[order]
+
+
+def _run_starts(values):
+    """Boolean mask of the elements that differ from their predecessor"""
+    starts = np.ones(len(values), dtype=bool)
+    starts[1:] = values[1:] != values[:-1]
+    return starts
+
+
+def _mido_events(midi_data):
+    """Converts the channel events of mido tracks with absolute times to an
+    ``EVENT_DTYPE`` array, returns it with the track names"""
+    # This dict will map track indices to any track names encountered
+    track_names = {}
+    records = []
+    for track_idx, track in enumerate(midi_data.tracks):
+        for event in track:
+            if event.type == 'track_name':
+                track_names[track_idx] = event.name
+            elif event.type == 'program_change':
+                records.append((track_idx, event.time, PROGRAM_CHANGE,
+                                event.channel, event.program, 0))
+            elif event.type == 'note_on':
+                records.append((track_idx, event.time, NOTE_ON,
+                                event.channel, event.note, event.velocity))
+            elif event.type == 'note_off':
+                records.append((track_idx, event.time, NOTE_OFF,
+                                event.channel, event.note, event.velocity))
+            elif event.type == 'control_change':
+                records.append((track_idx, event.time, CONTROL_CHANGE,
+                                event.channel, event.control, event.value))
+            elif event.type == 'pitchwheel':
+                bend = event.pitch + 8192
+                records.append((track_idx, event.time, PITCH_BEND,
+                                event.channel, bend & 0x7f, bend >> 7))
+            elif event.type == 'polytouch':
+                records.append((track_idx, event.time, POLY_AFTERTOUCH,
+                                event.channel, event.note, event.value))
+            elif event.type == 'aftertouch':
+                records.append((track_idx, event.time, CHANNEL_AFTERTOUCH,
+                                event.channel, event.value, 0))
+    return np.array(records, dtype=EVENT_DTYPE), track_names
+
+
+MidiInfo = collections.namedtuple('MidiInfo', [
+    'type', 'resolution', 'n_tracks', 'tempo_changes', 'key_signatures',
+    'time_signatures', 'instruments'
+])
+
+
+def scan(midi_file):
+    """Reads the header, the track 0 meta events and the instrument programs
+    of a midi file without building any notes.
+    Returns
+    -------
+    info : MidiInfo
+        ``instruments`` holds empty ``Instrument``s with program, drum flag
+        and track name.
+    """
+    smf = _read_smf(midi_file, notes=False)
+    midi = MidiObject.__new__(MidiObject)
+    midi._load_smf(smf, midi_file, notes=False)
+    return MidiInfo(smf.type, smf.resolution, smf.n_tracks,
+                    midi.tempo_changes, midi.key_signatures,
+                    midi.time_signatures, midi.instruments)
+
+
 class MidiObject(object):
-    """Class for reading midi files"""
+    """Class for reading midi files
+    Parameters
+    ----------
+    midi_file : str
+        Path to the midi file. If None, an empty object is created and
+        ``resolution`` is required.
+    resolution : int
+        Ticks per beat to convert the file to.
+    engine : str
+        ``'mido'`` parses with mido, ``'native'`` decodes the bytes directly
+        with ``ugly_midi.smf``.
+    columnar : bool
+        Store notes in ``ColumnarInstrument``s.
+    notes : bool
+        If False, only the header, meta events and instrument programs are
+        read (with the native reader) and instruments have no notes.
+    """
 
-    def __init__(self, midi_file=None, resolution=None):
+    def __init__(self,
+                 midi_file=None,
+                 resolution=None,
+                 engine='mido',
+                 columnar=False,
+                 notes=True):
         if resolution is not None:
-            if (not isinstance(resolution, int)) or (resolution <= 0):
-                raise ValueError(
-                    'Invalid resolution {} specified. Expecting a positive integer.'
-                    .format(resolution))
+            _check_resolution(resolution)
+        if engine not in ('mido', 'native'):
+            raise ValueError(
+                'Unknown engine {}. Expecting "mido" or "native".'.format(
+                    engine))
 
         if midi_file is None:
             assert resolution is not None
@@ -27,48 +267,121 @@ class MidiObject(object):
             self.resolution = resolution
             return
 
-        midi_data = MidiFile(midi_file)
-        if midi_data.type not in [0, 1]:
-            raise ValueError('Midi type {} ({}) is not supported.'.format(
-                midi_data.type, midi_file))
-        if len(midi_data.tracks) < 1:
-            raise ValueError(
-                'File {} appears to have no midi tracks. It is invalid.'.
-                format(midi_file))
+        instrument_class = ColumnarInstrument if columnar else Instrument
+        if engine == 'native' or not notes:
+            self._load_smf(
+                _read_smf(midi_file, notes), midi_file, instrument_class,
+                notes)
+        else:
+            self._load_mido(midi_file, instrument_class)
+
+        if resolution:
+            self._change_resolution(resolution)
+
+    @classmethod
+    def load(cls,
+             midi_file,
+             resolution=None,
+             cache_dir=None,
+             max_cache_bytes=None,
+             **kwargs):
+        """Loads ``midi_file`` through an on-disk cache of parsed files, see
+        ``ugly_midi.cache.load_cached``"""
+        from ugly_midi.cache import load_cached
+        return load_cached(midi_file, resolution, cache_dir, max_cache_bytes,
+                           **kwargs)
+
+    @classmethod
+    async def aload(cls, midi_file, resolution=None, midi_io=None, **kwargs):
+        """Loads ``midi_file`` on an executor without blocking the event
+        loop, see ``ugly_midi.aio.AsyncMidiIO.load``. ``midi_io`` defaults to
+        ``ugly_midi.aio.get_default_io()``."""
+        from ugly_midi.aio import get_default_io
+        midi_io = midi_io or get_default_io()
+        return await midi_io.load(midi_file, resolution, cls, **kwargs)
+
+    @classmethod
+    def from_bytes(cls, buf, resolution=None, columnar=False, notes=True):
+        """Reads a midi file held in memory with the native engine. ``buf``
+        is parsed through a ``memoryview``, without copying it.
+        Parameters
+        ----------
+        buf : bytes, bytearray or memoryview
+            The raw file bytes.
+        """
+        if resolution is not None:
+            _check_resolution(resolution)
+        midi = cls.__new__(cls)
+        midi._load_smf(
+            _read_smf(memoryview(buf), notes), '<bytes>',
+            ColumnarInstrument if columnar else Instrument, notes)
+        if resolution:
+            midi._change_resolution(resolution)
+        return midi
+
+    def _load_mido(self, midi_file, instrument_class=Instrument):
+        with stage('mido_parse') as timer:
+            midi_data = MidiFile(midi_file)
+            timer.count = sum(len(track) for track in midi_data.tracks)
+        _check_header(midi_data.type, len(midi_data.tracks), midi_file)
 
         # convert tick to absolute
-        for track in midi_data.tracks:
-            tick = 0
-            for event in track:
-                event.time += tick
-                tick = event.time
-
-        self.resolution = midi_data.ticks_per_beat
-        self._load_track0(midi_data)
-
-        max_tick = max([max([e.time for e in t])
-                        for t in midi_data.tracks]) + 1
-
-        if max_tick > MAX_TICK:
-            raise ValueError(('MIDI file has a largest tick of {},'
-                              ' it is likely corrupt'.format(max_tick)))
-
-        # Check that there are tempo, key and time change events
-        # only on track 0
-        if any(
-                e.type in ('set_tempo', 'key_signature', 'time_signature')
-                for track in midi_data.tracks[1:] for e in track):
-            warnings.warn(
-                "Tempo, Key or Time signature change events found on "
-                "non-zero tracks.  This is not a valid type 0 or type 1 "
-                "MIDI file.  Tempo, Key or Time Signature may be wrong.",
-                RuntimeWarning)
+        with stage('absolute_ticks'):
+            for track in midi_data.tracks:
+                tick = 0
+                for event in track:
+                    event.time += tick
+                    tick = event.time
+
+        with stage('meta_scan'):
+            self.resolution = midi_data.ticks_per_beat
+            self._load_track0(midi_data)
+
+            max_tick = max([max([e.time for e in t])
+                            for t in midi_data.tracks]) + 1
+            _check_max_tick(max_tick)
+
+            # Check that there are tempo, key and time change events
+            # only on track 0
+            if any(
+                    e.type in ('set_tempo', 'key_signature', 'time_signature')
+                    for track in midi_data.tracks[1:] for e in track):
+                _warn_meta_on_other_tracks()
 
         # Populate the list of instruments
-        self._load_instruments(midi_data)
+        self._load_instruments(midi_data, instrument_class)
 
-        if resolution:
-            self._change_resolution(resolution)
+    def _load_smf(self, smf, midi_file, instrument_class=Instrument,
+                  notes=True):
+        _check_header(smf.type, smf.n_tracks, midi_file)
+
+        self.resolution = smf.resolution
+        self._load_smf_meta(smf)
+
+        _check_max_tick(smf.max_tick + 1)
+        if smf.meta_on_other_tracks:
+            _warn_meta_on_other_tracks()
+
+        if notes:
+            with stage('note_pairing') as timer:
+                timer.count = len(smf.events)
+                self._load_instruments_from_events(
+                    smf.events, smf.track_names, instrument_class)
+        else:
+            self._load_instrument_programs(smf.events, smf.track_names,
+                                           instrument_class)
+
+    def _load_smf_meta(self, smf):
+        self.key_signatures = [
+            KeySignature(key, tick) for tick, key in smf.key_signatures
+        ]
+        self.time_signatures = [
+            TimeSignature(numerator, denominator, tick)
+            for tick, numerator, denominator in smf.time_signatures
+        ]
+        self.tempo_changes = [
+            TempoChange(tempo2bpm(tempo), tick) for tick, tempo in smf.tempos
+        ]
 
     def _load_track0(self, midi_data):
         self.key_signatures = []
@@ -87,109 +400,446 @@ class MidiObject(object):
             # track 0 can have note information for type 0 midi
 
 
-    def _load_instruments(self, midi_data):
+    def _load_instruments(self, midi_data, instrument_class=Instrument):
         """Populates ``self.instruments`` using ``midi_data``.
         Parameters
         ----------
         midi_data : midi.FileReader
-            MIDI object from which data will be read.
+            MIDI object from which data will be read, with absolute times.
+        instrument_class : type
+            ``Instrument`` or ``ColumnarInstrument``.
         """
-        # MIDI files can contain a collection of tracks; each track can have
-        # events occuring on one of sixteen channels, and events can correspond
-        # to different instruments according to the most recently occurring
-        # program number.  So, we need a way to keep track of which instrument
-        # is playing on each track on each channel.  This dict will map from
-        # program number, drum/not drum, channel, and track index to instrument
-        # indices, which we will retrieve/populate using the __get_instrument
-        # function below.
-        instrument_map = collections.OrderedDict()
-        # Store a similar mapping to instruments storing "straggler events",
-        # e.g. events which appear before we want to initialize an Instrument
-        stragglers = {}
-        # This dict will map track indices to any track names encountered
-        track_name_map = collections.defaultdict(str)
-
-        def __get_instrument(program, channel, track):
-
-            if (program, channel, track) in instrument_map:
-                return instrument_map[(program, channel, track)]
-
-            is_drum = (channel == 9)
-            instrument = Instrument(program, is_drum,
-                                    track_name_map[track_idx])
-
-            # If any events appeared for this instrument before now,
-            # include them in the new instrument
-            if (channel, track) in stragglers:
-                straggler = stragglers[(channel, track)]
-                instrument.control_changes = straggler.control_changes
-                instrument.pitch_bends = straggler.pitch_bends
-            # Add the instrument to the instrument map
-            instrument_map[(program, channel, track)] = instrument
-
-            return instrument
-
-        # NOTICE: it is actually possible to use program_change to affect other
-        # channels.
-
-        # all_events contain [track_idx, event]
-        all_events = []
-        for track_idx, track in enumerate(midi_data.tracks):
-            for event in track:
-                if event.type == 'track_name':
-                    track_name_map[track_idx] = event.name
-                elif event.type in ['program_change', 'note_on', 'note_off']:
-                    all_events.append([track_idx, event])
-
-        all_events = sorted(all_events, key=lambda e: e[1].time)
-
-        current_instrument = np.zeros(16, dtype=np.int)
-        # note on in one track and note off in another track is too ridiculous
-        last_note_on = {}
-        for track_id, event in all_events:
-            if event.type == 'program_change':
-                current_instrument[event.channel] = event.program
-            elif event.type == 'note_on' and event.velocity > 0:
-                # put the note into the note-on list, record its instrument
-                last_note_on[(track_id, event.channel, event.note)] = [
-                    current_instrument[event.channel], event.velocity,
-                    event.time
-                ]
-            elif event.type == 'note_off' or (event.type == 'note_on'
-                                              and event.velocity == 0):
-                # ignore spurious note-offs
-                key = (track_id, event.channel, event.note)
-                if key in last_note_on:
-                    prog, vel, t = last_note_on[key]
-                    instr = __get_instrument(prog, event.channel, track_id)
-                    if event.time == t:
-                        continue
-                    instr.add_note(Note(vel, event.note, t, event.time))
-                    del last_note_on[(track_id, event.channel, event.note)]
-
-        # TODO: add support for pitch bend and control changes
-
-        # Initialize list of instruments from instrument_map
-        self.instruments = [i for i in instrument_map.values()]
-
-    def _change_resolution(self, res):
-        if self.resolution == res:
+        with stage('event_records') as timer:
+            events, track_names = _mido_events(midi_data)
+            timer.count = len(events)
+        with stage('note_pairing') as timer:
+            timer.count = len(events)
+            self._load_instruments_from_events(events, track_names,
+                                               instrument_class)
+
+    def _load_instruments_from_events(self,
+                                      events,
+                                      track_names,
+                                      instrument_class=Instrument):
+        """Populates ``self.instruments`` from event arrays.
+
+        MIDI files can contain a collection of tracks; each track can have
+        events occuring on one of sixteen channels, and events can correspond
+        to different instruments according to the most recently occurring
+        program number, on any track. There is one instrument per (program,
+        channel, track), in the order their first note ends.
+
+        A note-on is paired with the next note-off (or note-on with zero
+        velocity) of the same track, channel and pitch, in playback order. A
+        later note-on replaces an unpaired one, note-offs without a note-on
+        are ignored, and a note-off on the tick of its note-on creates the
+        instrument but neither a note nor closes the note-on.
+
+        Control changes, pitch bends and aftertouch go to the instrument of
+        their program, channel and track if it exists by then. Earlier
+        "straggler" events go to every instrument of their channel and track
+        created after them.
+        Parameters
+        ----------
+        events : np.ndarray
+            Events with dtype ``smf.EVENT_DTYPE`` in file order.
+        track_names : dict
+            Maps track indices to track names.
+        instrument_class : type
+            ``Instrument`` or ``ColumnarInstrument``.
+        """
+        # the stable sort keeps the track order for simultaneous events
+        events = events[np.argsort(events['tick'], kind='stable')]
+        programs = _programs_at(events)
+
+        # group the note events by (track, channel, pitch), in playback order
+        notes = np.nonzero(np.isin(events['type'], (NOTE_ON, NOTE_OFF)))[0]
+        ev = events[notes]
+        key = ((ev['track'].astype(np.int64) * 16 + ev['channel']) * 128 +
+               ev['data1'])
+        order = np.argsort(key * len(events) + notes)
+        notes, ev, key = notes[order], ev[order], key[order]
+        tick = ev['tick']
+        is_on = (ev['type'] == NOTE_ON) & (ev['data2'] > 0)
+
+        # the note-on an event would close is the last one of its group
+        idx = np.arange(len(ev))
+        on = np.maximum.accumulate(np.where(is_on, idx, -1))
+        group_start = np.maximum.accumulate(np.where(_run_starts(key), idx, 0))
+        is_off = ~is_on & (on >= group_start) & (on >= 0)
+        on = np.maximum(on, 0)
+        # note-offs on the tick of the note-on leave it open; of the others,
+        # only the first one closes it
+        same_tick = is_off & (tick == tick[on])
+        closing = np.nonzero(is_off & ~same_tick)[0]
+        closing = closing[_run_starts(on[closing])]
+        matched = np.concatenate([np.nonzero(same_tick)[0], closing])
+
+        # instruments are created by matched note-offs in playback order,
+        # one for every (program, channel, track)
+        instrument_keys = (programs[notes[on]] * 16 +
+                           ev['channel']) * 65536 + ev['track']
+        matched = matched[np.argsort(notes[matched])]
+        created, first, instrument_idx = np.unique(
+            instrument_keys[matched], return_index=True, return_inverse=True)
+        creation_rank = np.argsort(np.argsort(first))
+        instrument_idx = creation_rank[instrument_idx]
+        created = created[np.argsort(first)]
+        created_at = np.sort(notes[matched[first]])
+
+        # notes are added to their instrument in the order of their note-off
+        is_closing = ~same_tick[matched]
+        instrument_idx = instrument_idx[is_closing]
+        closing = matched[is_closing]
+        by_instrument = np.argsort(instrument_idx, kind='stable')
+        closing = closing[by_instrument]
+        note_array = np.zeros(len(closing), dtype=NOTE_DTYPE)
+        note_array['start'] = tick[on[closing]]
+        note_array['end'] = tick[closing]
+        note_array['pitch'] = ev['data1'][closing]
+        note_array['velocity'] = ev['data2'][on[closing]]
+        bounds = np.searchsorted(instrument_idx[by_instrument],
+                                 np.arange(len(created) + 1)).tolist()
+
+        self.instruments = []
+        created_programs, channel_tracks = np.divmod(created, 16 * 65536)
+        created_channels, created_tracks = np.divmod(channel_tracks, 65536)
+        for i, (program, channel, track) in enumerate(
+                zip(created_programs.tolist(), created_channels.tolist(),
+                    created_tracks.tolist())):
+            instrument = instrument_class(program, channel == 9,
+                                          track_names.get(track, ''))
+            instrument.set_note_array(note_array[bounds[i]:bounds[i + 1]])
+            self.instruments.append(instrument)
+
+        with stage('controls'):
+            self._load_controls(events, programs, created, created_at)
+
+    def _load_controls(self, events, programs, created, created_at):
+        """Distributes the control events over ``self.instruments``.
+        Parameters
+        ----------
+        events : np.ndarray
+            Events in playback order.
+        programs : np.ndarray
+            Program in effect for every event.
+        created : np.ndarray
+            ``(program * 16 + channel) * 65536 + track`` of the instruments.
+        created_at : np.ndarray
+            Index in ``events`` of the note-off creating every instrument.
+        """
+        controls = np.nonzero(
+            np.isin(events['type'], (CONTROL_CHANGE, PITCH_BEND,
+                                     POLY_AFTERTOUCH, CHANNEL_AFTERTOUCH)))[0]
+        if not len(controls) or not len(created):
             return
+        keys = (programs[controls] * 16 +
+                events['channel'][controls]) * 65536 + events['track'][controls]
+
+        # events after the creation of the instrument of their key
+        by_key = np.argsort(created)
+        pos = np.minimum(np.searchsorted(created[by_key], keys),
+                         len(created) - 1)
+        owner = by_key[pos]
+        direct = (created[owner] == keys) & (created_at[owner] < controls)
+
+        # stragglers go to the instruments of their channel and track created
+        # after them
+        channel_tracks = created % (16 * 65536)
+        by_channel_track = np.lexsort((created_at, channel_tracks))
+        span = len(events) + 1
+        stragglers = controls[~direct]
+        straggler_keys = keys[~direct] % (16 * 65536)
+        lo = np.searchsorted(
+            channel_tracks[by_channel_track] * span +
+            created_at[by_channel_track], straggler_keys * span + stragglers)
+        hi = np.searchsorted(channel_tracks[by_channel_track], straggler_keys,
+                             'right')
+        counts = np.maximum(hi - lo, 0)
+        first = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        shared = by_channel_track[first + np.arange(counts.sum())]
+
+        owners = np.concatenate([owner[direct], shared])
+        positions = np.concatenate([controls[direct],
+                                    np.repeat(stragglers, counts)])
+        order = np.lexsort((positions, owners))
+        owners, controlled = owners[order], events[positions[order]]
+        bounds = np.searchsorted(owners, np.arange(len(created) + 1))
+
+        types = controlled['type']
+        data1 = controlled['data1'].astype(np.int64)
+        data2 = controlled['data2'].astype(np.int64)
+        for i, instrument in enumerate(self.instruments):
+            window = slice(bounds[i], bounds[i + 1])
+            if bounds[i] == bounds[i + 1]:
+                continue
+            t, d1, d2 = types[window], data1[window], data2[window]
+            ticks = controlled['tick'][window]
+
+            is_cc = t == CONTROL_CHANGE
+            cc = np.zeros(is_cc.sum(), dtype=CONTROL_CHANGE_DTYPE)
+            cc['time'], cc['number'], cc['value'] = (ticks[is_cc], d1[is_cc],
+                                                     d2[is_cc])
+            is_bend = t == PITCH_BEND
+            bends = np.zeros(is_bend.sum(), dtype=PITCH_BEND_DTYPE)
+            bends['time'] = ticks[is_bend]
+            bends['pitch'] = (d2[is_bend] << 7 | d1[is_bend]) - 8192
+            is_poly = t == POLY_AFTERTOUCH
+            is_touch = is_poly | (t == CHANNEL_AFTERTOUCH)
+            touches = np.zeros(is_touch.sum(), dtype=AFTERTOUCH_DTYPE)
+            touches['time'] = ticks[is_touch]
+            touches['note'] = np.where(is_poly, d1, -1)[is_touch]
+            touches['value'] = np.where(is_poly, d2, d1)[is_touch]
+
+            instrument.control_changes = cc
+            instrument.pitch_bends = bends
+            instrument.aftertouches = touches
+
+    def _load_instrument_programs(self,
+                                  events,
+                                  track_names,
+                                  instrument_class=Instrument):
+        """Populates ``self.instruments`` with empty instruments, one for
+        every (program, channel, track) that plays a note-on"""
+        events = events[np.argsort(events['tick'], kind='stable')]
+        programs = _programs_at(events)
+        note_on = (events['type'] == NOTE_ON) & (events['data2'] > 0)
+        tracks = events['track'][note_on].astype(np.int64)
+        # one integer key per (program, channel, track), so that np.unique
+        # sorts a flat array instead of rows
+        keys = ((programs[note_on] * 16 + events['channel'][note_on]) *
+                (int(tracks.max(initial=0)) + 1) + tracks)
+        _, first = np.unique(keys, return_index=True)
+        first = np.sort(first)
+        self.instruments = [
+            instrument_class(program, channel == 9,
+                             track_names.get(track, ''))
+            for program, channel, track in zip(
+                programs[note_on][first].tolist(),
+                events['channel'][note_on][first].tolist(),
+                tracks[first].tolist())
+        ]
+
+    def _change_resolution(self, res, policy='extend'):
+        # checked first, so that a bad policy neither passes silently when
+        # the resolution is unchanged nor leaves the meta events rescaled
+        _check_policy(policy)
+        if self.resolution == res:
+            return ResolutionReport(0, 0, 0)
 
         scale = res / self.resolution
 
-        # change the event time for meta events
-        for e in self.tempo_changes + self.key_signatures + self.time_signatures:
-            e.time = round(e.time * scale)
+        # change the event time for meta events in one pass
+        meta_events = (self.tempo_changes + self.key_signatures +
+                       self.time_signatures)
+        times = np.array([e.time for e in meta_events], dtype=np.float64)
+        for e, time in zip(meta_events,
+                           np.round(times * scale).astype(np.int64).tolist()):
+            e.time = time
 
-        # change the event time for notes
-        for ins in self.instruments:
-            ins.change_resolution(scale)
+        # change the event time for the notes of all instruments together
+        with stage('change_resolution') as timer:
+            notes, offsets = _concat_notes(self.instruments)
+            timer.count = len(notes)
+            counts = np.diff(offsets)
+            groups = np.repeat(np.arange(len(counts)), counts)
+            notes, keep, report = scale_notes(notes, scale, policy, groups)
+            bounds = np.cumsum([0] + np.bincount(
+                groups[keep], minlength=len(counts)).tolist()).tolist()
+            offsets = offsets.tolist()
+            for i, ins in enumerate(self.instruments):
+                # bounds index the kept notes, offsets the original ones
+                ins._set_scaled_notes(notes[bounds[i]:bounds[i + 1]],
+                                      keep[offsets[i]:offsets[i + 1]])
+                ins._scale_controls(scale)
         self.resolution = res
+        return report
 
-    def write(self, midi_file):
-        mid = MidiFile(ticks_per_beat=self.resolution)
+    def change_resolution(self, res, policy='extend'):
+        """Converts all events to ``res`` ticks per beat.
+        Parameters
+        ----------
+        res : int
+            New resolution.
+        policy : str
+            Handling of notes that collapse to zero length, ``'extend'``,
+            ``'drop'`` or ``'merge'``, see ``instrument.scale_notes``.
+        Returns
+        -------
+        report : ResolutionReport
+            Number of collapsed notes handled by each policy.
+        """
+        _check_resolution(res)
+        return self._change_resolution(res, policy)
+
+    def get_tempo_map(self):
+        """``TempoMap`` of the tempo changes, rebuilt only when they or the
+        resolution change"""
+        key = (self.resolution,
+               tuple((e.time, e.bpm) for e in self.tempo_changes))
+        if getattr(self, '_tempo_map_key', None) != key:
+            self._tempo_map = TempoMap(self.tempo_changes, self.resolution)
+            self._tempo_map_key = key
+        return self._tempo_map
+
+    def get_end_time(self):
+        """End of the last note over all instruments, in ticks"""
+        return max([ins.get_end_time() for ins in self.instruments] + [0])
+
+    def get_bar_lines(self, end_time=None):
+        """Ticks of the bar lines before ``end_time`` (default: the end of
+        the last note), from the time signatures. 4/4 is assumed before the
+        first time signature."""
+        if end_time is None:
+            end_time = self.get_end_time()
+        signatures = sorted(self.time_signatures, key=lambda e: e.time)
+        if not signatures or signatures[0].time > 0:
+            signatures = [TimeSignature(4, 4, 0)] + signatures
+        bars = []
+        for i, ts in enumerate(signatures):
+            stop = (signatures[i + 1].time
+                    if i + 1 < len(signatures) else end_time)
+            bar = self.resolution * 4 * ts.numerator / ts.denominator
+            bars.append(np.arange(ts.time, min(stop, end_time), bar))
+        return np.round(np.concatenate(bars)).astype(np.int64)
+
+    def iter_segments(self,
+                      length,
+                      hop=None,
+                      instruments=None,
+                      bar_aligned=True,
+                      dtype=np.float64,
+                      mode='velocity',
+                      out=None):
+        """Renders fixed-length piano roll windows one at a time.
+        Parameters
+        ----------
+        length : int
+            Window length in ticks.
+        hop : int
+            Minimum distance between window starts in ticks, defaults to
+            ``length``.
+        instruments : list
+            Instruments, or their indices in ``self.instruments``, to render.
+            Defaults to all.
+        bar_aligned : bool
+            Start every window on the first bar line at least ``hop`` ticks
+            after the previous start instead of exactly ``hop`` ticks after.
+        dtype, mode
+            See ``Instrument.get_piano_roll``.
+        out : np.ndarray
+            ``(n_instruments, length, 128)`` buffer that is filled and
+            yielded for every window instead of allocating a new one. The
+            caller must copy what it keeps before the next window.
+        Yields
+        ------
+        start_time : int
+            Start of the window in ticks.
+        roll : np.ndarray
+            ``(n_instruments, length, 128)`` piano rolls of the window,
+            padded with zeros past the end of the file.
+        """
+        hop = length if hop is None else hop
+        if length <= 0 or hop <= 0:
+            raise ValueError('length and hop must be positive')
+        if instruments is None:
+            instruments = self.instruments
+        instruments = [
+            self.instruments[i] if isinstance(i, (int, np.integer)) else i
+            for i in instruments
+        ]
+        shape = (len(instruments), length, 128)
+        if out is not None and out.shape != shape:
+            raise ValueError('out has shape {}, expecting {}'.format(
+                out.shape, shape))
+
+        end_time = self.get_end_time()
+        if bar_aligned:
+            starts = []
+            for bar in self.get_bar_lines(end_time).tolist():
+                if not starts or bar >= starts[-1] + hop:
+                    starts.append(bar)
+        else:
+            starts = range(0, end_time, hop)
+
+        # one note array and index per instrument for the whole pass
+        indexed = [ins._get_indexed_notes() for ins in instruments]
+        for start in starts:
+            roll = np.empty(shape, dtype) if out is None else out
+            for i, (notes, index) in enumerate(indexed):
+                notes = notes[index.query(start, start + length)]
+                notes['start'] -= start
+                notes['end'] -= start
+                roll[i] = rasterize(notes, length, dtype, mode)
+            yield start, roll
+
+    def get_piano_roll_tensor(self,
+                              group_by='family5',
+                              end_time=None,
+                              dtype=np.float64,
+                              mode='velocity',
+                              reduction='max',
+                              out=None):
+        """Rasterizes all instruments into one ``(groups, frames, 128)``
+        array in a single pass.
+        Parameters
+        ----------
+        group_by : str
+            ``'family5'`` for the groups of ``misc.FAMILIES5``, drums
+            included, ``'program'`` for 129 groups, the programs and then
+            the drums, or ``'track'`` for one group per instrument.
+            Instruments in no family5 group are left out.
+        end_time : int
+            Number of frames, defaults to ``out.shape[1]`` or to the end of
+            the last note.
+        dtype, mode
+            See ``Instrument.get_piano_roll``.
+        reduction : str
+            ``'max'``, ``'sum'`` or ``'clip'``, see
+            ``instrument.rasterize_groups``.
+        out : np.ndarray
+            Array to fill instead of allocating a new one.
+        """
+        if group_by == 'family5':
+            from ugly_midi.misc import FAMILIES5, program2family5
+            families = [
+                'Drums' if ins.is_drum else program2family5(ins.program)
+                for ins in self.instruments
+            ]
+            groups = [
+                FAMILIES5.index(f) if f in FAMILIES5 else -1
+                for f in families
+            ]
+            n_groups = len(FAMILIES5)
+        elif group_by == 'program':
+            groups = [
+                128 if ins.is_drum else int(ins.program)
+                for ins in self.instruments
+            ]
+            n_groups = 129
+        elif group_by == 'track':
+            groups = list(range(len(self.instruments)))
+            n_groups = len(self.instruments)
+        else:
+            raise ValueError(
+                'Unknown group_by {}. Expecting "family5", "program" or '
+                '"track".'.format(group_by))
+
+        notes, offsets = _concat_notes(self.instruments)
+        sources = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        if end_time is None:
+            end_time = (out.shape[1] if out is not None else int(
+                notes['end'].max(initial=0)))
+        return rasterize_groups(notes, sources, groups, n_groups, end_time,
+                                dtype, mode, reduction, out)
 
+    def _prepare_write(self):
+        """Fills in the default meta events and assigns channels.
+        Returns
+        -------
+        tracks : list
+            ``(instrument, channel)`` pairs of the instruments to write.
+        """
         # default time signature
         if not self.time_signatures:
             self.time_signatures = [TimeSignature(4, 4, 0)]
@@ -198,6 +848,57 @@ class MidiObject(object):
         if not self.tempo_changes:
             self.tempo_changes = [TempoChange(120, 0)]
 
+        if len([instr
+                for instr in self.instruments if not instr.is_drum]) > 15:
+            warnings.warn(
+                "Synthesizing with more than 15 instruments is not supported",
+                RuntimeWarning)
+
+        tracks = []
+        current_channel = 0
+        for instr in self.instruments:
+            channel = 9 if instr.is_drum else current_channel
+            tracks.append((instr, channel))
+
+            if not instr.is_drum:
+                current_channel += 1
+                if current_channel > 15:
+                    break
+        return tracks
+
+    def write(self, midi_file, engine='mido'):
+        """Writes the midi file.
+        Parameters
+        ----------
+        midi_file : str or file object
+            Destination path, or with the native engine also an open binary
+            file.
+        engine : str
+            ``'mido'`` or ``'native'``, which encodes the file directly from
+            the note arrays. Both produce the same bytes.
+        """
+        if engine == 'native':
+            with stage('write_native'):
+                data = self.to_bytes()
+            if hasattr(midi_file, 'write'):
+                midi_file.write(data)
+            else:
+                with open(midi_file, 'wb') as f:
+                    f.write(data)
+            return
+        if engine != 'mido':
+            raise ValueError(
+                'Unknown engine {}. Expecting "mido" or "native".'.format(
+                    engine))
+
+        with stage('write_mido'):
+            self._to_mido().save(midi_file)
+
+    def _to_mido(self):
+        """Builds the ``mido.MidiFile`` written by ``write``"""
+        mid = MidiFile(ticks_per_beat=self.resolution)
+        tracks = self._prepare_write()
+
         track = mid.add_track()
 
         events = []
@@ -222,53 +923,192 @@ class MidiObject(object):
             track.append(msg)
             now += msg.time
 
-        if len([instr
-                for instr in self.instruments if not instr.is_drum]) > 15:
-            warnings.warn(
-                "Synthesizing with more than 15 instruments is not supported",
-                RuntimeWarning)
-
-        current_channel = 0
-        for instr in self.instruments:
+        for instr, channel in tracks:
             track = mid.add_track()
-            channel = 9 if instr.is_drum else current_channel
-
-            track.append(
-                Message(
-                    'program_change',
-                    channel=channel,
-                    program=instr.program,
-                    time=0))
-
-            note_msgs = []
-            for n in instr.notes:
-                note_msgs.append(
-                    Message(
-                        'note_on',
-                        channel=channel,
-                        note=n.pitch,
-                        velocity=n.velocity,
-                        time=n.start))
-                note_msgs.append(
-                    Message(
-                        'note_off',
-                        channel=channel,
-                        note=n.pitch,
-                        velocity=0,
-                        time=n.end))
-
-            note_msgs = sorted(note_msgs, key=lambda msg: msg.time)
             now = 0
-            for msg in note_msgs:
-                track.append(msg.copy(time=msg.time - now))
-                now = msg.time
+            for tick, status, data1, data2 in zip(
+                    *[a.tolist() for a in _instrument_events(instr, channel)]):
+                data = [status, data1]
+                if status >> 4 not in (PROGRAM_CHANGE, CHANNEL_AFTERTOUCH):
+                    data.append(data2)
+                track.append(Message.from_bytes(data, time=tick - now))
+                now = tick
 
-            if not instr.is_drum:
-                current_channel += 1
-                if current_channel > 15:
-                    break
+        return mid
+
+    async def awrite(self, midi_file, engine='mido', midi_io=None):
+        """Writes the midi file on an executor without blocking the event
+        loop, see ``ugly_midi.aio.AsyncMidiIO.write``"""
+        from ugly_midi.aio import get_default_io
+        midi_io = midi_io or get_default_io()
+        await midi_io.write(self, midi_file, engine)
+
+    def to_bytes(self, engine='native'):
+        """Encodes the midi file, returns the file bytes. ``engine`` is
+        ``'native'``, which encodes without mido, or ``'mido'``, see
+        ``write``."""
+        if engine == 'mido':
+            buf = io.BytesIO()
+            self._to_mido().save(file=buf)
+            return buf.getvalue()
+        if engine != 'native':
+            raise ValueError(
+                'Unknown engine {}. Expecting "mido" or "native".'.format(
+                    engine))
+        tracks = self._prepare_write()
+
+        events = []
+        for ks in self.key_signatures:
+            events.append((ks.time, META_KEY_SIGNATURE,
+                           key_signature_payload(ks.key)))
+        for ts in self.time_signatures:
+            events.append((ts.time, META_TIME_SIGNATURE,
+                           time_signature_payload(ts.numerator,
+                                                  ts.denominator)))
+        for tc in self.tempo_changes:
+            events.append((tc.time, META_SET_TEMPO,
+                           tempo_payload(bpm2tempo(tc.bpm))))
+        events = sorted(events, key=lambda e: e[0])
+        chunks = [
+            encode_header(1, len(tracks) + 1, self.resolution),
+            encode_meta_events(events)
+        ]
+
+        for instr, channel in tracks:
+            chunks.append(
+                encode_channel_events(*_instrument_events(instr, channel)))
+        return b''.join(chunks)
+
+    @classmethod
+    def concat(cls,
+               objs,
+               resolution=None,
+               bar_aligned=True,
+               policy='extend'):
+        """Plays ``objs`` one after the other.
+
+        Every file starts where the previous one ends, at the end of its
+        last note or meta event, rounded up to the next bar line if
+        ``bar_aligned``. The k-th instrument with a given program, drum flag
+        and name of every file goes to the same instrument. Meta events are
+        shifted with their file, and a file without a tempo or time
+        signature at its start gets 120 bpm and 4/4 there.
+        Parameters
+        ----------
+        objs : list
+            ``MidiObject``s to concatenate, they are not modified.
+        resolution : int
+            Resolution of the result, defaults to the highest of ``objs``.
+        policy : str
+            Handling of notes that collapse to zero length when converting
+            to ``resolution``, see ``instrument.scale_notes``.
+        """
+        objs = list(objs)
+        spans = [_file_span(m, bar_aligned) for m in objs]
+        return cls._combine(objs, resolution, policy, spans)
+
+    @classmethod
+    def overlay(cls, objs, resolution=None, policy='extend'):
+        """Plays ``objs`` together, from their start. The instruments of all
+        files are kept, and the tempo, key and time signatures are those of
+        the first file. See ``concat`` for the parameters."""
+        return cls._combine(list(objs), resolution, policy, None)
+
+    @classmethod
+    def _combine(cls, objs, resolution, policy, spans):
+        """Converts ``objs`` to a common resolution in one pass over all
+        their notes and combines them, one after the other if ``spans``
+        holds their lengths, or overlaid if it is None."""
+        if not objs:
+            raise ValueError('Expecting at least one MidiObject')
+        if resolution is None:
+            resolution = max(m.resolution for m in objs)
+        else:
+            _check_resolution(resolution)
+        scales = np.array([resolution / m.resolution for m in objs])
+        if spans is None:
+            offsets = np.zeros(len(objs), dtype=np.int64)
+        else:
+            lengths = np.round(np.array(spans) * scales).astype(np.int64)
+            offsets = np.cumsum(lengths) - lengths
+
+        # the instrument of the result every instrument goes to
+        instruments = [ins for m in objs for ins in m.instruments]
+        sources = np.repeat(np.arange(len(objs)),
+                            [len(m.instruments) for m in objs])
+        targets = []
+        outputs = collections.OrderedDict()
+        for m in objs:
+            seen = collections.Counter()
+            for ins in m.instruments:
+                key = (ins.program, ins.is_drum, ins.name)
+                seen[key] += 1
+                if spans is None:
+                    key = len(outputs)
+                else:
+                    key += (seen[key], )
+                targets.append(outputs.setdefault(key, len(outputs)))
+        targets = np.array(targets, dtype=np.int64)
+        first = np.unique(targets, return_index=True)[1]
+
+        notes, note_offsets = _concat_notes(instruments)
+        counts = np.diff(note_offsets)
+        groups = np.repeat(np.arange(len(instruments)), counts)
+        notes, keep, _ = scale_notes(notes, scales[sources][groups], policy,
+                                     groups)
+        shift = offsets[sources][groups][keep]
+        notes['start'] += shift
+        notes['end'] += shift
+        note_targets = targets[groups][keep]
+        order = np.lexsort((notes['pitch'], notes['start'], note_targets))
+        notes = notes[order]
+        bounds = np.searchsorted(note_targets[order],
+                                 np.arange(len(first) + 1)).tolist()
+
+        midi = cls(resolution=resolution)
+        for t, i in enumerate(first.tolist()):
+            src = instruments[i]
+            instr = type(src)(src.program, src.is_drum, src.name)
+            instr.set_note_array(notes[bounds[t]:bounds[t + 1]])
+            members = np.nonzero(targets == t)[0].tolist()
+            for name in ('control_changes', 'pitch_bends', 'aftertouches'):
+                arrays = [getattr(instruments[j], name) for j in members]
+                events = np.concatenate(arrays)
+                member = np.repeat(members, [len(a) for a in arrays])
+                events['time'] = (
+                    np.round(events['time'] * scales[sources[member]]) +
+                    offsets[sources[member]])
+                setattr(instr, name,
+                        events[np.argsort(events['time'], kind='stable')])
+            midi.instruments.append(instr)
 
-        mid.save(midi_file)
+        meta_objs = objs if spans is not None else objs[:1]
+        for k, m in enumerate(meta_objs):
+            events = m.tempo_changes + m.key_signatures + m.time_signatures
+            times = np.round(
+                np.array([e.time for e in events], dtype=np.float64) *
+                scales[k]).astype(np.int64) + offsets[k]
+            times = times.tolist()
+            n_tempos, n_keys = len(m.tempo_changes), len(m.key_signatures)
+            offset = int(offsets[k])
+            if k and not any(e.time <= 0 for e in m.tempo_changes):
+                midi.tempo_changes.append(TempoChange(DEFAULT_BPM, offset))
+            midi.tempo_changes += [
+                TempoChange(e.bpm, t)
+                for e, t in zip(m.tempo_changes, times[:n_tempos])
+            ]
+            midi.key_signatures += [
+                KeySignature(e.key, t)
+                for e, t in zip(m.key_signatures,
+                                times[n_tempos:n_tempos + n_keys])
+            ]
+            if k and not any(e.time <= 0 for e in m.time_signatures):
+                midi.time_signatures.append(TimeSignature(4, 4, offset))
+            midi.time_signatures += [
+                TimeSignature(e.numerator, e.denominator, t)
+                for e, t in zip(m.time_signatures, times[n_tempos + n_keys:])
+            ]
+        return midi
 
     def add_instrument(self, instr):
         if not isinstance(instr, Instrument):
@@ -1,7 +1,9 @@
-from ugly_midi.midi_file import MidiObject
-from ugly_midi.instrument import Instrument
-from ugly_midi.containers import Note, TempoChange
+from ugly_midi.midi_file import MidiObject, _concat_notes
+from ugly_midi.instrument import Instrument, ColumnarInstrument
+from ugly_midi.containers import Note, TempoChange, NOTE_DTYPE
 import numpy as np
+import itertools
+import operator
 
 
 def program2family(prog):
@@ -39,6 +41,9 @@ def program2family(prog):
         return 'Sound Effects'
 
 
+FAMILIES5 = ('Piano', 'Guitar', 'Bass', 'Ensemble', 'Drums')
+
+
 def program2family5(prog):
     family = program2family(prog)
     if family in ['Piano', 'Chromatic Percussion']:
@@ -73,42 +78,159 @@ def family2program(name):
     return -1
 
 
-def get_instrument_from_piano_roll(roll, program=0, is_drum=False, name=''):
+def _decode_piano_rolls(rolls, split_velocity=False):
+    """Finds the notes of a batch of piano rolls in one pass.
+    Parameters
+    ----------
+    rolls : np.ndarray
+        Piano rolls with shape [batch x frames x 128].
+    split_velocity : bool
+        Whether a change between two non-zero values starts a new note.
+    Returns
+    -------
+    batch, start, end, pitch, velocity : np.ndarray
+        Notes ordered by batch, pitch and start. The velocity of a note is
+        the roll value of its last frame.
+    """
+    # pitch major, padded with a silent frame on both sides
+    values = np.zeros((rolls.shape[0], 128, rolls.shape[1] + 2),
+                      dtype=rolls.dtype)
+    values[:, :, 1:-1] = rolls.transpose(0, 2, 1)
+    prev, curr = values[:, :, :-1], values[:, :, 1:]
+    onsets = (curr != 0) & (prev == 0)
+    offsets = (prev != 0) & (curr == 0)
+    if split_velocity:
+        changed = (prev != curr) & (prev != 0) & (curr != 0)
+        onsets |= changed
+        offsets |= changed
+    # np.nonzero walks the arrays in (batch, pitch, frame) order, so the k-th
+    # onset and the k-th offset belong to the same note
+    batch, pitch, start = np.nonzero(onsets)
+    end = np.nonzero(offsets)[2]
+    velocity = values[batch, pitch, end]
+    return batch, start, end, pitch, velocity
+
+
+def _instrument_from_notes(start, end, pitch, velocity, program, is_drum,
+                           name, columnar):
+    if columnar:
+        instr = ColumnarInstrument(program, is_drum, name)
+        notes = np.zeros(len(start), dtype=NOTE_DTYPE)
+        notes['start'], notes['end'] = start, end
+        notes['pitch'], notes['velocity'] = pitch, velocity
+        instr.set_note_array(notes)
+        return instr
+
+    instr = Instrument(program, is_drum, name)
+    instr.notes = [
+        Note(v, p, s, e) for s, e, p, v in zip(start.tolist(), end.tolist(
+        ), pitch.tolist(), velocity.tolist())
+    ]
+    return instr
+
+
+def get_instrument_from_piano_roll(roll,
+                                   program=0,
+                                   is_drum=False,
+                                   name='',
+                                   split_velocity=False,
+                                   columnar=False):
     if not isinstance(roll, np.ndarray):
         raise TypeError('Piano roll should be an np.ndarray')
     if len(roll.shape) != 2 or roll.shape[1] != 128:
         raise ValueError('Piano roll must have shape [frames x 128]')
 
-    instr = Instrument(program, is_drum, name)
+    _, start, end, pitch, velocity = _decode_piano_rolls(
+        roll[np.newaxis], split_velocity)
+    return _instrument_from_notes(start, end, pitch, velocity, program,
+                                  is_drum, name, columnar)
 
-    for pitch in range(roll.shape[1]):
-        prev_val = 0
-        start_t = -1
-        for t in range(roll.shape[0]):
-            curr_val = roll[t, pitch]
-            if prev_val == 0 and curr_val != 0:
-                start_t = t
-            if prev_val != 0 and curr_val == 0:
-                instr.add_note(Note(prev_val, pitch, start_t, t))
-                start_t = -1
-            prev_val = curr_val
-        # add the note that last to the end
-        if prev_val != 0:
-            instr.add_note(Note(prev_val, pitch, start_t, roll.shape[0]))
-    return instr
 
+def get_instruments_from_piano_rolls(rolls,
+                                     program=0,
+                                     is_drum=False,
+                                     name='',
+                                     split_velocity=False,
+                                     columnar=False):
+    """Batched ``get_instrument_from_piano_roll`` over a
+    [batch x frames x 128] array, returns a list of Instruments"""
+    if not isinstance(rolls, np.ndarray):
+        raise TypeError('Piano rolls should be an np.ndarray')
+    if len(rolls.shape) != 3 or rolls.shape[2] != 128:
+        raise ValueError('Piano rolls must have shape [batch x frames x 128]')
+
+    batch, start, end, pitch, velocity = _decode_piano_rolls(
+        rolls, split_velocity)
+    bounds = np.searchsorted(batch, np.arange(rolls.shape[0] + 1))
+    return [
+        _instrument_from_notes(start[lo:hi], end[lo:hi], pitch[lo:hi],
+                               velocity[lo:hi], program, is_drum, name,
+                               columnar)
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
 
-def merge_instruments(instr1, instr2):
-    assert isinstance(instr1, Instrument)
-    assert isinstance(instr2, Instrument)
-    assert instr1.is_drum == instr2.is_drum
 
-    instr = Instrument(
-        instr1.program, is_drum=instr1.is_drum, name=instr1.name)
-    instr.notes = instr1.notes + instr2.notes
+def merge_instruments(*instrs, dedupe=False):
+    """Merges the notes and controls of ``instrs`` into a new instrument
+    with the program and name of the first one.
+    Parameters
+    ----------
+    instrs : Instrument
+        Instruments to merge, all drums or none.
+    dedupe : bool
+        Keep a single note, the longest, of the notes starting at the same
+        tick with the same pitch.
+    Returns
+    -------
+    instr : Instrument
+        Instrument of the type of the first one, with its notes sorted by
+        start and pitch. Merging plain ``Instrument``s shares their ``Note``
+        objects.
+    """
+    if not instrs:
+        raise ValueError('Expecting at least one instrument')
+    for instr in instrs:
+        assert isinstance(instr, Instrument)
+        assert instr.is_drum == instrs[0].is_drum
+
+    instr = type(instrs[0])(
+        instrs[0].program, is_drum=instrs[0].is_drum, name=instrs[0].name)
+    if all(type(i) is Instrument for i in instrs):
+        # sorting the Note lists directly is much cheaper than a round trip
+        # through arrays, and is linear on already sorted inputs
+        notes = [n for i in instrs for n in i.notes]
+        if dedupe:
+            notes.sort(key=lambda n: (n.start, n.pitch, -n.end))
+            notes = [
+                next(group) for _, group in itertools.groupby(
+                    notes, operator.attrgetter('start', 'pitch'))
+            ]
+        else:
+            notes.sort(key=operator.attrgetter('start', 'pitch'))
+        instr.notes = notes
+    else:
+        instr.set_note_array(_merge_note_arrays(instrs, dedupe))
+    for name in ('control_changes', 'pitch_bends', 'aftertouches'):
+        events = np.concatenate([getattr(i, name) for i in instrs])
+        setattr(instr, name, events[np.argsort(events['time'],
+                                               kind='stable')])
     return instr
 
 
+def _merge_note_arrays(instrs, dedupe):
+    notes = _concat_notes(instrs)[0]
+    if dedupe:
+        order = np.lexsort((-notes['end'], notes['pitch'], notes['start']))
+        notes = notes[order]
+        first = np.ones(len(notes), dtype=bool)
+        first[1:] = ((notes['start'][1:] != notes['start'][:-1]) |
+                     (notes['pitch'][1:] != notes['pitch'][:-1]))
+        notes = notes[first]
+    else:
+        notes = notes[np.lexsort((notes['pitch'], notes['start']))]
+    return notes
+
+
 def midi_write_pianoroll(midi_file,
                          roll,
                          resolution,
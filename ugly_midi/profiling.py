@@ -0,0 +1,195 @@
+"""
+Opt-in timing of the stages of loading, converting and writing midi files.
+
+The library wraps its stages in ``stage(name)``, which does nothing unless a
+``Profile`` is active::
+
+    with Profile() as prof:
+        midi = MidiObject(path)
+        midi.change_resolution(24)
+    print(prof.summary())
+
+A profile only records the stages run in the thread, or asyncio task, that
+entered it, so threads profiling their own loads don't mix their records.
+Stages run on an executor are recorded by a profile entered there, as
+``load_corpus`` does with ``profile=True``.
+"""
+import collections
+import contextvars
+import time
+import tracemalloc
+
+StageStats = collections.namedtuple('StageStats',
+                                    ['calls', 'seconds', 'count', 'alloc_bytes'])
+StageStats.__doc__ = """Totals of one stage.
+Attributes
+----------
+calls : int
+    Number of times the stage ran.
+seconds : float
+    Total wall time.
+count : int
+    Total number of items (events or notes) processed, as reported by the
+    stage.
+alloc_bytes : int
+    Total growth of the memory traced by ``tracemalloc`` over the stage,
+    ``None`` if memory wasn't traced.
+"""
+
+# the profiles collecting records in the current context, innermost last
+_active = contextvars.ContextVar('ugly_midi_profiles', default=())
+
+
+class _NullStage(object):
+    """Stage returned while no profile is active, ignores everything"""
+    count = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    __slots__ = ('name', 'count', '_start', '_memory')
+
+    def __init__(self, name):
+        self.name = name
+        self.count = None
+
+    def __enter__(self):
+        self._memory = (tracemalloc.get_traced_memory()[0]
+                        if tracemalloc.is_tracing() else None)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self._start
+        alloc = None
+        if self._memory is not None and tracemalloc.is_tracing():
+            alloc = tracemalloc.get_traced_memory()[0] - self._memory
+        for profile in _active.get():
+            profile.records.append((profile.label, self.name, seconds,
+                                    self.count, alloc))
+        return False
+
+
+def stage(name):
+    """Context manager timing the stage ``name`` for the active profiles.
+    Set ``count`` on the returned object to record the number of items the
+    stage processed. Without an active profile it costs a function call."""
+    if not _active.get():
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def enabled():
+    """Whether a profile is active in the current thread or task"""
+    return bool(_active.get())
+
+
+class Profile(object):
+    """Records the stages run while the profile is active.
+
+    Profiles are picklable, so workers can return them to be merged into a
+    summary of the whole batch.
+    Parameters
+    ----------
+    label : str
+        Attached to every record, e.g. the path of the file being loaded.
+    memory : bool
+        Also record the memory allocated by every stage with
+        ``tracemalloc``, which slows everything down. The memory is traced
+        for the whole process, so it includes what other threads allocate
+        meanwhile.
+    Attributes
+    ----------
+    records : list
+        ``(label, stage, seconds, count, alloc_bytes)`` of every stage run.
+    """
+
+    def __init__(self, label=None, memory=False):
+        self.label = label
+        self.memory = memory
+        self.records = []
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        _active.set(_active.get() + (self, ))
+        return self
+
+    def __exit__(self, *exc_info):
+        _active.set(tuple(p for p in _active.get() if p is not self))
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def merge(self, other):
+        """Adds the records of ``other`` to this profile"""
+        self.records.extend(other.records)
+        return self
+
+    def stages(self, label=None):
+        """Totals per stage, in the order the stages first ran.
+        Parameters
+        ----------
+        label : str
+            Only use the records with this label, ``None`` uses all.
+        Returns
+        -------
+        stages : OrderedDict
+            Maps stage names to ``StageStats``.
+        """
+        totals = collections.OrderedDict()
+        for record_label, name, seconds, count, alloc in self.records:
+            if label is not None and record_label != label:
+                continue
+            calls, total, total_count, total_alloc = totals.get(
+                name, (0, 0., None, None))
+            if count is not None:
+                total_count = (total_count or 0) + count
+            if alloc is not None:
+                total_alloc = (total_alloc or 0) + alloc
+            totals[name] = (calls + 1, total + seconds, total_count,
+                            total_alloc)
+        return collections.OrderedDict(
+            (name, StageStats(*t)) for name, t in totals.items())
+
+    def labels(self):
+        """The labels of the records, in order"""
+        return list(
+            collections.OrderedDict.fromkeys(r[0] for r in self.records))
+
+    def summary(self):
+        """Formats the totals per stage as a table. Stages run inside other
+        stages are counted in both."""
+        lines = [
+            '{:<20} {:>8} {:>10} {:>10} {:>12} {:>12} {:>10}'.format(
+                'stage', 'calls', 'total s', 'mean ms', 'items',
+                'items/s', 'alloc MB')
+        ]
+        for name, s in self.stages().items():
+            lines.append(
+                '{:<20} {:>8} {:>10.3f} {:>10.3f} {:>12} {:>12} {:>10}'.format(
+                    name, s.calls, s.seconds, 1e3 * s.seconds / s.calls,
+                    '' if s.count is None else s.count,
+                    '' if s.count is None or not s.seconds else
+                    '{:.0f}'.format(s.count / s.seconds),
+                    '' if s.alloc_bytes is None else
+                    '{:.1f}'.format(s.alloc_bytes / 1e6)))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.summary()
+
+    def __repr__(self):
+        return 'Profile(label={!r}, n_records={})'.format(
+            self.label, len(self.records))
@@ -0,0 +1,425 @@
+"""
+A minimal standard midi file (SMF) reader and writer that decodes the raw
+bytes straight into NumPy event arrays and encodes them back, bypassing
+mido's per-message objects.
+"""
+from array import array
+import struct
+import numpy as np
+
+# channel voice message types, the high nibble of the status byte
+NOTE_OFF = 0x8
+NOTE_ON = 0x9
+POLY_AFTERTOUCH = 0xA
+CONTROL_CHANGE = 0xB
+PROGRAM_CHANGE = 0xC
+CHANNEL_AFTERTOUCH = 0xD
+PITCH_BEND = 0xE
+
+EVENT_DTYPE = np.dtype([('track', np.int32), ('tick', np.int64),
+                        ('type', np.uint8), ('channel', np.uint8),
+                        ('data1', np.uint8), ('data2', np.uint8)])
+
+# number of data bytes following a system common / realtime status byte
+_SYSTEM_DATA_LENGTH = {
+    0xf1: 1,
+    0xf2: 2,
+    0xf3: 1,
+    0xf6: 0,
+    0xf8: 0,
+    0xfa: 0,
+    0xfb: 0,
+    0xfc: 0,
+    0xfe: 0,
+}
+
+_KEY_SIGNATURES = {
+    (-7, 0): 'Cb', (-6, 0): 'Gb', (-5, 0): 'Db', (-4, 0): 'Ab',
+    (-3, 0): 'Eb', (-2, 0): 'Bb', (-1, 0): 'F', (0, 0): 'C',
+    (1, 0): 'G', (2, 0): 'D', (3, 0): 'A', (4, 0): 'E',
+    (5, 0): 'B', (6, 0): 'F#', (7, 0): 'C#',
+    (-7, 1): 'Abm', (-6, 1): 'Ebm', (-5, 1): 'Bbm', (-4, 1): 'Fm',
+    (-3, 1): 'Cm', (-2, 1): 'Gm', (-1, 1): 'Dm', (0, 1): 'Am',
+    (1, 1): 'Em', (2, 1): 'Bm', (3, 1): 'F#m', (4, 1): 'C#m',
+    (5, 1): 'G#m', (6, 1): 'D#m', (7, 1): 'A#m',
+}
+
+_KEY_SIGNATURE_CODES = {key: code for code, key in _KEY_SIGNATURES.items()}
+
+META_TRACK_NAME = 0x03
+META_SET_TEMPO = 0x51
+META_TIME_SIGNATURE = 0x58
+META_KEY_SIGNATURE = 0x59
+META_END_OF_TRACK = 0x2f
+
+
+class SmfData(object):
+    """Contents of a midi file decoded into arrays.
+    Attributes
+    ----------
+    type : int
+        Midi file type (0, 1 or 2).
+    resolution : int
+        Ticks per beat.
+    n_tracks : int
+        Number of track chunks.
+    events : np.ndarray
+        Channel voice events with dtype ``EVENT_DTYPE`` in file order, i.e.
+        sorted by track and then by absolute tick.
+    track_names : dict
+        Maps track index to the last track name found in that track.
+    tempos : list
+        ``(tick, microseconds per beat)`` pairs found in track 0.
+    key_signatures : list
+        ``(tick, key)`` pairs found in track 0.
+    time_signatures : list
+        ``(tick, numerator, denominator)`` pairs found in track 0.
+    max_tick : int
+        Largest absolute tick of any event, meta events included.
+    meta_on_other_tracks : bool
+        Whether tempo, key or time signature events appear after track 0.
+    """
+
+    def __init__(self, type, resolution, n_tracks):
+        self.type = type
+        self.resolution = resolution
+        self.n_tracks = n_tracks
+        self.events = np.zeros(0, dtype=EVENT_DTYPE)
+        self.track_names = {}
+        self.tempos = []
+        self.key_signatures = []
+        self.time_signatures = []
+        self.max_tick = 0
+        self.meta_on_other_tracks = False
+
+
+def _read_source(source):
+    """Returns the raw bytes of a path, file object or bytes-like object"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    if hasattr(source, 'read'):
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def _decode_meta(smf, track_idx, tick, meta_type, payload):
+    if meta_type == META_TRACK_NAME:
+        smf.track_names[track_idx] = bytes(payload).decode('latin1')
+        return
+    if meta_type not in (META_SET_TEMPO, META_TIME_SIGNATURE,
+                         META_KEY_SIGNATURE):
+        return
+    if track_idx != 0:
+        smf.meta_on_other_tracks = True
+        return
+    if meta_type == META_SET_TEMPO:
+        smf.tempos.append(
+            (tick, (payload[0] << 16) | (payload[1] << 8) | payload[2]))
+    elif meta_type == META_TIME_SIGNATURE:
+        smf.time_signatures.append((tick, payload[0], 2**payload[1]))
+    else:
+        key = payload[0] - 256 if payload[0] > 127 else payload[0]
+        mode = payload[1]
+        if (key, mode) not in _KEY_SIGNATURES:
+            raise ValueError(
+                'Could not decode key signature ({}, {})'.format(key, mode))
+        smf.key_signatures.append((tick, _KEY_SIGNATURES[(key, mode)]))
+
+
+# number of data bytes following every channel voice status byte
+_CHANNEL_DATA_LENGTH = [0] * 0x80 + [
+    1 if 0xc0 <= status < 0xe0 else 2 for status in range(0x80, 0x100)
+]
+
+
+def _read_meta(smf, data, pos, status, track_idx, tick):
+    """Reads the meta or sysex event whose status byte ``status`` precedes
+    ``pos``, returns the position after it"""
+    if status == 0xff:
+        meta_type = data[pos]
+        pos += 1
+    length = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        length = (length << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            break
+    if status == 0xff:
+        _decode_meta(smf, track_idx, tick, meta_type, data[pos:pos + length])
+    return pos + length
+
+
+def _decode_track(smf, data, pos, end, track_idx, append):
+    """Decodes the events of one track, appending a
+    ``(track, tick, type, channel, data1, data2)`` record for every channel
+    event. Returns the tick of the last event."""
+    tick = 0
+    running_status = None
+    while pos < end:
+        # delta time
+        byte = data[pos]
+        pos += 1
+        delta = byte & 0x7f
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            delta = (delta << 7) | (byte & 0x7f)
+        tick += delta
+
+        status = data[pos]
+        if status < 0x80:
+            if running_status is None:
+                raise ValueError('Running status without last status')
+            status = running_status
+        else:
+            pos += 1
+            if status != 0xff:
+                # meta messages don't set running status
+                running_status = status
+
+        if status < 0xf0:
+            d1 = data[pos]
+            if status < 0xc0 or status >= 0xe0:
+                d2 = data[pos + 1]
+                pos += 2
+            else:
+                d2 = 0
+                pos += 1
+            if (d1 | d2) & 0x80:
+                raise ValueError('Data byte must be in range 0..127')
+            append((track_idx, tick, status >> 4, status & 0xf, d1, d2))
+        elif status == 0xff or status == 0xf0 or status == 0xf7:
+            pos = _read_meta(smf, data, pos, status, track_idx, tick)
+        elif status in _SYSTEM_DATA_LENGTH:
+            pos += _SYSTEM_DATA_LENGTH[status]
+        else:
+            raise ValueError('Undefined status byte 0x{:02x}'.format(status))
+    return tick
+
+
+def _skim_track(smf, data, pos, end, track_idx, append):
+    """Like ``_decode_track``, but only appends the program changes and the
+    note-ons with a velocity. The data bytes of the other channel events are
+    skipped without reading or validating them."""
+    lengths = _CHANNEL_DATA_LENGTH
+    tick = 0
+    running_status = None
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        if byte & 0x80:
+            delta = byte & 0x7f
+            while byte & 0x80:
+                byte = data[pos]
+                pos += 1
+                delta = (delta << 7) | (byte & 0x7f)
+            tick += delta
+        else:
+            tick += byte
+
+        status = data[pos]
+        if status < 0x80:
+            if running_status is None:
+                raise ValueError('Running status without last status')
+            status = running_status
+        else:
+            pos += 1
+            if status != 0xff:
+                running_status = status
+
+        if status < 0xf0:
+            kind = status >> 4
+            if kind == NOTE_ON:
+                d2 = data[pos + 1]
+                if d2:
+                    d1 = data[pos]
+                    if (d1 | d2) & 0x80:
+                        raise ValueError('Data byte must be in range 0..127')
+                    append((track_idx, tick, NOTE_ON, status & 0xf, d1, d2))
+            elif kind == PROGRAM_CHANGE:
+                d1 = data[pos]
+                if d1 & 0x80:
+                    raise ValueError('Data byte must be in range 0..127')
+                append((track_idx, tick, PROGRAM_CHANGE, status & 0xf, d1, 0))
+            pos += lengths[status]
+        elif status == 0xff or status == 0xf0 or status == 0xf7:
+            pos = _read_meta(smf, data, pos, status, track_idx, tick)
+        elif status in _SYSTEM_DATA_LENGTH:
+            pos += _SYSTEM_DATA_LENGTH[status]
+        else:
+            raise ValueError('Undefined status byte 0x{:02x}'.format(status))
+    return tick
+
+
+def read_smf(source, notes=True):
+    """Decodes a midi file into an ``SmfData``.
+    Parameters
+    ----------
+    source : str, file object or bytes
+        Path to the midi file, an open binary file or the raw file bytes.
+    notes : bool
+        Whether to keep every channel event. If False only program changes
+        and note-ons are kept, which is enough to find the instruments, and
+        the other channel events are skipped without being decoded.
+    """
+    data = memoryview(_read_source(source)).cast('B')
+    size = len(data)
+
+    if size < 14 or bytes(data[:4]) != b'MThd':
+        raise ValueError('MThd not found. Probably not a MIDI file')
+    header_size = struct.unpack('>L', data[4:8])[0]
+    if header_size < 6 or 8 + header_size > size:
+        raise ValueError('Truncated MThd chunk')
+    file_type, n_tracks, resolution = struct.unpack('>hhh', data[8:14])
+    pos = 8 + header_size
+
+    smf = SmfData(file_type, resolution, n_tracks)
+    # flat (track, tick, type, channel, data1, data2) records
+    flat = array('q')
+    read_track = _decode_track if notes else _skim_track
+    max_tick = 0
+
+    try:
+        for track_idx in range(n_tracks):
+            if pos + 8 > size:
+                raise ValueError(
+                    'Expected {} tracks, found {}'.format(n_tracks, track_idx))
+            if bytes(data[pos:pos + 4]) != b'MTrk':
+                raise ValueError('No MTrk header at start of track')
+            end = pos + 8 + struct.unpack('>L', data[pos + 4:pos + 8])[0]
+            if end > size:
+                raise ValueError('Truncated track {}'.format(track_idx))
+            tick = read_track(smf, data, pos + 8, end, track_idx, flat.extend)
+            if tick > max_tick:
+                max_tick = tick
+            pos = end
+    except IndexError:
+        raise ValueError('Unexpected end of midi data')
+
+    smf.max_tick = max_tick
+    records = np.frombuffer(flat, dtype=np.int64).reshape(-1, 6)
+    events = np.empty(len(records), dtype=EVENT_DTYPE)
+    for i, name in enumerate(EVENT_DTYPE.names):
+        events[name] = records[:, i]
+    smf.events = events
+    return smf
+
+
+def encode_vlq(value):
+    """Encodes a non-negative integer as a variable-length quantity"""
+    if value < 0:
+        raise ValueError('message time must be non-negative in MIDI file')
+    out = [value & 0x7f]
+    value >>= 7
+    while value:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def chunk(name, payload):
+    """Frames ``payload`` as a chunk named ``name``"""
+    return name + struct.pack('>L', len(payload)) + payload
+
+
+def encode_header(file_type, n_tracks, resolution):
+    return chunk(b'MThd', struct.pack('>hhh', file_type, n_tracks,
+                                      resolution))
+
+
+def encode_meta_events(events):
+    """Encodes a track of meta events.
+    Parameters
+    ----------
+    events : list
+        ``(tick, meta_type, payload)`` triples sorted by tick.
+    Returns
+    -------
+    track : bytes
+        The MTrk chunk, terminated by an end of track event.
+    """
+    out = bytearray()
+    now = 0
+    for tick, meta_type, payload in events:
+        out += encode_vlq(tick - now)
+        out += bytes([0xff, meta_type]) + encode_vlq(len(payload)) + payload
+        now = tick
+    out += bytes([0, 0xff, META_END_OF_TRACK, 0])
+    return chunk(b'MTrk', bytes(out))
+
+
+def tempo_payload(tempo):
+    return bytes([tempo >> 16, tempo >> 8 & 0xff, tempo & 0xff])
+
+
+def time_signature_payload(numerator, denominator):
+    return bytes([numerator, denominator.bit_length() - 1, 24, 8])
+
+
+def key_signature_payload(key):
+    if key not in _KEY_SIGNATURE_CODES:
+        raise ValueError('invalid key {!r}'.format(key))
+    sharps, mode = _KEY_SIGNATURE_CODES[key]
+    return bytes([sharps & 0xff, mode])
+
+
+def encode_channel_events(ticks, status, data1, data2):
+    """Encodes a track of channel voice events with vectorized delta time
+    encoding and running status.
+    Parameters
+    ----------
+    ticks : np.ndarray
+        Absolute ticks, sorted.
+    status : np.ndarray
+        Status bytes.
+    data1, data2 : np.ndarray
+        Data bytes. ``data2`` is ignored for program changes and channel
+        aftertouch.
+    Returns
+    -------
+    track : bytes
+        The MTrk chunk, terminated by an end of track event.
+    """
+    ticks = np.asarray(ticks, dtype=np.int64)
+    status = np.asarray(status, dtype=np.int64)
+    data1 = np.asarray(data1, dtype=np.int64)
+    data2 = np.asarray(data2, dtype=np.int64)
+    end_of_track = bytes([0, 0xff, META_END_OF_TRACK, 0])
+    if not len(ticks):
+        return chunk(b'MTrk', end_of_track)
+
+    deltas = np.diff(ticks, prepend=0)
+    if (deltas < 0).any():
+        raise ValueError('message time must be non-negative in MIDI file')
+    n_data = np.where((status >> 4 == PROGRAM_CHANGE) |
+                      (status >> 4 == CHANNEL_AFTERTOUCH), 1, 2)
+    if ((data1 < 0) | (data1 > 127) |
+        ((n_data == 2) & ((data2 < 0) | (data2 > 127)))).any():
+        raise ValueError('data byte must be in range 0..127')
+
+    n_vlq = np.ones(len(deltas), dtype=np.int64)
+    rest = deltas >> 7
+    while rest.any():
+        n_vlq += rest > 0
+        rest >>= 7
+    # the status byte is dropped when it repeats the previous one
+    has_status = np.ones(len(status), dtype=bool)
+    has_status[1:] = status[1:] != status[:-1]
+
+    lengths = n_vlq + has_status + n_data
+    starts = np.cumsum(lengths) - lengths
+    out = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(n_vlq.max())):
+        mask = n_vlq > k
+        shift = 7 * (n_vlq[mask] - 1 - k)
+        continuation = np.where(k < n_vlq[mask] - 1, 0x80, 0)
+        out[starts[mask] + k] = ((deltas[mask] >> shift) & 0x7f) | continuation
+    pos = starts + n_vlq
+    out[pos[has_status]] = status[has_status]
+    pos += has_status
+    out[pos] = data1
+    two = n_data == 2
+    out[pos[two] + 1] = data2[two]
+    return chunk(b'MTrk', out.tobytes() + end_of_track)
@@ -0,0 +1,348 @@
+"""
+Incremental construction of a ``MidiObject`` from a midi file arriving in
+chunks, or from live messages.
+"""
+from ugly_midi.midi_file import MidiObject, _check_header, _check_max_tick
+from ugly_midi.midi_file import _warn_meta_on_other_tracks
+from ugly_midi.instrument import Instrument, ColumnarInstrument
+from ugly_midi.containers import NOTE_DTYPE, CONTROL_CHANGE_DTYPE
+from ugly_midi.containers import PITCH_BEND_DTYPE, AFTERTOUCH_DTYPE
+from ugly_midi.smf import SmfData, _decode_meta, _SYSTEM_DATA_LENGTH
+from ugly_midi.smf import NOTE_ON, NOTE_OFF, PROGRAM_CHANGE, CONTROL_CHANGE
+from ugly_midi.smf import PITCH_BEND, POLY_AFTERTOUCH, CHANNEL_AFTERTOUCH
+import numpy as np
+import struct
+import bisect
+import collections
+
+_CONTROL_DTYPES = (CONTROL_CHANGE_DTYPE, PITCH_BEND_DTYPE, AFTERTOUCH_DTYPE)
+
+
+class StreamBuilder(object):
+    """Builds a ``MidiObject`` from a midi file fed in chunks, or from live
+    messages.
+
+    Events are paired into notes as they arrive, with a table of the open
+    note-ons, following the rules of ``MidiObject``, so the notes finished
+    so far are available before the stream ends. The tracks of a midi file
+    arrive one after the other, so a program change can't affect the notes
+    of the tracks read before it, unlike when loading the whole file.
+    Parameters
+    ----------
+    resolution : int
+        Ticks per beat of the messages passed to ``feed_messages``. It is
+        read from the header of the data passed to ``feed``.
+    columnar : bool
+        Build ``ColumnarInstrument``s.
+    """
+
+    def __init__(self, resolution=None, columnar=False):
+        self.resolution = resolution
+        self.instrument_class = ColumnarInstrument if columnar else Instrument
+        # track names and meta events, with the fields of an SmfData
+        self._meta = SmfData(1, resolution, 0)
+        self._warned_meta = False
+
+        # smf parsing state
+        self._buffer = bytearray()
+        self._n_tracks = None
+        self._track = 0
+        self._track_end = None
+        self._running_status = None
+
+        self._ticks = collections.defaultdict(int)
+        self._n_events = 0
+        # (tick, track, event count, program) of the program changes of
+        # every channel, in playback order
+        self._program_changes = [[] for _ in range(16)]
+        # (track, channel, pitch) -> (program, velocity, start)
+        self._open = {}
+        # (program, channel, track) -> instrument index
+        self._index = {}
+        self._keys = []
+        self._created = []
+        self._notes = []
+        self._controls = []
+        self._popped = []
+        # (channel, track) -> control events before any instrument of their
+        # program
+        self._stragglers = {}
+
+    @property
+    def n_open_notes(self):
+        """Number of note-ons still waiting for their note-off"""
+        return len(self._open)
+
+    def feed(self, data):
+        """Feeds the next chunk of a standard midi file. Events are
+        processed as soon as they are complete.
+        Parameters
+        ----------
+        data : bytes
+            Any number of bytes following the previous chunk.
+        """
+        self._buffer += data
+        buf = self._buffer
+        pos = 0
+        while True:
+            if self._n_tracks is None:
+                if len(buf) < 8:
+                    break
+                if bytes(buf[:4]) != b'MThd':
+                    raise ValueError('MThd not found. Probably not a MIDI file')
+                header_size = struct.unpack('>L', buf[4:8])[0]
+                if header_size < 6:
+                    raise ValueError('Truncated MThd chunk')
+                if len(buf) < 8 + header_size:
+                    break
+                file_type, n_tracks, resolution = struct.unpack(
+                    '>hhh', buf[8:14])
+                _check_header(file_type, n_tracks, '<stream>')
+                self._n_tracks = n_tracks
+                self._meta.type = file_type
+                self._meta.n_tracks = n_tracks
+                self.resolution = self._meta.resolution = resolution
+                pos = 8 + header_size
+            elif self._track == self._n_tracks:
+                # data after the last track is ignored
+                pos = len(buf)
+                break
+            elif self._track_end is None:
+                if len(buf) < pos + 8:
+                    break
+                if bytes(buf[pos:pos + 4]) != b'MTrk':
+                    raise ValueError('No MTrk header at start of track')
+                self._track_end = pos + 8 + struct.unpack(
+                    '>L', buf[pos + 4:pos + 8])[0]
+                self._running_status = None
+                pos += 8
+            elif pos >= self._track_end:
+                pos = self._track_end
+                self._track_end = None
+                self._track += 1
+            else:
+                end = self._read_event(buf, pos)
+                if end is None:
+                    break
+                pos = end
+        del buf[:pos]
+        if self._track_end is not None:
+            self._track_end -= pos
+
+    def _read_event(self, buf, pos):
+        """Processes the event at ``pos`` of ``buf``. Returns the position
+        after it, or None if it isn't complete yet."""
+        size = len(buf)
+        try:
+            byte = buf[pos]
+            pos += 1
+            delta = byte & 0x7f
+            while byte & 0x80:
+                byte = buf[pos]
+                pos += 1
+                delta = (delta << 7) | (byte & 0x7f)
+
+            status = buf[pos]
+            explicit = status >= 0x80
+            if explicit:
+                pos += 1
+            elif self._running_status is None:
+                raise ValueError('Running status without last status')
+            else:
+                status = self._running_status
+
+            if status < 0xf0:
+                d1 = buf[pos]
+                if status < 0xc0 or status >= 0xe0:
+                    d2 = buf[pos + 1]
+                    pos += 2
+                else:
+                    d2 = 0
+                    pos += 1
+                if (d1 | d2) & 0x80:
+                    raise ValueError('Data byte must be in range 0..127')
+            elif status == 0xff or status == 0xf0 or status == 0xf7:
+                if status == 0xff:
+                    meta_type = buf[pos]
+                    pos += 1
+                length = 0
+                while True:
+                    byte = buf[pos]
+                    pos += 1
+                    length = (length << 7) | (byte & 0x7f)
+                    if byte < 0x80:
+                        break
+                payload = buf[pos:pos + length]
+                pos += length
+            elif status in _SYSTEM_DATA_LENGTH:
+                pos += _SYSTEM_DATA_LENGTH[status]
+            else:
+                raise ValueError(
+                    'Undefined status byte 0x{:02x}'.format(status))
+            if pos > size:
+                return None
+        except IndexError:
+            return None
+
+        # the event is complete, update the state
+        if explicit and status != 0xff:
+            self._running_status = status
+        tick = self._advance(self._track, delta)
+        if status < 0xf0:
+            self._event(self._track, tick, status >> 4, status & 0xf, d1, d2)
+        elif status == 0xff:
+            _decode_meta(self._meta, self._track, tick, meta_type, payload)
+            self._check_meta()
+        return pos
+
+    def feed_messages(self, messages, track=0):
+        """Feeds live messages.
+        Parameters
+        ----------
+        messages : iterable
+            ``mido`` messages, with ``time`` the delta in ticks from the
+            previous message of ``track``.
+        track : int
+            Track the messages belong to.
+        """
+        meta = self._meta
+        for msg in messages:
+            tick = self._advance(track, msg.time)
+            if not msg.is_meta:
+                data = msg.bytes()
+                if data[0] < 0xf0:
+                    self._event(track, tick, data[0] >> 4, data[0] & 0xf,
+                                data[1], data[2] if len(data) > 2 else 0)
+            elif msg.type == 'track_name':
+                meta.track_names[track] = msg.name
+            elif msg.type in ('set_tempo', 'key_signature', 'time_signature'):
+                if track != 0:
+                    meta.meta_on_other_tracks = True
+                elif msg.type == 'set_tempo':
+                    meta.tempos.append((tick, msg.tempo))
+                elif msg.type == 'key_signature':
+                    meta.key_signatures.append((tick, msg.key))
+                else:
+                    meta.time_signatures.append(
+                        (tick, msg.numerator, msg.denominator))
+                self._check_meta()
+
+    def _advance(self, track, delta):
+        tick = self._ticks[track] + delta
+        _check_max_tick(tick + 1)
+        self._ticks[track] = tick
+        return tick
+
+    def _check_meta(self):
+        if self._meta.meta_on_other_tracks and not self._warned_meta:
+            self._warned_meta = True
+            _warn_meta_on_other_tracks()
+
+    def _event(self, track, tick, kind, channel, data1, data2):
+        self._n_events += 1
+        if kind == PROGRAM_CHANGE:
+            bisect.insort(self._program_changes[channel],
+                          (tick, track, self._n_events, data1))
+        elif kind == NOTE_ON and data2:
+            self._open[(track, channel, data1)] = (self._program(
+                channel, tick, track), data2, tick)
+        elif kind == NOTE_ON or kind == NOTE_OFF:
+            # ignore spurious note-offs
+            key = (track, channel, data1)
+            if key not in self._open:
+                return
+            program, velocity, start = self._open[key]
+            i = self._instrument(program, channel, track, tick)
+            if tick != start:
+                self._notes[i].append((start, tick, data1, velocity))
+                del self._open[key]
+        else:
+            if kind == CONTROL_CHANGE:
+                field, record = 0, (tick, data1, data2)
+            elif kind == PITCH_BEND:
+                field, record = 1, (tick, (data2 << 7 | data1) - 8192)
+            elif kind == POLY_AFTERTOUCH:
+                field, record = 2, (tick, data1, data2)
+            elif kind == CHANNEL_AFTERTOUCH:
+                field, record = 2, (tick, -1, data1)
+            else:
+                return
+            i = self._index.get((self._program(channel, tick, track), channel,
+                                 track))
+            if i is None:
+                controls = self._stragglers.setdefault((channel, track),
+                                                       ([], [], []))
+            else:
+                controls = self._controls[i]
+            controls[field].append(record)
+
+    def _program(self, channel, tick, track):
+        """Program in effect on ``channel`` for the current event"""
+        changes = self._program_changes[channel]
+        i = bisect.bisect(changes, (tick, track, self._n_events))
+        return changes[i - 1][3] if i else 0
+
+    def _instrument(self, program, channel, track, tick):
+        """Index of the instrument of (program, channel, track), created
+        with the stragglers of its channel and track if needed"""
+        key = (program, channel, track)
+        i = self._index.get(key)
+        if i is None:
+            i = self._index[key] = len(self._keys)
+            self._keys.append(key)
+            # playback order of the creating event, as when loading a file
+            self._created.append((tick, track, self._n_events))
+            self._notes.append([])
+            stragglers = self._stragglers.get((channel, track), ((), (), ()))
+            self._controls.append(tuple(list(c) for c in stragglers))
+            self._popped.append(0)
+        return i
+
+    def _new_instrument(self, i, notes):
+        program, channel, track = self._keys[i]
+        instr = self.instrument_class(program, channel == 9,
+                                      self._meta.track_names.get(track, ''))
+        instr.set_note_array(np.array(notes, dtype=NOTE_DTYPE))
+        return instr
+
+    def pop_notes(self):
+        """Returns the notes finished since the last call.
+        Returns
+        -------
+        instruments : list
+            One instrument, without control events, per (program, channel,
+            track) with new notes, holding only those notes, in the order
+            the instruments were created.
+        """
+        instruments = []
+        for i, notes in enumerate(self._notes):
+            if len(notes) > self._popped[i]:
+                instruments.append(
+                    self._new_instrument(i, notes[self._popped[i]:]))
+                self._popped[i] = len(notes)
+        return instruments
+
+    def get_midi(self):
+        """Returns a ``MidiObject`` with the meta events and the notes
+        finished so far. Notes still open are left out."""
+        if self.resolution is None:
+            raise ValueError('The resolution is unknown before the header')
+        midi = MidiObject(resolution=self.resolution)
+        midi._load_smf_meta(self._meta)
+        for i in sorted(range(len(self._keys)), key=self._created.__getitem__):
+            instr = self._new_instrument(i, self._notes[i])
+            (instr.control_changes, instr.pitch_bends,
+             instr.aftertouches) = [
+                 np.array(c, dtype=dtype)
+                 for c, dtype in zip(self._controls[i], _CONTROL_DTYPES)
+             ]
+            midi.instruments.append(instr)
+        return midi
+
+    def close(self):
+        """Checks that the whole midi file was fed and returns the
+        ``MidiObject``"""
+        if self._n_tracks is not None and self._track < self._n_tracks:
+            raise ValueError('Expected {} tracks, found {}'.format(
+                self._n_tracks, self._track))
+        return self.get_midi()
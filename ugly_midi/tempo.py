@@ -0,0 +1,66 @@
+"""
+Conversion between ticks and seconds
+"""
+import numpy as np
+
+DEFAULT_BPM = 120.
+
+
+class TempoMap(object):
+    """Piecewise linear map between ticks and seconds.
+
+    Built once from the tempo changes of a file, it holds the tick and the
+    cumulative seconds of every tempo change, so that conversions of whole
+    arrays are a ``np.searchsorted`` away.
+    Parameters
+    ----------
+    tempo_changes : list
+        ``TempoChange`` events, with times in ticks.
+    resolution : int
+        Ticks per beat.
+    """
+
+    def __init__(self, tempo_changes, resolution):
+        changes = sorted(tempo_changes, key=lambda e: e.time)
+        ticks = np.array([e.time for e in changes], dtype=np.float64)
+        bpms = np.array([e.bpm for e in changes], dtype=np.float64)
+        # the tempo defaults to 120 bpm until the first change, and the last
+        # of several changes on the same tick wins
+        if not len(ticks) or ticks[0] > 0:
+            ticks = np.concatenate([[0.], ticks])
+            bpms = np.concatenate([[DEFAULT_BPM], bpms])
+        last = np.append(ticks[1:] != ticks[:-1], True)
+        ticks, bpms = ticks[last], bpms[last]
+
+        self.resolution = resolution
+        self.ticks = ticks
+        self.bpms = bpms
+        self.seconds_per_tick = 60. / (bpms * resolution)
+        self.seconds = np.concatenate(
+            [[0.], np.cumsum(np.diff(ticks) * self.seconds_per_tick[:-1])])
+
+    @classmethod
+    def from_midi(cls, midi):
+        return cls(midi.tempo_changes, midi.resolution)
+
+    def ticks_to_seconds(self, ticks):
+        """Converts an array of ticks to seconds"""
+        ticks = np.asarray(ticks, dtype=np.float64)
+        idx = np.maximum(np.searchsorted(self.ticks, ticks, 'right') - 1, 0)
+        return (self.seconds[idx] +
+                (ticks - self.ticks[idx]) * self.seconds_per_tick[idx])
+
+    def seconds_to_ticks(self, seconds):
+        """Converts an array of seconds to (fractional) ticks"""
+        seconds = np.asarray(seconds, dtype=np.float64)
+        idx = np.maximum(np.searchsorted(self.seconds, seconds, 'right') - 1,
+                         0)
+        return (self.ticks[idx] +
+                (seconds - self.seconds[idx]) / self.seconds_per_tick[idx])
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __repr__(self):
+        return 'TempoMap(n_tempos={}, resolution={})'.format(
+            len(self), self.resolution)
@@ -0,0 +1,201 @@
+"""
+Data augmentation transforms over note arrays.
+
+Transforms take an ``Instrument`` or a ``MidiObject`` and return a new one.
+Notes and meta events are copied, so that editing the result in place, e.g.
+with ``change_resolution``, leaves the input alone. Control event arrays are
+never changed in place and are shared with the input.
+"""
+from ugly_midi.midi_file import MidiObject
+from ugly_midi.instrument import Instrument, ColumnarInstrument, scale_notes
+from ugly_midi.containers import Note, TimeSignature, KeySignature
+from ugly_midi.containers import TempoChange
+import numpy as np
+
+
+def _with_notes(instr, notes=None):
+    """A copy of ``instr`` holding ``notes``, or a copy of the notes of
+    ``instr`` if ``notes`` is None"""
+    new = type(instr)(instr.program, instr.is_drum, instr.name)
+    new.control_changes = instr.control_changes
+    new.pitch_bends = instr.pitch_bends
+    new.aftertouches = instr.aftertouches
+    if notes is not None:
+        new.set_note_array(notes)
+    elif isinstance(instr, ColumnarInstrument):
+        new.set_note_array(instr.get_note_array().copy())
+    else:
+        new.notes = [
+            Note(n.velocity, n.pitch, n.start, n.end) for n in instr.notes
+        ]
+    return new
+
+
+def _with_instruments(midi, instruments):
+    """A copy of ``midi`` holding ``instruments`` and copies of its meta
+    events"""
+    new = MidiObject(resolution=midi.resolution)
+    new.tempo_changes = [
+        TempoChange(e.bpm, e.time) for e in midi.tempo_changes
+    ]
+    new.key_signatures = [
+        KeySignature(e.key, e.time) for e in midi.key_signatures
+    ]
+    new.time_signatures = [
+        TimeSignature(e.numerator, e.denominator, e.time)
+        for e in midi.time_signatures
+    ]
+    new.instruments = instruments
+    return new
+
+
+class Transform(object):
+    """Base class of the transforms, and the identity transform.
+
+    Subclasses override ``transform_notes``, which maps the ``NOTE_DTYPE``
+    array of one instrument to a new array, or returns the input array to
+    leave the notes unchanged.
+    """
+
+    def transform_notes(self, notes, instr):
+        return notes
+
+    def transform_instrument(self, instr):
+        notes = instr.get_note_array()
+        new_notes = self.transform_notes(notes, instr)
+        return _with_notes(instr, None if new_notes is notes else new_notes)
+
+    def transform_midi(self, midi):
+        return _with_instruments(
+            midi, [self.transform_instrument(i) for i in midi.instruments])
+
+    def __call__(self, obj):
+        if isinstance(obj, MidiObject):
+            return self.transform_midi(obj)
+        if isinstance(obj, Instrument):
+            return self.transform_instrument(obj)
+        raise TypeError('Expecting a MidiObject or an Instrument, got {}'.format(
+            type(obj).__name__))
+
+    def batch(self, objs):
+        """Applies the transform to every object of ``objs``"""
+        return [self(obj) for obj in objs]
+
+
+class Transpose(Transform):
+    """Shifts the pitch of all non-drum notes.
+    Parameters
+    ----------
+    semitones : int
+        Shift in semitones.
+    out_of_range : str
+        ``'clip'`` clips the shifted pitches to 0..127, ``'drop'`` removes
+        the notes shifted out of range.
+    """
+
+    def __init__(self, semitones, out_of_range='clip'):
+        if out_of_range not in ('clip', 'drop'):
+            raise ValueError(
+                'Unknown out_of_range {}. Expecting "clip" or "drop".'.format(
+                    out_of_range))
+        self.semitones = semitones
+        self.out_of_range = out_of_range
+
+    def transform_notes(self, notes, instr):
+        if instr.is_drum or not self.semitones:
+            return notes
+        pitch = notes['pitch'].astype(np.int64) + self.semitones
+        if self.out_of_range == 'drop':
+            keep = (pitch >= 0) & (pitch <= 127)
+            notes, pitch = notes[keep], pitch[keep]
+        else:
+            notes = notes.copy()
+        notes['pitch'] = np.clip(pitch, 0, 127)
+        return notes
+
+
+class TimeStretch(Transform):
+    """Scales note and meta event times by ``factor``, at the same
+    resolution and tempo. See ``instrument.scale_notes`` for ``policy``."""
+
+    def __init__(self, factor, policy='extend'):
+        if factor <= 0:
+            raise ValueError('factor must be positive')
+        self.factor = factor
+        self.policy = policy
+
+    def transform_notes(self, notes, instr):
+        return scale_notes(notes, self.factor, self.policy)[0]
+
+    def transform_instrument(self, instr):
+        new = Transform.transform_instrument(self, instr)
+        new._scale_controls(self.factor)
+        return new
+
+    def transform_midi(self, midi):
+        new = Transform.transform_midi(self, midi)
+        times = np.array(
+            [e.time for e in midi.tempo_changes + midi.key_signatures +
+             midi.time_signatures],
+            dtype=np.float64)
+        times = np.round(times * self.factor).astype(np.int64).tolist()
+        n_tempos, n_keys = len(midi.tempo_changes), len(midi.key_signatures)
+        new.tempo_changes = [
+            TempoChange(e.bpm, t)
+            for e, t in zip(midi.tempo_changes, times[:n_tempos])
+        ]
+        new.key_signatures = [
+            KeySignature(e.key, t)
+            for e, t in zip(midi.key_signatures,
+                            times[n_tempos:n_tempos + n_keys])
+        ]
+        new.time_signatures = [
+            TimeSignature(e.numerator, e.denominator, t)
+            for e, t in zip(midi.time_signatures, times[n_tempos + n_keys:])
+        ]
+        return new
+
+
+class VelocityCurve(Transform):
+    """Maps note velocities through a curve.
+    Parameters
+    ----------
+    curve : float, array_like or callable
+        A float is an exponent applied to the velocity scaled to 0..1, an
+        array of 128 values is a lookup table and a callable maps an array
+        of velocities to new velocities. Results are rounded and clipped to
+        1..127.
+    """
+
+    def __init__(self, curve):
+        if callable(curve):
+            self.table = curve(np.arange(128, dtype=np.float64))
+        elif np.ndim(curve) == 0:
+            self.table = 127 * (np.arange(128) / 127.)**curve
+        else:
+            self.table = np.asarray(curve, dtype=np.float64)
+        if self.table.shape != (128, ):
+            raise ValueError('curve must map the 128 velocities')
+        self.table = np.clip(np.round(self.table), 1, 127).astype(np.int16)
+
+    def transform_notes(self, notes, instr):
+        notes = notes.copy()
+        notes['velocity'] = self.table[np.clip(notes['velocity'], 0, 127)]
+        return notes
+
+
+class Compose(Transform):
+    """Applies ``transforms`` in order"""
+
+    def __init__(self, transforms):
+        self.transforms = list(transforms)
+
+    def transform_instrument(self, instr):
+        for t in self.transforms:
+            instr = t.transform_instrument(instr)
+        return instr
+
+    def transform_midi(self, midi):
+        for t in self.transforms:
+            midi = t.transform_midi(midi)
+        return midi